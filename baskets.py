@@ -0,0 +1,137 @@
+import math
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from data_access import file_fingerprint, load_transactions
+from model_cache import cached_model
+from rfm_engine import as_of_cutoff
+
+# What a basket is: one order, or everything a customer has bought
+BASKET_COLUMNS = {'OrderID': 'Order', 'CustomerID': 'Customer'}
+ITEM_COLUMN = 'ProductInformation'
+
+# Columns of the rule table, as mlxtend's association_rules names them
+RULE_COLUMNS = ['antecedents', 'consequents', 'antecedent support', 'consequent support',
+                'support', 'confidence', 'lift', 'leverage', 'conviction']
+
+
+def basket_matrix(transactions, basket='OrderID', item=ITEM_COLUMN):
+    """Sparse basket x item matrix with a True wherever the basket holds the item.
+
+    Returns {'matrix': CSR boolean matrix, 'items': item names by column}.
+    Memory grows with the distinct (basket, item) pairs, not with
+    baskets x items as a one-hot frame does.
+    """
+    rows, _ = pd.factorize(transactions[basket])
+    columns, items = pd.factorize(transactions[item], sort=True)
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, columns)),
+                               shape=(rows.max() + 1, len(items)))
+    # Items bought twice in one basket were summed into one cell
+    matrix.sum_duplicates()
+    return {'matrix': matrix, 'items': np.asarray(items, dtype=object)}
+
+
+def frequent_itemsets(matrix, items, min_support=0.01, max_len=3):
+    """Itemsets found in at least min_support of the baskets, like mlxtend's apriori.
+
+    Pairs are counted with one sparse co-occurrence product; larger
+    itemsets extend the frequent pairs depth first by intersecting sorted
+    basket lists (Eclat), so only the baskets holding a candidate are
+    touched. Returns a frame of support and itemsets (frozensets of item
+    names), ordered by itemset size.
+    """
+    n_baskets = matrix.shape[0]
+    min_count = max(math.ceil(min_support * n_baskets - 1e-9), 1)
+    columns = matrix.tocsc()
+    columns.sort_indices()
+    counts = np.diff(columns.indptr)
+    frequent = np.flatnonzero(counts >= min_count)
+    found = [((item,), counts[item]) for item in frequent]
+
+    if max_len is None or max_len >= 2:
+        kept = columns[:, frequent]
+        pairs = sparse.triu(kept.T.astype(np.int32) @ kept.astype(np.int32), k=1).tocsr()
+        baskets_of = lambda item: columns.indices[columns.indptr[item]:columns.indptr[item + 1]]
+
+        def extend(prefix, members):
+            # members: (item, baskets holding prefix + item), in column order
+            for i, (item, baskets) in enumerate(members):
+                itemset = prefix + (item,)
+                found.append((itemset, len(baskets)))
+                if max_len is not None and len(itemset) >= max_len:
+                    continue
+                larger = []
+                for other, other_baskets in members[i + 1:]:
+                    both = np.intersect1d(baskets, other_baskets, assume_unique=True)
+                    if len(both) >= min_count:
+                        larger.append((other, both))
+                extend(itemset, larger)
+
+        for a in range(len(frequent)):
+            start, end = pairs.indptr[a], pairs.indptr[a + 1]
+            partners = pairs.indices[start:end][pairs.data[start:end] >= min_count]
+            if len(partners):
+                first = baskets_of(frequent[a])
+                extend((frequent[a],), [
+                    (frequent[b], np.intersect1d(first, baskets_of(frequent[b]), assume_unique=True))
+                    for b in np.sort(partners)
+                ])
+
+    found.sort(key=lambda entry: len(entry[0]))
+    return pd.DataFrame({
+        'support': np.array([count for _, count in found], dtype=float) / n_baskets,
+        'itemsets': [frozenset(items[list(itemset)]) for itemset, _ in found],
+    })
+
+
+def association_rules(itemsets, min_confidence=0.5):
+    """Rules between frequent itemsets with the support, confidence and lift columns of mlxtend.
+
+    Every split of an itemset of two or more items into antecedents and
+    consequents is scored; rules below min_confidence are dropped.
+    """
+    support = dict(zip(itemsets['itemsets'], itemsets['support']))
+    antecedents, consequents = [], []
+    for itemset in itemsets['itemsets']:
+        for size in range(1, len(itemset)):
+            for left in combinations(sorted(itemset), size):
+                antecedents.append(frozenset(left))
+                consequents.append(itemset - frozenset(left))
+
+    both = np.array([support[left | right] for left, right in zip(antecedents, consequents)])
+    left = np.array([support[itemset] for itemset in antecedents])
+    right = np.array([support[itemset] for itemset in consequents])
+    confidence = both / np.maximum(left, 1e-12)
+    with np.errstate(divide='ignore'):
+        conviction = np.where(confidence < 1, (1 - right) / (1 - confidence), np.inf)
+    rules = pd.DataFrame(dict(zip(RULE_COLUMNS, [
+        antecedents, consequents, left, right, both, confidence,
+        confidence / np.maximum(right, 1e-12), both - left * right, conviction,
+    ])), columns=RULE_COLUMNS)
+    # Supports are count / baskets, so a confidence exactly at the threshold may round just below it
+    return rules[rules['confidence'] >= min_confidence - 1e-12].reset_index(drop=True)
+
+
+def basket_rules(path, as_of, basket='OrderID', min_support=0.01, min_confidence=0.5, max_len=3):
+    """Frequent itemsets and rules of the baskets bought up to as_of.
+
+    The basket matrix and the rules are cached per file version and as-of
+    date, so the transactions are only read when the settings change.
+    """
+    data_key = (*file_fingerprint(path), np.datetime64(as_of, 'D'))
+
+    def fit():
+        baskets = cached_model(('baskets', data_key, basket), lambda: basket_matrix(
+            load_transactions(path, columns=[basket, ITEM_COLUMN], end=as_of_cutoff(as_of)), basket))
+        itemsets = frequent_itemsets(baskets['matrix'], baskets['items'], min_support, max_len)
+        return {
+            'itemsets': itemsets,
+            'rules': association_rules(itemsets, min_confidence),
+            'baskets': baskets['matrix'].shape[0],
+            'items': len(baskets['items']),
+            'pairs': baskets['matrix'].nnz,
+        }
+    return cached_model(('basket_rules', data_key, basket, min_support, min_confidence, max_len), fit)
@@ -0,0 +1,537 @@
+import argparse
+import datetime as dt
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+
+import data_access
+import ingest
+from data_access import DATA_FILE, file_fingerprint, memory_report, read_columnar, read_transactions_csv, write_columnar
+from time_buckets import period_ends
+from rfm_engine import compute_rfm, purchase_history, rfm_history, segment_transitions, transactions_as_of
+import snapshot
+from snapshot import REVENUE_COLUMNS, RFM_COLUMNS, load_as_of_tables, purchase_date_range
+
+# Recency reference the pages hard-coded before the as-of setting
+LEGACY_REFERENCE_DATE = dt.datetime(2023, 7, 1)
+
+# One dashboard worker loading the transactions, parsed on its own heap or mapped
+WORKER_PROBE = '''
+import json, sys, time
+import data_access
+def resident():
+    status = dict(line.split(':', 1) for line in open('/proc/self/status'))
+    return {field: int(status[field].split()[0]) for field in ('RssAnon', 'RssFile')}
+path, cache_dir, mapped = sys.argv[1], sys.argv[2], sys.argv[3] == 'mapped'
+before = resident()
+start = time.perf_counter()
+if mapped:
+    frame = data_access.map_transactions(*data_access.file_fingerprint(path), cache_dir)
+else:
+    frame = data_access.read_transactions_csv(path)
+frame.sum(numeric_only=True)
+elapsed = time.perf_counter() - start
+after = resident()
+print(json.dumps({'seconds': elapsed, 'heap': after['RssAnon'] - before['RssAnon'],
+                  'shared': after['RssFile'] - before['RssFile']}))
+'''
+
+
+def make_transactions(n_customers, orders_per_customer=3, seed=0):
+    """Synthetic transactions shaped like rfm_data.csv."""
+    rng = np.random.default_rng(seed)
+    n_rows = n_customers * orders_per_customer
+    start = np.datetime64('2023-01-01')
+    return pd.DataFrame({
+        'CustomerID': rng.integers(0, n_customers, n_rows),
+        'PurchaseDate': pd.to_datetime(start + rng.integers(0, 180, n_rows).astype('timedelta64[D]')),
+        'TransactionAmount': rng.uniform(10, 1000, n_rows).round(2),
+        'ProductInformation': rng.choice(['Product A', 'Product B', 'Product C', 'Product D'], n_rows),
+        'OrderID': rng.integers(100000, 999999, n_rows),
+        'Location': rng.choice(['London', 'New York', 'Paris', 'Tokyo'], n_rows),
+    })
+
+
+def legacy_rfm(data, reference_date=LEGACY_REFERENCE_DATE):
+    # RFM computation as the pages did it before rfm_engine.compute_rfm
+    rfm = data.groupby('CustomerID').agg({
+        'PurchaseDate': lambda x: (reference_date - x.max()).days,
+        'OrderID': 'count',
+        'TransactionAmount': 'sum'
+    }).reset_index()
+    rfm.columns = ['CustomerID', 'Recency', 'Frequency', 'Monetary']
+    rfm = rfm[rfm['Monetary'] > 0]
+
+    rfm['R_Score'] = pd.qcut(rfm['Recency'], 4, ['1', '2', '3', '4'])
+    rfm['F_Score'] = pd.qcut(rfm['Frequency'].rank(method='first'), 4, ['4', '3', '2', '1'])
+    rfm['M_Score'] = pd.qcut(rfm['Monetary'], 4, ['4', '3', '2', '1'])
+    rfm['RFM_Score'] = rfm[['R_Score', 'F_Score', 'M_Score']].sum(axis=1).astype(int)
+
+    def rfm_segment(df):
+        if df['RFM_Score'] >= 9:
+            return 'Champions'
+        elif df['RFM_Score'] >= 8:
+            return 'Loyal Customers'
+        elif df['RFM_Score'] >= 7:
+            return 'Potential Loyalists'
+        elif df['RFM_Score'] >= 6:
+            return 'Recent Customers'
+        elif df['RFM_Score'] >= 5:
+            return 'Promising'
+        elif df['RFM_Score'] >= 4:
+            return 'Need Attention'
+        elif df['RFM_Score'] >= 3:
+            return 'At Risk'
+        else:
+            return 'Lost'
+
+    rfm['Segment'] = rfm.apply(rfm_segment, axis=1)
+    return rfm
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_rfm(args):
+    data = make_transactions(args.customers)
+    print(f"{len(data):,} transactions, {data['CustomerID'].nunique():,} customers")
+
+    new, new_time = timed(compute_rfm, data, LEGACY_REFERENCE_DATE)
+    print(f"compute_rfm: {new_time:.2f}s")
+    old, old_time = timed(legacy_rfm, data)
+    print(f"legacy:      {old_time:.2f}s")
+
+    # Summing the string scores concatenated their digits, so the legacy
+    # RFM_Score is the code and its segments were all Champions
+    old = old.rename(columns={'RFM_Score': 'RFM_Code'})
+    columns = new.columns.drop(['RFM_Score', 'Segment'])
+    pd.testing.assert_frame_equal(
+        new[columns].reset_index(drop=True),
+        old[columns].reset_index(drop=True),
+        check_dtype=False,
+    )
+    print(f"identical scores, speedup {old_time / new_time:.1f}x")
+
+
+def bench_history(args):
+    # Exports are chronological, so purchases are summed in the same order both ways
+    data = make_transactions(args.customers).sort_values('PurchaseDate', kind='stable', ignore_index=True)
+    first, last = data['PurchaseDate'].min(), data['PurchaseDate'].max()
+    dates = period_ends(first, last, args.granularity).astype(object)
+    print(f"{len(data):,} transactions, {len(dates)} as-of dates")
+
+    history, build_time = timed(purchase_history, data)
+    print(f"purchase_history: {build_time:.2f}s (once per file version)")
+    for scores in (False, True):
+        batch, batch_time = timed(rfm_history, history, dates, scores)
+        per_date, per_date_time = timed(
+            lambda: [compute_rfm(transactions_as_of(data, as_of), as_of, scores) for as_of in dates])
+        for as_of, expected in zip(dates, per_date):
+            block = batch[batch['AsOf'] == np.datetime64(as_of, 'D')].drop(columns='AsOf')
+            pd.testing.assert_frame_equal(
+                block.reset_index(drop=True), expected.reset_index(drop=True), check_dtype=False)
+        if scores:
+            segments = segment_transitions(batch)['To'].unique()
+            assert len(segments) > 1, f"every customer lands in {segments}"
+        label = 'with scores' if scores else 'R/F/M only '
+        print(f"{label}: rfm_history {batch_time:.2f}s, compute_rfm per date {per_date_time:.2f}s, "
+              f"identical output, speedup {per_date_time / batch_time:.1f}x")
+
+
+def rfm_features(n_customers, features):
+    # Scaled per-customer features of synthetic transactions, as the ML page builds them
+    from sklearn.preprocessing import StandardScaler
+    from rfm_engine import customer_features
+    data = make_transactions(n_customers)
+    ml_data = compute_rfm(data, scores=False).merge(customer_features(data), on='CustomerID')
+    return ml_data, StandardScaler().fit_transform(ml_data[features])
+
+
+def bench_dbscan(args):
+    from sklearn.cluster import DBSCAN
+    from sklearn.metrics import adjusted_rand_score
+    from ml_models import dbscan_segments, distinct_points, suggest_eps
+
+    features = tuple(args.features.split(','))
+    for n_customers in args.customers:
+        ml_data, X = rfm_features(n_customers, list(features))
+        key = ('bench', n_customers)
+        (points, distinct_time) = timed(distinct_points, key, ml_data, features, args.decimals)
+        suggestion, eps_time = timed(suggest_eps, key, ml_data, features, args.min_samples, args.decimals)
+        eps = suggestion['eps']
+        result, fit_time = timed(dbscan_segments, key, ml_data, features, eps, args.min_samples, args.decimals)
+        labels = result['labels']
+        print(f"{len(X):,} customers, {len(points['points']):,} distinct vectors, eps {eps:.3f}: "
+              f"dedup {distinct_time:.2f}s, eps {eps_time:.2f}s, DBSCAN {fit_time:.2f}s, "
+              f"{labels.max() + 1} clusters, {(labels < 0).mean():.1%} noise")
+
+        if len(X) > args.naive_max:
+            print(f"  plain DBSCAN skipped above {args.naive_max:,} customers")
+            continue
+        plain, plain_time = timed(lambda: DBSCAN(eps=eps, min_samples=args.min_samples).fit(X))
+        core = np.zeros(len(X), dtype=bool)
+        core[plain.core_sample_indices_] = True
+        agreement = f"adjusted Rand index {adjusted_rand_score(plain.labels_, labels):.4f}"
+        if args.decimals is None:
+            # Border points reachable from two clusters may join either one
+            same = ((core == result['core']).all() and ((plain.labels_ < 0) == (labels < 0)).all()
+                    and adjusted_rand_score(plain.labels_[core], labels[core]) == 1.0)
+            agreement += ', same core points, clusters and noise' if same else ', DIFFERENT core clusters'
+        print(f"  plain DBSCAN {plain_time:.2f}s, {agreement}, speedup {plain_time / fit_time:.1f}x")
+
+
+def bench_forecast(args):
+    from forecasting import forecast_panel, prophet_available, revenue_panel
+    from model_cache import clear_model_cache
+
+    # Split revenue into args.series synthetic stores
+    data = make_transactions(args.customers)
+    data['Store'] = data['CustomerID'] % args.series
+    panel, panel_time = timed(revenue_panel, data, 'Store', args.granularity)
+    print(f"{len(data):,} transactions -> {args.series} series x {len(panel['keys'])} periods "
+          f"in {panel_time:.2f}s (Prophet {'installed' if prophet_available() else 'missing'})")
+
+    serial = None
+    for n_jobs in sorted({1, os.cpu_count() or 1}):
+        clear_model_cache()
+        forecasts, fit_time = timed(forecast_panel, panel, args.granularity, args.horizon, n_jobs=n_jobs)
+        serial = serial or fit_time
+        print(f"{n_jobs} worker(s): {fit_time:.2f}s, speedup {serial / fit_time:.1f}x")
+    _, cached_time = timed(forecast_panel, panel, args.granularity, args.horizon)
+    print(f"cached rerun: {cached_time:.2f}s; models: {forecasts.groupby('Series')['Model'].first().value_counts().to_dict()}")
+
+
+def bench_baskets(args):
+    from mlxtend.frequent_patterns import apriori, association_rules as mlxtend_rules
+    from baskets import RULE_COLUMNS, association_rules, basket_matrix, frequent_itemsets
+
+    # Orders of a few items from a catalogue with a long tail of rare products
+    rng = np.random.default_rng(0)
+    popularity = 1 / np.arange(1, args.products + 1)
+    n_rows = args.orders * args.items_per_order
+    data = pd.DataFrame({
+        'OrderID': rng.integers(0, args.orders, n_rows),
+        'ProductInformation': rng.choice(args.products, n_rows, p=popularity / popularity.sum()),
+    })
+    baskets, build_time = timed(basket_matrix, data)
+    matrix = baskets['matrix']
+    sparse_bytes = matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    print(f"{matrix.shape[0]:,} orders x {matrix.shape[1]:,} products: CSR {sparse_bytes / 1e6:.1f} MB "
+          f"vs one-hot {matrix.shape[0] * matrix.shape[1] / 1e6:.1f} MB, built in {build_time:.2f}s")
+
+    itemsets, itemset_time = timed(frequent_itemsets, matrix, baskets['items'], args.min_support, args.max_len)
+    rules, rule_time = timed(association_rules, itemsets, args.min_confidence)
+    print(f"sparse: {len(itemsets):,} itemsets in {itemset_time:.2f}s, {len(rules):,} rules in {rule_time:.2f}s")
+
+    if matrix.shape[0] * matrix.shape[1] > args.dense_max:
+        print(f"  mlxtend skipped above {args.dense_max:,} one-hot cells")
+        return
+    onehot = pd.DataFrame(matrix.toarray(), columns=baskets['items'])
+    expected, apriori_time = timed(apriori, onehot, args.min_support, use_colnames=True, max_len=args.max_len,
+                                       low_memory=True)
+    # Same tolerance as association_rules: confidences exactly at the threshold are kept
+    expected_rules = mlxtend_rules(expected, num_itemsets=len(onehot), metric='confidence',
+                                   min_threshold=args.min_confidence - 1e-12)
+    by_items = lambda frame: dict(zip(frame['itemsets'], frame['support']))
+    by_rule = lambda frame: dict(zip(zip(frame['antecedents'], frame['consequents']),
+                                     frame[RULE_COLUMNS[2:]].to_numpy()))
+    found, wanted = by_items(itemsets), by_items(expected)
+    same = found.keys() == wanted.keys() and all(np.isclose(found[key], wanted[key]) for key in found)
+    found, wanted = by_rule(rules), by_rule(expected_rules)
+    same = same and found.keys() == wanted.keys() and all(np.allclose(found[key], wanted[key]) for key in found)
+    print(f"  mlxtend apriori {apriori_time:.2f}s, {'identical itemsets and rules' if same else 'DIFFERENT output'}, "
+          f"speedup {apriori_time / itemset_time:.1f}x")
+
+
+def bench_train(args):
+    from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
+    from sklearn.metrics import r2_score, roc_auc_score
+    from sklearn.model_selection import train_test_split
+    from ml_models import ENGINES, PREDICTION_FEATURES, PREDICTION_TARGETS, customer_table, labelled_customers, train_model
+
+    for n_customers in args.customers:
+        data = make_transactions(n_customers)
+        as_of = data['PurchaseDate'].max()
+        (labelled, current), feature_time = timed(
+            lambda: (labelled_customers(data, as_of, args.horizon), customer_table(data, as_of)))
+        print(f"{len(labelled):,} labelled customers, features in {feature_time:.2f}s")
+        for kind in args.kinds:
+            for engine in ENGINES:
+                result, total = timed(train_model, kind, engine, labelled, current)
+                stages = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in result['timings'].items())
+                metrics = ', '.join(f"{name} {value:.3f}" for name, value in result['metrics'].items())
+                print(f"  {kind} {engine}: {total:.2f}s ({stages}); {result['iterations']} iterations; {metrics}")
+
+            if len(labelled) > args.legacy_max:
+                print(f"  {kind} legacy random forest skipped above {args.legacy_max:,} customers")
+                continue
+            # The scikit-learn defaults: 100 full-depth trees on one core
+            X = labelled[PREDICTION_FEATURES].to_numpy(dtype=np.float64)
+            y = labelled[PREDICTION_TARGETS[kind]].to_numpy()
+            X_train, X_test, y_train, y_test = train_test_split(
+                X, y, test_size=0.2, random_state=42, stratify=y if kind == 'churn' else None)
+            model = RandomForestClassifier if kind == 'churn' else RandomForestRegressor
+            fitted, fit_time = timed(lambda: model(random_state=42).fit(X_train, y_train))
+            score = roc_auc_score(y_test, fitted.predict_proba(X_test)[:, 1]) if kind == 'churn' \
+                else r2_score(y_test, fitted.predict(X_test))
+            print(f"  {kind} legacy random forest: fit {fit_time:.2f}s; {'ROC AUC' if kind == 'churn' else 'R2'} {score:.3f}")
+
+
+def bench_charts(args):
+    import plotly.express as px
+    from charts import box_figure, histogram_figure, scatter_figure
+
+    rfm = compute_rfm(make_transactions(args.customers), LEGACY_REFERENCE_DATE)
+    rfm['Loyalty_Score'] = rfm['Frequency'] * 0.5 + rfm['Monetary'] * 0.3 + (100 - rfm['Recency']) * 0.2
+    print(f"{len(rfm):,} customers; figure JSON sent to the browser:")
+    charts = [
+        ('RFM score histogram', lambda: px.histogram(rfm, x='RFM_Score', nbins=20),
+         lambda: histogram_figure(rfm, 'RFM_Score', nbins=20)),
+        ('value vs recency scatter', lambda: px.scatter(rfm, x='Recency', y='Monetary', color='RFM_Score'),
+         lambda: scatter_figure(rfm, x='Recency', y='Monetary', color='RFM_Score')),
+        ('loyalty box plot', lambda: px.box(rfm, x='Segment', y='Loyalty_Score', color='Segment'),
+         lambda: box_figure(rfm, 'Segment', 'Loyalty_Score')),
+    ]
+    for name, plain, binned in charts:
+        (plain_json, plain_time), (binned_json, binned_time) = [
+            timed(lambda build=build: build().to_json()) for build in (plain, binned)]
+        print(f"  {name}: plotly express {len(plain_json) / 1e6:.2f} MB in {plain_time:.2f}s, "
+              f"binned {len(binned_json) / 1e6:.3f} MB in {binned_time:.2f}s")
+
+
+def bench_as_of(args):
+    first, last = purchase_date_range(args.data)
+    dates = [last - dt.timedelta(days=step) for step in range(0, (last - first).days, args.step)]
+    dates.append(last + dt.timedelta(days=30))
+    print(f"{len(dates)} as-of dates from {dates[-2]} to {dates[-1]}")
+    for label in ('first pass', 'second pass'):
+        times = [timed(load_as_of_tables, as_of, args.data)[1] for as_of in dates]
+        print(f"{label}: {sum(times):.3f}s total, {max(times) * 1000:.1f}ms slowest")
+
+
+def bench_incremental(args):
+    # Appends arrive in purchase order, as from the nightly export
+    data = make_transactions(args.customers).sort_values('PurchaseDate', kind='stable', ignore_index=True)
+    batches = np.array_split(np.arange(len(data)), args.batches)
+    print(f"{len(data):,} transactions appended in {args.batches} batches")
+    with tempfile.TemporaryDirectory() as directory:
+        path, state_dir = os.path.join(directory, 'rfm_data.csv'), os.path.join(directory, 'state')
+        data.iloc[batches[0]].to_csv(path, index=False)
+        update_time = 0.0
+        for rows in batches[1:]:
+            update_time += timed(ingest.update_state, path, state_dir)[1]
+            data.iloc[rows].to_csv(path, mode='a', header=False, index=False)
+        (state, _, _), last_time = timed(ingest.update_state, path, state_dir)
+        incremental = ingest.state_tables(state)
+        full, full_time = timed(lambda: snapshot.build_tables(read_transactions_csv(path)))
+
+    for name, expected in full.items():
+        pd.testing.assert_frame_equal(
+            incremental[name].reset_index(drop=True), expected.reset_index(drop=True),
+            check_dtype=False, check_categorical=False, check_exact=True)
+    print(f"incremental: {update_time + last_time:.2f}s over all batches, {last_time:.2f}s for the last; "
+          f"full recompute {full_time:.2f}s; identical tables")
+
+
+def bench_sessions(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'transactions.csv')
+        make_transactions(args.customers).to_csv(path, index=False)
+        first, last = purchase_date_range(path, tmp)
+        dates = [last - dt.timedelta(days=30 * step) for step in range(1, args.dates + 1)]
+        print(f"{args.sessions} sessions each loading {len(dates)} as-of dates of {args.customers:,} customers")
+
+        # Before: lru_cache around the same function, so concurrent misses each compute
+        calls = []
+        def legacy_tables(*key):
+            calls.append(key)
+            return snapshot._as_of_tables.__wrapped__(*key)
+        legacy = lru_cache(maxsize=snapshot.AS_OF_CACHE_SIZE)(legacy_tables)
+        keys = [(*file_fingerprint(path), tmp, as_of) for as_of in dates]
+        with ThreadPoolExecutor(args.sessions) as pool:
+            _, legacy_time = timed(lambda: list(pool.map(lambda _: [legacy(*key) for key in keys],
+                                                         range(args.sessions))))
+        print(f"  lru_cache: {legacy_time:.2f}s, {len(calls)} computations")
+
+        before = snapshot._as_of_tables.cache_info()
+        with ThreadPoolExecutor(args.sessions) as pool:
+            _, shared_time = timed(lambda: list(pool.map(
+                lambda _: [load_as_of_tables(as_of, path, tmp) for as_of in dates], range(args.sessions))))
+        after = snapshot._as_of_tables.cache_info()
+        counts = {name: after[name] - before[name] for name in ('misses', 'waits', 'hits', 'disk_hits')}
+        print(f"  shared cache: {shared_time:.2f}s, {counts['misses']} computations "
+              f"({counts['disk_hits']} from disk), {counts['waits']} waited, {counts['hits']} hits")
+
+
+def scanned_bytes(path, columns, start=None, end=None, locations=None):
+    # Compressed bytes of the column chunks a filtered Parquet read has to fetch
+    dataset = ds.dataset(path, format='parquet', partitioning='hive' if os.path.isdir(path) else None)
+    # Partitions are pruned by the whole filter, row groups by the date range in their files
+    date_filter = data_access._row_filter(dataset.schema, start, end, None)
+    total = 0
+    for fragment in dataset.get_fragments(filter=data_access._row_filter(dataset.schema, start, end, locations)):
+        metadata = fragment.metadata
+        names = [metadata.schema.column(i).name for i in range(metadata.num_columns)]
+        wanted = [i for i, name in enumerate(names) if name in columns]
+        for group in fragment.split_by_row_group(date_filter):
+            for row_group in group.row_groups:
+                chunks = metadata.row_group(row_group.id)
+                total += sum(chunks.column(i).total_compressed_size for i in wanted)
+    return total
+
+
+def bench_columnar(args):
+    data = make_transactions(args.customers)
+    # Spread the purchases over several years, as in a long-running export
+    data['PurchaseDate'] = np.datetime64('2020-01-01') + np.random.default_rng(1).integers(
+        0, args.days, len(data)).astype('timedelta64[D]')
+    with tempfile.TemporaryDirectory() as tmp:
+        csv = os.path.join(tmp, 'transactions.csv')
+        data.to_csv(csv, index=False)
+        parquet = os.path.join(tmp, 'transactions.parquet')
+        partitioned = os.path.join(tmp, 'by_location')
+        write_columnar(csv, parquet)
+        write_columnar(csv, partitioned, partition_by='Location')
+        csv_bytes = os.path.getsize(csv)
+        print(f"{len(data):,} transactions over {args.days} days: CSV {csv_bytes / 1e6:.1f} MB, "
+              f"Parquet {file_fingerprint(parquet)[2] / 1e6:.1f} MB")
+
+        _, csv_time = timed(read_transactions_csv, csv)
+        print(f"  whole CSV, every page: {csv_time:.2f}s, {csv_bytes / 1e6:.1f} MB")
+        last = data['PurchaseDate'].max()
+        reads = [
+            ('Revenue page columns', parquet, REVENUE_COLUMNS, {}),
+            (f'RFM columns, last {args.window} days', parquet, RFM_COLUMNS,
+             {'start': last - np.timedelta64(args.window - 1, 'D')}),
+            ('every column, one location', partitioned, list(data.columns), {'locations': ['Tokyo']}),
+        ]
+        for label, path, columns, filters in reads:
+            frame, read_time = timed(read_columnar, path, columns, **filters)
+            expected = data_access.select_transactions(
+                data, columns, filters.get('start'), None, filters.get('locations'))
+            assert len(frame) == len(expected), (label, len(frame), len(expected))
+            nbytes = scanned_bytes(path, columns, filters.get('start'), None, filters.get('locations'))
+            print(f"  {label}: {read_time:.2f}s, {nbytes / 1e6:.1f} MB "
+                  f"({nbytes / csv_bytes:.0%} of the CSV), {len(frame):,} rows")
+
+
+def bench_workers(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'transactions.csv')
+        make_transactions(args.customers).to_csv(path, index=False)
+        print(f"{args.workers} workers loading {args.customers * 3:,} transactions "
+              f"({os.path.getsize(path) / 1e6:.0f} MB of CSV)")
+        for mode in ('parsed', 'mapped', 'mapped'):
+            procs = [subprocess.Popen([sys.executable, '-c', WORKER_PROBE, path, os.path.join(tmp, 'cache'), mode],
+                                      stdout=subprocess.PIPE, text=True) for _ in range(args.workers)]
+            runs = [json.loads(proc.communicate()[0].strip().splitlines()[-1]) for proc in procs]
+            heap = sum(run['heap'] for run in runs) / 1024
+            shared = max(run['shared'] for run in runs) / 1024
+            # The second mapped round finds the Arrow copy already written
+            print(f"  {mode}: {max(run['seconds'] for run in runs):.2f}s slowest, "
+                  f"{heap / args.workers:.0f} MB of heap per worker ({heap:.0f} MB in all), "
+                  f"up to {shared:.0f} MB mapped from the shared page cache")
+
+
+def bench_memory(args):
+    print(memory_report(args.data).to_string())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RFM Dashboard benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rfm_parser = commands.add_parser('rfm', help='compute_rfm vs the legacy per-customer lambdas')
+    rfm_parser.add_argument('--customers', type=int, default=1_000_000)
+    rfm_parser.set_defaults(func=bench_rfm)
+
+    history_parser = commands.add_parser('history', help='rfm_history vs compute_rfm once per as-of date')
+    history_parser.add_argument('--customers', type=int, default=1_000_000)
+    history_parser.add_argument('--granularity', default='W', help='D, W, M or Q between as-of dates')
+    history_parser.set_defaults(func=bench_history)
+
+    dbscan_parser = commands.add_parser('dbscan', help='deduplicated KD-tree DBSCAN vs plain DBSCAN')
+    dbscan_parser.add_argument('--customers', type=int, nargs='+', default=[100_000, 1_000_000])
+    dbscan_parser.add_argument('--features', default='Recency,Frequency,Tenure,ProductVariety')
+    dbscan_parser.add_argument('--min-samples', type=int, default=10)
+    dbscan_parser.add_argument('--decimals', type=int, default=None, help='round scaled values before deduplicating')
+    dbscan_parser.add_argument('--naive-max', type=int, default=200_000, help='largest run of plain DBSCAN')
+    dbscan_parser.set_defaults(func=bench_dbscan)
+
+    forecast_parser = commands.add_parser('forecast', help='per-series revenue forecasts on one core vs all cores')
+    forecast_parser.add_argument('--customers', type=int, default=100_000)
+    forecast_parser.add_argument('--series', type=int, default=24)
+    forecast_parser.add_argument('--granularity', default='D', help='D, W, M or Q')
+    forecast_parser.add_argument('--horizon', type=int, default=14)
+    forecast_parser.set_defaults(func=bench_forecast)
+
+    baskets_parser = commands.add_parser('baskets', help='sparse Eclat itemsets vs mlxtend apriori on a one-hot frame')
+    baskets_parser.add_argument('--orders', type=int, default=200_000)
+    baskets_parser.add_argument('--products', type=int, default=2_000)
+    baskets_parser.add_argument('--items-per-order', type=int, default=4)
+    baskets_parser.add_argument('--min-support', type=float, default=0.001)
+    baskets_parser.add_argument('--min-confidence', type=float, default=0.1)
+    baskets_parser.add_argument('--max-len', type=int, default=3)
+    baskets_parser.add_argument('--dense-max', type=int, default=50_000_000, help='largest one-hot frame for mlxtend')
+    baskets_parser.set_defaults(func=bench_baskets)
+
+    train_parser = commands.add_parser('train', help='churn and CLV training per engine vs the default random forest')
+    train_parser.add_argument('--customers', type=int, nargs='+', default=[100_000, 1_000_000])
+    train_parser.add_argument('--kinds', nargs='+', default=['churn', 'clv'], choices=['churn', 'clv'])
+    train_parser.add_argument('--horizon', type=int, default=30, help='days after the training cut-off')
+    train_parser.add_argument('--legacy-max', type=int, default=100_000, help='largest run of the default random forest')
+    train_parser.set_defaults(func=bench_train)
+
+    charts_parser = commands.add_parser('charts', help='figure size with server-side binning vs raw plotly express')
+    charts_parser.add_argument('--customers', type=int, default=1_000_000)
+    charts_parser.set_defaults(func=bench_charts)
+
+    as_of_parser = commands.add_parser('as-of', help='RFM for a sweep of as-of dates, cold and cached')
+    as_of_parser.add_argument('--data', default=DATA_FILE)
+    as_of_parser.add_argument('--step', type=int, default=7, help='days between as-of dates')
+    as_of_parser.set_defaults(func=bench_as_of)
+
+    incremental_parser = commands.add_parser('incremental', help='tables folded batch by batch vs recomputed from the whole file')
+    incremental_parser.add_argument('--customers', type=int, default=200_000)
+    incremental_parser.add_argument('--batches', type=int, default=5)
+    incremental_parser.set_defaults(func=bench_incremental)
+
+    sessions_parser = commands.add_parser('sessions', help='concurrent sessions loading as-of tables, lru_cache vs shared cache')
+    sessions_parser.add_argument('--customers', type=int, default=200_000)
+    sessions_parser.add_argument('--sessions', type=int, default=8)
+    sessions_parser.add_argument('--dates', type=int, default=3, help='as-of dates, a month apart, per session')
+    sessions_parser.set_defaults(func=bench_sessions)
+
+    columnar_parser = commands.add_parser('columnar', help='bytes and time to load page columns from CSV vs Parquet')
+    columnar_parser.add_argument('--customers', type=int, default=1_000_000)
+    columnar_parser.add_argument('--days', type=int, default=4 * 365, help='days of purchase history')
+    columnar_parser.add_argument('--window', type=int, default=90, help='days read by the date-filtered load')
+    columnar_parser.set_defaults(func=bench_columnar)
+
+    workers_parser = commands.add_parser('workers', help='resident memory of worker processes parsing vs mapping the transactions')
+    workers_parser.add_argument('--customers', type=int, default=1_000_000)
+    workers_parser.add_argument('--workers', type=int, default=4)
+    workers_parser.set_defaults(func=bench_workers)
+
+    memory_parser = commands.add_parser('memory', help='bytes per column before and after the load schema')
+    memory_parser.add_argument('--data', default=DATA_FILE)
+    memory_parser.set_defaults(func=bench_memory)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+# Scatter plots send every point as SVG up to POINT_LIMIT points and as
+# WebGL (Scattergl) up to WEBGL_LIMIT; above that they become a density
+# grid of GRID_BINS x GRID_BINS cells, or a WebGL sample of WEBGL_LIMIT
+# points when coloured by category. px.scatter would itself switch to WebGL
+# above 1,000 points, so both modes are passed explicitly.
+POINT_LIMIT = 1_000
+WEBGL_LIMIT = 200_000
+GRID_BINS = 120
+
+# Whiskers reach the furthest value within this many interquartile ranges of the box
+WHISKER_IQR = 1.5
+
+
+def histogram_bins(values, nbins=30):
+    """Equal-width bins of values: left and right edges, centre and count per bin."""
+    values = np.asarray(values, dtype=np.float64)
+    counts, edges = np.histogram(values[~np.isnan(values)], bins=nbins)
+    return pd.DataFrame({
+        'left': edges[:-1],
+        'right': edges[1:],
+        'center': (edges[:-1] + edges[1:]) / 2,
+        'count': counts,
+    })
+
+
+def histogram_figure(frame, column, nbins=30, title=None, color=None):
+    """Histogram of a column, binned here so only the bin counts reach the browser."""
+    bins = histogram_bins(frame[column], nbins)
+    fig = go.Figure(go.Bar(
+        x=bins['center'], y=bins['count'], width=bins['right'] - bins['left'],
+        marker_color=color, customdata=bins[['left', 'right']],
+        hovertemplate=f'{column}: %{{customdata[0]:,.4g}} to %{{customdata[1]:,.4g}}<br>count: %{{y:,}}<extra></extra>',
+    ))
+    fig.update_layout(title=title, xaxis_title=column, yaxis_title='count', bargap=0)
+    return fig
+
+
+def density_grid(x, y, bins=GRID_BINS):
+    """Points per cell of a bins x bins grid: {'x', 'y': cell centres, 'counts': y by x array}."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+    return {
+        'x': (x_edges[:-1] + x_edges[1:]) / 2,
+        'y': (y_edges[:-1] + y_edges[1:]) / 2,
+        'counts': counts.T,
+    }
+
+
+def density_figure(frame, x, y, title=None, bins=GRID_BINS):
+    """Heatmap of how many points fall in each cell; empty cells are left blank."""
+    grid = density_grid(frame[x], frame[y], bins)
+    fig = go.Figure(go.Heatmap(
+        x=grid['x'], y=grid['y'], z=np.where(grid['counts'] > 0, grid['counts'], np.nan),
+        colorscale='Viridis', colorbar_title='Points',
+        hovertemplate=f'{x}: %{{x:,.4g}}<br>{y}: %{{y:,.4g}}<br>points: %{{z:,}}<extra></extra>',
+    ))
+    fig.update_layout(title=title, xaxis_title=x, yaxis_title=y)
+    return fig
+
+
+def scatter_figure(frame, x, y, color=None, title=None, **kwargs):
+    """px.scatter that stays light in the browser however many rows frame has.
+
+    Up to POINT_LIMIT rows this is a plain scatter and up to WEBGL_LIMIT a
+    WebGL one. Larger frames become a density grid, or, with a categorical
+    color, a WebGL scatter of a per-category sample of WEBGL_LIMIT rows.
+    """
+    rows = len(frame)
+    if rows <= POINT_LIMIT:
+        return px.scatter(frame, x=x, y=y, color=color, title=title, render_mode='svg', **kwargs)
+    if rows <= WEBGL_LIMIT:
+        return px.scatter(frame, x=x, y=y, color=color, title=title, render_mode='webgl', **kwargs)
+    if color is None or pd.api.types.is_numeric_dtype(frame[color]):
+        return density_figure(frame, x, y, title=f'{title} (density of {rows:,} points)')
+    sample = frame.groupby(color, observed=True, group_keys=False).sample(
+        frac=WEBGL_LIMIT / rows, random_state=0)
+    return px.scatter(sample, x=x, y=y, color=color, render_mode='webgl',
+                      title=f'{title} (sample of {len(sample):,} of {rows:,} points)', **kwargs)
+
+
+def box_stats(frame, group, value):
+    """Box plot statistics per group: quartiles, whisker ends and count.
+
+    Whiskers end at the furthest values within WHISKER_IQR interquartile
+    ranges of the box, as Plotly draws them from raw points.
+    """
+    groups = frame[group]
+    values = frame[value]
+    grouped = values.groupby(groups, observed=True)
+    quartiles = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+    spread = WHISKER_IQR * (quartiles[0.75] - quartiles[0.25])
+    low = groups.map(quartiles[0.25] - spread).astype(np.float64)
+    high = groups.map(quartiles[0.75] + spread).astype(np.float64)
+    inside = (values >= low) & (values <= high)
+    whiskers = values[inside].groupby(groups[inside], observed=True)
+    return pd.DataFrame({
+        'q1': quartiles[0.25],
+        'median': quartiles[0.5],
+        'q3': quartiles[0.75],
+        'lowerfence': whiskers.min(),
+        'upperfence': whiskers.max(),
+        'count': grouped.size(),
+    })
+
+
+def box_figure(frame, group, value, title=None, colors=None):
+    """Box plot per group drawn from box_stats, so no raw points are sent; outliers are not drawn."""
+    stats = box_stats(frame, group, value)
+    colors = colors or px.colors.qualitative.Plotly
+    fig = go.Figure()
+    for i, (name, row) in enumerate(stats.iterrows()):
+        fig.add_trace(go.Box(
+            x=[name], name=str(name), q1=[row['q1']], median=[row['median']], q3=[row['q3']],
+            lowerfence=[row['lowerfence']], upperfence=[row['upperfence']],
+            marker_color=colors[i % len(colors)], boxpoints=False,
+        ))
+    fig.update_layout(title=title, xaxis_title=group, yaxis_title=value)
+    return fig
@@ -0,0 +1,275 @@
+import argparse
+import contextlib
+import glob
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from shared_cache import file_lock, shared_cache
+
+# Default transaction export used by every page: a CSV, or a Parquet or Arrow
+# IPC file or Parquet directory written by write_columnar
+DATA_FILE = os.environ.get('RFM_DATA_FILE', 'rfm_data.csv')
+
+# Column types of the transaction export, applied while reading. Repeated
+# labels are categorical; amounts stay float64 so monetary sums keep their cents.
+TRANSACTION_DTYPES = {
+    'CustomerID': 'int64',
+    'TransactionAmount': 'float64',
+    'ProductInformation': 'category',
+    'OrderID': 'int64',
+    'Location': 'category',
+}
+DATE_COLUMNS = ['PurchaseDate']
+DATE_FORMAT = 'ISO8601'
+# Id columns are downcast to the smallest integer type holding their values
+ID_COLUMNS = ['CustomerID', 'OrderID']
+
+# Columnar formats by file extension; a directory is a (Hive-partitioned) Parquet dataset
+COLUMNAR_FORMATS = {'.parquet': 'parquet', '.pq': 'parquet', '.feather': 'ipc', '.arrow': 'ipc', '.ipc': 'ipc'}
+# Rows per row group written by write_columnar. The rows are sorted by date,
+# so each group spans a short date range that date filters can skip whole.
+ROW_GROUP_ROWS = 128 * 1024
+
+# Parsed CSV transactions, kept as uncompressed Arrow IPC files that every
+# server and worker process on the host memory-maps instead of parsing
+TRANSACTION_CACHE_DIR = 'transaction_cache'
+
+
+def read_transactions_csv(source, **kwargs):
+    """pd.read_csv with the transaction schema applied."""
+    frame = pd.read_csv(
+        source,
+        dtype=TRANSACTION_DTYPES,
+        parse_dates=DATE_COLUMNS,
+        date_format=DATE_FORMAT,
+        **kwargs,
+    )
+    return apply_schema(frame)
+
+
+def apply_schema(frame):
+    """Downcast the integer id columns of a freshly read transaction frame."""
+    for column in ID_COLUMNS:
+        if column in frame:
+            frame[column] = pd.to_numeric(frame[column], downcast='integer')
+    return frame
+
+
+def memory_report(path=DATA_FILE):
+    """Bytes per column of the transaction file read naively vs with the schema."""
+    naive = pd.read_csv(path)
+    naive['PurchaseDate'] = pd.to_datetime(naive['PurchaseDate'])
+    typed = load_transactions(path)
+    report = pd.DataFrame({
+        'naive_dtype': naive.dtypes.astype(str),
+        'naive_bytes': naive.memory_usage(deep=True, index=False),
+        'typed_dtype': typed.dtypes.astype(str),
+        'typed_bytes': typed.memory_usage(deep=True, index=False),
+    })
+    report.loc['Total'] = ['', report['naive_bytes'].sum(), '', report['typed_bytes'].sum()]
+    report['ratio'] = (report['naive_bytes'] / report['typed_bytes']).round(2)
+    return report
+
+
+def file_fingerprint(path=DATA_FILE):
+    """Return (absolute path, mtime_ns, size) identifying the current file version.
+
+    For a dataset directory these are the latest mtime and the total size of
+    the directory tree, so adding, removing or rewriting a file changes them.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    if not os.path.isdir(path):
+        return path, stat.st_mtime_ns, stat.st_size
+    mtime_ns, size = stat.st_mtime_ns, 0
+    for root, _, names in os.walk(path):
+        mtime_ns = max(mtime_ns, os.stat(root).st_mtime_ns)
+        for name in names:
+            entry = os.stat(os.path.join(root, name))
+            mtime_ns, size = max(mtime_ns, entry.st_mtime_ns), size + entry.st_size
+    return path, mtime_ns, size
+
+
+def transaction_format(path):
+    """'csv', 'parquet' or 'ipc' (Feather / Arrow IPC) for a transaction file, from its extension."""
+    if os.path.isdir(path):
+        return 'parquet'
+    return COLUMNAR_FORMATS.get(os.path.splitext(path)[1].lower(), 'csv')
+
+
+def _dataset(path):
+    partitioning = 'hive' if os.path.isdir(path) else None
+    return ds.dataset(path, format=transaction_format(path), partitioning=partitioning)
+
+
+def _row_filter(schema, start, end, locations):
+    # Dataset expression for start <= PurchaseDate < end and Location in locations, or None
+    conditions = []
+    date_type = schema.field('PurchaseDate').type
+    if start is not None:
+        conditions.append(ds.field('PurchaseDate') >= pa.scalar(np.datetime64(start, 'ns')).cast(date_type))
+    if end is not None:
+        conditions.append(ds.field('PurchaseDate') < pa.scalar(np.datetime64(end, 'ns')).cast(date_type))
+    if locations is not None:
+        conditions.append(ds.field('Location').isin(list(locations)))
+    if not conditions:
+        return None
+    expression = conditions[0]
+    for condition in conditions[1:]:
+        expression = expression & condition
+    return expression
+
+
+def _arrow_frame(table):
+    # Apply the CSV schema to rows read from a columnar file, whatever types its writer used
+    frame = table.to_pandas()
+    if 'PurchaseDate' in frame:
+        frame['PurchaseDate'] = pd.to_datetime(frame['PurchaseDate'])
+    frame = frame.astype({column: dtype for column, dtype in TRANSACTION_DTYPES.items() if column in frame})
+    for column in frame.select_dtypes('category'):
+        # Same categories as read_csv: the values present, sorted
+        categories = frame[column].cat.remove_unused_categories().cat.categories
+        frame[column] = frame[column].cat.set_categories(categories.sort_values())
+    return apply_schema(frame)
+
+
+def read_columnar(path, columns=None, start=None, end=None, locations=None):
+    """Read the given columns of the rows with start <= PurchaseDate < end and Location in locations.
+
+    Only the requested columns are read. Parquet row groups whose
+    PurchaseDate or Location statistics fall outside the filters, and
+    partitions of other locations, are skipped without being read. Arrow
+    IPC files have no statistics, so their rows are filtered after reading.
+    """
+    dataset = _dataset(path)
+    return _arrow_frame(dataset.to_table(columns=columns, filter=_row_filter(dataset.schema, start, end, locations)))
+
+
+def iter_columnar(path, columns=None, start=None, end=None, locations=None, batch_rows=ROW_GROUP_ROWS):
+    """read_columnar in frames of at most batch_rows rows, for files too large to load at once."""
+    dataset = _dataset(path)
+    batches = dataset.to_batches(columns=columns, filter=_row_filter(dataset.schema, start, end, locations),
+                                 batch_size=batch_rows)
+    for batch in batches:
+        if batch.num_rows:
+            yield _arrow_frame(pa.Table.from_batches([batch]))
+
+
+def select_transactions(transactions, columns=None, start=None, end=None, locations=None):
+    """The rows and columns of a loaded frame that read_columnar would have read."""
+    rows = np.ones(len(transactions), dtype=bool)
+    if start is not None:
+        rows &= (transactions['PurchaseDate'] >= start).to_numpy()
+    if end is not None:
+        rows &= (transactions['PurchaseDate'] < end).to_numpy()
+    if locations is not None:
+        rows &= transactions['Location'].isin(locations).to_numpy()
+    if not rows.all():
+        transactions = transactions[rows]
+    return transactions if columns is None else transactions[list(columns)]
+
+
+def _write_arrow(transactions, out_path):
+    table = pa.Table.from_pandas(transactions, preserve_index=False)
+    # One record batch, so every column maps as one contiguous buffer
+    tmp = f'{out_path}.{os.getpid()}.tmp'
+    feather.write_feather(table, tmp, compression='uncompressed', chunksize=max(table.num_rows, 1))
+    os.replace(tmp, out_path)
+
+
+def map_transactions(path, mtime_ns, size, cache_dir=TRANSACTION_CACHE_DIR):
+    """The parsed CSV at path as a frame over a memory-mapped Arrow IPC copy.
+
+    The first process to ask parses the CSV and writes the copy to
+    cache_dir while the others wait on its lock; every process then maps the
+    same file, so the rows live once in the page cache instead of once per
+    process heap. Copies of older versions of the file are deleted. The
+    frame's columns are read-only views of the mapping.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    source = hashlib.sha1(path.encode()).hexdigest()[:16]
+    version = hashlib.sha1(repr((mtime_ns, size, TRANSACTION_DTYPES, ID_COLUMNS)).encode()).hexdigest()[:16]
+    cache_path = os.path.join(cache_dir, f'{source}-{version}.arrow')
+    if not os.path.exists(cache_path):
+        with file_lock(os.path.join(cache_dir, f'{source}.lock')):
+            if not os.path.exists(cache_path):
+                _write_arrow(read_transactions_csv(path), cache_path)
+                for stale in glob.glob(os.path.join(cache_dir, f'{source}-*.arrow')):
+                    # Processes still mapping a stale copy keep it until they let go (not on Windows)
+                    if stale != cache_path:
+                        with contextlib.suppress(OSError):
+                            os.remove(stale)
+    with pa.memory_map(cache_path) as mapped:
+        # split_blocks keeps each column as its own block, so pandas does not copy them into one
+        return feather.read_table(mapped, memory_map=True).to_pandas(split_blocks=True)
+
+
+# Parsed once per file version by the first process, then mapped by all of them
+@shared_cache(maxsize=4, disk_dir=None)
+def _read_transactions(path, mtime_ns, size):
+    # mtime_ns and size are only part of the cache key: a rewritten file misses
+    return map_transactions(path, mtime_ns, size)
+
+
+@shared_cache(maxsize=8, disk_dir=None)
+def _read_columnar(path, mtime_ns, size, columns, start, end, locations):
+    return read_columnar(path, None if columns is None else list(columns), start, end, locations)
+
+
+def load_transactions(path=DATA_FILE, columns=None, start=None, end=None, locations=None):
+    """Load the transactions, or only some columns of the rows with start <= PurchaseDate < end and Location in locations.
+
+    Parquet and Arrow IPC files read just that selection (see
+    read_columnar). A CSV has no columns or row groups to skip, so it is
+    parsed whole once per file version and the selection is made in
+    memory. Either way each selection is cached per file version. The
+    returned frame is shared between callers and reruns, so pages must
+    treat it as read-only and copy before adding columns.
+    """
+    fingerprint = file_fingerprint(path)
+    start, end = (None if date is None else np.datetime64(date, 'ns') for date in (start, end))
+    if transaction_format(path) == 'csv':
+        return select_transactions(_read_transactions(*fingerprint), columns, start, end, locations)
+    return _read_columnar(*fingerprint, None if columns is None else tuple(columns), start, end,
+                          None if locations is None else tuple(sorted(locations)))
+
+
+def write_columnar(path, out_path, partition_by=None, row_group_rows=ROW_GROUP_ROWS):
+    """Convert a transaction CSV to Parquet, or Arrow IPC for a .feather, .arrow or .ipc out_path.
+
+    Rows are sorted by PurchaseDate so each row group covers a short date
+    range. With partition_by (e.g. 'Location') out_path becomes a
+    Hive-partitioned Parquet directory with one folder per value.
+    """
+    transactions = read_transactions_csv(path).sort_values('PurchaseDate', kind='stable', ignore_index=True)
+    table = pa.Table.from_pandas(transactions, preserve_index=False)
+    if partition_by is not None:
+        ds.write_dataset(table, out_path, format='parquet', partitioning=[partition_by],
+                         partitioning_flavor='hive', max_rows_per_group=row_group_rows,
+                         existing_data_behavior='delete_matching')
+    elif transaction_format(out_path) == 'ipc':
+        feather.write_feather(table, out_path, compression='uncompressed', chunksize=row_group_rows)
+    else:
+        pq.write_table(table, out_path, row_group_size=row_group_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert a transaction CSV to Parquet or Arrow IPC')
+    parser.add_argument('csv', help='transaction CSV to convert')
+    parser.add_argument('out', help='.parquet, .feather/.arrow/.ipc file, or directory with --partition-by')
+    parser.add_argument('--partition-by', help='column to partition a Parquet directory by, e.g. Location')
+    parser.add_argument('--row-group-rows', type=int, default=ROW_GROUP_ROWS)
+    args = parser.parse_args()
+    write_columnar(args.csv, args.out, args.partition_by, args.row_group_rows)
+    print(f"{args.csv} -> {args.out} ({transaction_format(args.out)})")
+
+
+if __name__ == '__main__':
+    main()
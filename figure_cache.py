@@ -0,0 +1,31 @@
+from model_cache import SizedLRU
+
+# Upper bound on the serialized size of the cached figures
+FIGURE_CACHE_BYTES = 64 * 1024 * 1024
+
+# Figures are sized by their JSON spec, which is what reaches the browser
+_figures = SizedLRU(FIGURE_CACHE_BYTES, lambda figure: len(figure.to_json()))
+
+
+def cached_figure(key, build, max_bytes=FIGURE_CACHE_BYTES):
+    """Return the Plotly figure stored under key, calling build() and storing its result on a miss.
+
+    key must name everything the figure shows: the chart, the data version
+    (file fingerprint and as-of date) and any setting that changes it, but
+    not settings the figure ignores, so switching those costs nothing.
+    Entries are sized by their JSON spec and the least recently used are
+    evicted beyond max_bytes. Figures are shared between reruns and
+    sessions: build() must apply every layout change, and callers must not
+    modify the returned figure.
+    """
+    return _figures.get(key, build, max_bytes)
+
+
+def figure_cache_info():
+    """Entries, bytes held, hits, misses and evictions of the figure cache."""
+    return _figures.info()
+
+
+def clear_figure_cache():
+    """Drop every cached figure."""
+    _figures.clear()
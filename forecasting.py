@@ -0,0 +1,200 @@
+import hashlib
+import importlib.util
+import logging
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+from data_access import load_transactions
+from jobs import job_cores, report_progress
+from model_cache import cached_model, lookup_model
+from rfm_engine import as_of_cutoff
+from snapshot import load_as_of_tables
+from time_buckets import bucket_keys, bucket_labels, bucket_starts
+
+# Columns revenue can be split by; 'Segment' is looked up per customer as of the date
+FORECAST_GROUPS = ['Location', 'ProductInformation', 'Segment']
+TOTAL_SERIES = 'All customers'
+
+# Season length per granularity. A series needs MIN_SEASONS full seasons of
+# history, counted from its first sale, before Prophet or the seasonal
+# naive baseline is fitted to it; shorter ones get exponential smoothing.
+SEASON_LENGTH = {'D': 7, 'W': 52, 'M': 12, 'Q': 4}
+MIN_SEASONS = 2
+
+# Prophet settings shared by every series, and the matching interval for the baseline
+PROPHET_PARAMS = {'interval_width': 0.8}
+INTERVAL_Z = 1.2816
+# Smoothing levels tried per series by the exponential smoothing baseline
+SES_ALPHAS = np.linspace(0.1, 0.9, 9)
+
+
+def prophet_available():
+    """Whether Prophet is installed; without it every series uses the baseline."""
+    return importlib.util.find_spec('prophet') is not None
+
+
+def revenue_panel(transactions, by=None, granularity='D', segments=None):
+    """Revenue per series and time bucket, built with one grouped sum.
+
+    by is a transaction column, 'Segment' (looked up in segments, a frame
+    of CustomerID and Segment) or None for a single total series. Returns
+    {'names': series names, 'keys': bucket keys of the columns, 'values':
+    series x buckets array with zeros for buckets without sales, 'first':
+    column of each series' first sale}.
+    """
+    periods = bucket_keys(transactions['PurchaseDate'], granularity)
+    start = periods.min()
+    keys = np.arange(start, periods.max() + 1)
+    if by is None:
+        names, codes = np.array([TOTAL_SERIES], dtype=object), np.zeros(len(transactions), dtype=np.int64)
+    else:
+        column = transactions['CustomerID'].map(segments.set_index('CustomerID')['Segment']) if by == 'Segment' \
+            else transactions[by]
+        codes, names = pd.factorize(column, sort=True)
+        names = np.asarray(names, dtype=object)
+    # Rows without a series (a customer missing from segments) are left out
+    sold = codes >= 0
+    periods, codes = periods[sold], codes[sold]
+    cells = codes * len(keys) + (periods - start)
+    values = np.bincount(cells, weights=transactions['TransactionAmount'].to_numpy()[sold],
+                         minlength=len(names) * len(keys)).reshape(len(names), len(keys))
+    return {'names': names, 'keys': keys, 'values': values, 'first': (values != 0).argmax(axis=1)}
+
+
+def series_hash(keys, values):
+    """Digest of a series' bucket keys and values, for caching its forecast."""
+    digest = hashlib.sha1(np.ascontiguousarray(keys, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def baseline_forecast(values, first, horizon, season):
+    """Vectorized forecasts of every row of values: seasonal naive or exponential smoothing.
+
+    Rows with at least MIN_SEASONS seasons since their first sale repeat
+    their last season; the rest use simple exponential smoothing with the
+    smoothing level picked per row by one-step-ahead error. Returns
+    (forecast, lower, upper, model names), the arrays series x horizon.
+    """
+    n_series, n_periods = values.shape
+    steps = np.arange(horizon)
+    observed = np.arange(n_periods) >= first[:, None]
+
+    # Exponential smoothing for every row and smoothing level at once: levels x series
+    alphas = SES_ALPHAS[:, None]
+    level = values[np.arange(n_series), first][None, :].repeat(len(SES_ALPHAS), axis=0)
+    sse = np.zeros_like(level)
+    for t in range(n_periods):
+        active = t > first
+        error = values[:, t] - level
+        sse += np.where(active, error ** 2, 0.0)
+        level = np.where(active, level + alphas * error, level)
+    best = sse.argmin(axis=0)
+    rows = np.arange(n_series)
+    ses_level = level[best, rows]
+    ses_sigma = np.sqrt(sse[best, rows] / np.maximum(n_periods - first - 1, 1))
+    ses_alpha = SES_ALPHAS[best]
+    forecast = np.repeat(ses_level[:, None], horizon, axis=1)
+    margin = INTERVAL_Z * ses_sigma[:, None] * np.sqrt(1 + steps * ses_alpha[:, None] ** 2)
+
+    seasonal = n_periods - first >= MIN_SEASONS * season
+    if seasonal.any():
+        # Repeat the last season; the spread comes from the season-on-season changes
+        recent = values[seasonal][:, n_periods - season + steps % season]
+        changes = values[seasonal][:, season:] - values[seasonal][:, :-season]
+        valid = observed[seasonal][:, :-season]
+        sigma = np.sqrt((np.where(valid, changes, 0.0) ** 2).sum(axis=1) / np.maximum(valid.sum(axis=1), 1))
+        forecast[seasonal] = recent
+        margin[seasonal] = INTERVAL_Z * sigma[:, None] * np.sqrt(steps // season + 1)
+
+    models = np.where(seasonal, 'Seasonal naive', 'Exponential smoothing').astype(object)
+    forecast = np.maximum(forecast, 0.0)
+    return forecast, np.maximum(forecast - margin, 0.0), forecast + margin, models
+
+
+def _prophet_one(dates, values, future):
+    # Runs in a worker process, so Prophet is imported there
+    from prophet import Prophet
+    # Prophet's Stan backend logs the start and end of every fit
+    logging.getLogger('cmdstanpy').disabled = True
+    model = Prophet(**PROPHET_PARAMS).fit(pd.DataFrame({'ds': dates, 'y': values}))
+    predicted = model.predict(pd.DataFrame({'ds': future}))
+    return (np.maximum(predicted['yhat'].to_numpy(), 0.0),
+            np.maximum(predicted['yhat_lower'].to_numpy(), 0.0),
+            np.maximum(predicted['yhat_upper'].to_numpy(), 0.0))
+
+
+def forecast_panel(panel, granularity='D', horizon=14, progress=None, n_jobs=None):
+    """Forecast every series of a revenue_panel for horizon buckets.
+
+    Series long enough for Prophet are fitted in parallel worker processes,
+    one per core, and each forecast is cached by series hash, granularity
+    and horizon; the others, or all of them without Prophet, get the
+    vectorized baseline. Returns one row per series and bucket with
+    Series, Period, Date, Revenue (actuals), Forecast, Lower, Upper and
+    Model. progress(fraction, message) is called as each fit finishes;
+    n_jobs caps the worker processes (default: one per core, or the
+    job's share of them inside a background job).
+    """
+    keys, values, first = panel['keys'], panel['values'], panel['first']
+    season = SEASON_LENGTH[granularity]
+    future_keys = np.arange(keys[-1] + 1, keys[-1] + 1 + horizon)
+    forecast, lower, upper, models = baseline_forecast(values, first, horizon, season)
+
+    long_enough = np.flatnonzero(len(keys) - first >= MIN_SEASONS * season) if prophet_available() \
+        else np.array([], dtype=np.int64)
+    settings = (granularity, horizon, tuple(PROPHET_PARAMS.items()))
+    hashes = {row: series_hash(keys[first[row]:], values[row, first[row]:]) for row in long_enough}
+    fitted = {row: lookup_model(('prophet', hashes[row], settings)) for row in long_enough}
+    todo = [row for row, result in fitted.items() if result is None]
+    if todo:
+        dates = bucket_starts(keys, granularity).astype('datetime64[ns]')
+        future = bucket_starts(future_keys, granularity).astype('datetime64[ns]')
+        # Each Prophet fit is single-threaded, so series are spread over processes
+        n_jobs = min(len(todo), n_jobs or job_cores())
+        fits = Parallel(n_jobs=n_jobs, return_as='generator')(
+            delayed(_prophet_one)(dates[first[row]:], values[row, first[row]:], future) for row in todo)
+        for done, (row, result) in enumerate(zip(todo, fits), 1):
+            fitted[row] = cached_model(('prophet', hashes[row], settings), lambda: result)
+            if progress is not None:
+                progress(done / len(todo), f"Fitted {panel['names'][row]}")
+    for row, (yhat, low, high) in fitted.items():
+        forecast[row], lower[row], upper[row], models[row] = yhat, low, high, 'Prophet'
+
+    # Actuals from each series' first sale, then the forecast buckets
+    n_series = len(panel['names'])
+    actual = pd.DataFrame({
+        'Series': np.repeat(panel['names'], len(keys)),
+        'Key': np.tile(keys, n_series),
+        'Revenue': values.ravel(),
+        'Model': np.repeat(models, len(keys)),
+    })[(np.arange(len(keys)) >= first[:, None]).ravel()]
+    predicted = pd.DataFrame({
+        'Series': np.repeat(panel['names'], horizon),
+        'Key': np.tile(future_keys, n_series),
+        'Forecast': forecast.ravel(),
+        'Lower': lower.ravel(),
+        'Upper': upper.ravel(),
+        'Model': np.repeat(models, horizon),
+    })
+    result = pd.concat([actual, predicted], ignore_index=True)
+    result.insert(1, 'Period', bucket_labels(result['Key'].to_numpy(), granularity))
+    result.insert(2, 'Date', bucket_starts(result['Key'].to_numpy(), granularity).astype('datetime64[ns]'))
+    return result.drop(columns='Key').sort_values(['Series', 'Date'], ignore_index=True)
+
+
+def forecast_job_key(data_key, by, granularity, horizon):
+    """Key of a forecast job: the data version, its arguments and the model settings."""
+    settings = (prophet_available(), tuple(PROPHET_PARAMS.items()), MIN_SEASONS, tuple(SES_ALPHAS))
+    return ('forecast_job', data_key, (by, granularity, horizon), settings)
+
+
+def forecast_job(path, as_of, by, granularity, horizon):
+    """Revenue forecasts per series as a background job (see jobs.submit_job)."""
+    columns = ['CustomerID', 'PurchaseDate', 'TransactionAmount'] + ([by] if by not in (None, 'Segment') else [])
+    transactions = load_transactions(path, columns=columns, end=as_of_cutoff(as_of))
+    segments = load_as_of_tables(as_of, path)['rfm'][['CustomerID', 'Segment']] if by == 'Segment' else None
+    panel = revenue_panel(transactions, by, granularity, segments)
+    return forecast_panel(panel, granularity, horizon, progress=report_progress)
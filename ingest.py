@@ -0,0 +1,324 @@
+import hashlib
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+from data_access import file_fingerprint, iter_columnar, read_transactions_csv, transaction_format
+from rfm_engine import CENTS, amount_cents, as_of_cutoff, days_between, rfm_from_aggregates, spending_std
+from time_buckets import bucket_keys, bucket_labels, bucket_starts
+
+# Per-customer and per-period accumulators that transactions are folded into.
+# Amounts are kept as integer cents, so folding batches in any order gives
+# exactly the tables computed from the whole file.
+# customers: one row per CustomerID with its order count, the sums of its
+#            amounts and squared amounts in int64 cents, and its date range
+# products:  distinct (CustomerID, ProductInformation) pairs for ProductVariety
+# daily:     revenue in cents and order count per day key (days since 1970-01-01)
+# active:    distinct (Month, CustomerID) pairs for monthly active customers,
+#            with Month as a month key (months since 1970-01)
+STATE_TABLES = ('customers', 'products', 'daily', 'active')
+STATE_META = 'state.json'
+STATE_VERSION = 4
+
+# Raw CSV bytes parsed per chunk when folding a file into the accumulators
+CHUNK_BYTES = 64 * 1024 * 1024
+TAIL_BLOCK_BYTES = 64 * 1024
+
+
+def empty_state():
+    """Accumulators holding no transactions yet."""
+    return {
+        'customers': pd.DataFrame({
+            'FirstPurchase': pd.Series(dtype='datetime64[ns]'),
+            'LastPurchase': pd.Series(dtype='datetime64[ns]'),
+            'Count': pd.Series(dtype='int64'),
+            'Cents': pd.Series(dtype='int64'),
+            'SquaredCents': pd.Series(dtype='int64'),
+        }, index=pd.Index([], dtype='int64', name='CustomerID')),
+        'products': pd.DataFrame({'CustomerID': pd.Series(dtype='int64'),
+                                  'ProductInformation': pd.Series(dtype='category')}),
+        'daily': pd.DataFrame({'Revenue': pd.Series(dtype='int64'),
+                               'Orders': pd.Series(dtype='int64')},
+                              index=pd.Index([], dtype='int64', name='Day')),
+        'active': pd.DataFrame({'Month': pd.Series(dtype='int32'),
+                                'CustomerID': pd.Series(dtype='int64')}),
+    }
+
+
+def _union_pairs(old, new, category):
+    # Distinct rows of both frames; category columns share one set of categories
+    categories = old[category].cat.categories.union(new[category].cat.categories)
+    old = old.astype({category: pd.CategoricalDtype(categories)})
+    new = new.astype({category: pd.CategoricalDtype(categories)})
+    return pd.concat([old, new]).drop_duplicates(ignore_index=True)
+
+
+def summarize(transactions):
+    """Accumulators for a batch of transactions on their own."""
+    cents = amount_cents(transactions['TransactionAmount'])
+    amounts = pd.DataFrame({
+        'CustomerID': transactions['CustomerID'].to_numpy(),
+        'PurchaseDate': transactions['PurchaseDate'].to_numpy(),
+        'Cents': cents,
+        'SquaredCents': cents ** 2,
+    })
+    customers = amounts.groupby('CustomerID').agg(
+        FirstPurchase=('PurchaseDate', 'min'),
+        LastPurchase=('PurchaseDate', 'max'),
+        Count=('Cents', 'count'),
+        Cents=('Cents', 'sum'),
+        SquaredCents=('SquaredCents', 'sum'),
+    )
+
+    days = pd.Index(bucket_keys(transactions['PurchaseDate'], 'D'), name='Day')
+    return {
+        'customers': customers,
+        'products': transactions[['CustomerID', 'ProductInformation']].drop_duplicates()
+                    .astype({'ProductInformation': 'category'}),
+        'daily': amounts.groupby(days).agg(
+            Revenue=('Cents', 'sum'),
+            Orders=('Cents', 'count'),
+        ),
+        'active': pd.DataFrame({
+            'Month': bucket_keys(transactions['PurchaseDate'], 'M').astype('int32'),
+            'CustomerID': transactions['CustomerID'],
+        }).drop_duplicates(),
+    }
+
+
+def _merge_customers(old, new):
+    # Counts and cent sums add exactly; the date range widens
+    left, right = old.align(new, join='outer')
+    merged = pd.DataFrame(index=left.index)
+    merged['FirstPurchase'] = np.fmin(left['FirstPurchase'], right['FirstPurchase'])
+    merged['LastPurchase'] = np.fmax(left['LastPurchase'], right['LastPurchase'])
+    for column in ('Count', 'Cents', 'SquaredCents'):
+        merged[column] = left[column].fillna(0).astype('int64') + right[column].fillna(0).astype('int64')
+    return merged
+
+
+def merge_state(state, batch):
+    """Fold the accumulators of a new batch into the running state."""
+    daily = state['daily'].add(batch['daily'], fill_value=0)
+    daily = daily.astype('int64')
+    return {
+        'customers': _merge_customers(state['customers'], batch['customers']),
+        'products': _union_pairs(state['products'], batch['products'], 'ProductInformation'),
+        'daily': daily,
+        'active': pd.concat([state['active'], batch['active']]).drop_duplicates(ignore_index=True),
+    }
+
+
+def state_tables(state, reference_date=None):
+    """The page tables (see snapshot.build_tables) derived from accumulators."""
+    customers = state['customers'].sort_index().reset_index()
+    count = customers['Count']
+    if reference_date is None:
+        reference_date = customers['LastPurchase'].max()
+
+    monetary = customers['Cents'] / CENTS
+    aggregates = customers[['CustomerID', 'LastPurchase']].assign(Frequency=count, Monetary=monetary)
+    rfm = rfm_from_aggregates(aggregates, reference_date)
+
+    metrics = pd.DataFrame({
+        'CustomerID': customers['CustomerID'],
+        'Total_Orders': count,
+        'Total_Spent': monetary,
+        'Days_Since_Last_Purchase': days_between(reference_date, customers['LastPurchase']),
+    })
+
+    variety = state['products'].groupby('CustomerID').size()
+    features = pd.DataFrame({
+        'CustomerID': customers['CustomerID'],
+        'Tenure': days_between(customers['LastPurchase'], customers['FirstPurchase']),
+        'TransactionCount': count,
+        'AvgOrderValue': monetary / count,
+        'SpendingStd': spending_std(count, customers['Cents'], customers['SquaredCents']),
+        'TotalSpending': monetary,
+        'ProductVariety': variety.reindex(customers['CustomerID']).to_numpy(),
+        'TotalProducts': count,
+    })
+
+    daily = state['daily'].sort_index()
+    days = bucket_starts(daily.index, 'D')
+    monthly = daily.groupby(bucket_keys(days, 'M')).sum()
+    revenue = monthly['Revenue'] / CENTS
+    monthly_revenue = pd.DataFrame({
+        'Month': bucket_labels(monthly.index, 'M'),
+        'Total_Revenue': revenue.to_numpy(),
+        'Average_Order_Value': (revenue / monthly['Orders']).to_numpy(),
+        'Number_of_Orders': monthly['Orders'].to_numpy(),
+        'Active_Customers': state['active'].groupby('Month').size().reindex(monthly.index).to_numpy(),
+    })
+    daily_revenue = pd.DataFrame({
+        'PurchaseDate': days.astype(object),
+        'TransactionAmount': (daily['Revenue'] / CENTS).to_numpy(),
+        'Number_of_Orders': daily['Orders'].to_numpy(),
+    })
+
+    return {
+        'rfm': rfm,
+        'customer_metrics': metrics,
+        'customer_features': features,
+        'monthly_revenue': monthly_revenue,
+        'daily_revenue': daily_revenue,
+    }
+
+
+def read_header(path):
+    """Column names of a transaction CSV and the byte offset of its first data row."""
+    with open(path, 'rb') as f:
+        header = f.readline()
+    return header.decode().strip().split(','), len(header)
+
+
+def complete_rows_end(path):
+    """Byte offset just past the last newline, i.e. the end of the last complete row."""
+    with open(path, 'rb') as f:
+        position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            step = min(TAIL_BLOCK_BYTES, position)
+            position -= step
+            f.seek(position)
+            newline = f.read(step).rfind(b'\n')
+            if newline >= 0:
+                return position + newline + 1
+    return 0
+
+
+def prefix_digest(path, offset):
+    """SHA-1 of the first and last TAIL_BLOCK_BYTES of the file's first offset bytes.
+
+    update_state compares it with the digest stored at the last update to
+    tell a file that was only appended to from one rewritten in place; a
+    rewrite that leaves both blocks untouched goes unnoticed.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        digest.update(f.read(min(TAIL_BLOCK_BYTES, offset)))
+        f.seek(max(0, offset - TAIL_BLOCK_BYTES))
+        digest.update(f.read(offset - f.tell()))
+    return digest.hexdigest()
+
+
+def iter_rows(path, start, end, columns, chunk_bytes=CHUNK_BYTES):
+    """Parse the rows between two byte offsets in chunks of about chunk_bytes.
+
+    Chunks are cut at newlines, so only one chunk of raw text and its parsed
+    frame are in memory at a time.
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        carry = b''
+        while remaining > 0:
+            block = f.read(min(chunk_bytes, remaining))
+            remaining -= len(block)
+            block = carry + block
+            cut = block.rfind(b'\n') + 1 if remaining > 0 else len(block)
+            carry = block[cut:]
+            if cut:
+                yield read_transactions_csv(io.BytesIO(block[:cut]), names=columns, header=None)
+
+
+def fold_rows(state, chunks):
+    """Fold transaction chunks into state; returns (state, rows folded)."""
+    rows = 0
+    for chunk in chunks:
+        state = merge_state(state, summarize(chunk))
+        rows += len(chunk)
+    return state, rows
+
+
+def stream_state(path, chunk_bytes=CHUNK_BYTES, as_of=None):
+    """Accumulators for a whole transaction file, read chunk by chunk.
+
+    With as_of set, only purchases made on or before that date are folded in.
+    Peak memory is one chunk plus the accumulators, which grow with the
+    number of customers (and their distinct products and active months)
+    rather than with the number of rows. Parquet and Arrow files are read
+    in row batches, skipping the row groups after as_of.
+    """
+    if transaction_format(path) != 'csv':
+        end = None if as_of is None else as_of_cutoff(as_of)
+        return fold_rows(empty_state(), iter_columnar(path, end=end))[0]
+    columns, header_size = read_header(path)
+    end = os.path.getsize(path)
+    chunks = iter_rows(path, header_size, end, columns, chunk_bytes)
+    if as_of is not None:
+        cutoff = as_of_cutoff(as_of)
+        chunks = (chunk[chunk['PurchaseDate'] < cutoff] for chunk in chunks)
+    return fold_rows(empty_state(), chunks)[0]
+
+
+def stream_tables(path, as_of=None, chunk_bytes=CHUNK_BYTES):
+    """The page tables for a transaction file too large to load at once.
+
+    With as_of set, the tables describe the purchases up to that date and
+    recency is counted back from it.
+    """
+    return state_tables(stream_state(path, chunk_bytes, as_of), as_of)
+
+
+def save_state(state, meta, state_dir):
+    os.makedirs(state_dir, exist_ok=True)
+    for name in STATE_TABLES:
+        table = state[name]
+        if name in ('customers', 'daily'):
+            table = table.reset_index()
+        feather.write_feather(table, os.path.join(state_dir, f'{name}.feather'))
+    # Metadata last: it holds the high-water mark the tables correspond to
+    meta_path = os.path.join(state_dir, STATE_META)
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(meta_path + '.tmp', meta_path)
+
+
+def load_state(state_dir):
+    """Return (state, meta) persisted in state_dir, or (None, None) when absent."""
+    try:
+        with open(os.path.join(state_dir, STATE_META)) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None, None
+    if meta.get('version') != STATE_VERSION:
+        return None, None
+
+    state = {name: feather.read_feather(os.path.join(state_dir, f'{name}.feather'))
+             for name in STATE_TABLES}
+    state['customers'] = state['customers'].set_index('CustomerID')
+    state['daily'] = state['daily'].set_index('Day')
+    return state, meta
+
+
+def update_state(path, state_dir):
+    """Fold rows appended to the transaction file since the last update into the state.
+
+    Starts from scratch when there is no state yet or when the file no longer
+    extends what was ingested: it shrank, its header changed or the bytes
+    already ingested were rewritten (see prefix_digest). Returns
+    (state, meta, new_rows).
+    """
+    state, meta = load_state(state_dir)
+    columns, header_size = read_header(path)
+    source, mtime_ns, size = file_fingerprint(path)
+
+    if (state is None or meta['source'] != source or meta['columns'] != columns
+            or size < meta['offset'] or meta['prefix_sha1'] != prefix_digest(path, meta['offset'])):
+        state = empty_state()
+        meta = {'version': STATE_VERSION, 'source': source, 'columns': columns,
+                'offset': header_size, 'rows': 0}
+
+    # Rows past the last newline may still be being written; leave them for later
+    end = max(complete_rows_end(path), meta['offset'])
+    state, n_new = fold_rows(state, iter_rows(path, meta['offset'], end, columns))
+    if n_new:
+        meta.update(offset=end, rows=meta['rows'] + n_new,
+                    max_purchase_date=state['customers']['LastPurchase'].max().isoformat())
+    meta.update(mtime_ns=mtime_ns, size=size, prefix_sha1=prefix_digest(path, meta['offset']))
+    save_state(state, meta, state_dir)
+    return state, meta, n_new
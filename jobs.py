@@ -0,0 +1,172 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from model_cache import cached_model
+from shared_cache import prune_pickles
+
+# Finished job results and progress of running jobs, one file pair per job
+JOB_DIR = 'job_cache'
+# Upper bound on the results kept in JOB_DIR, least recently used go first
+JOB_DIR_BYTES = 2 * 1024 * 1024 * 1024
+# Worker processes for long fits; one core is left to the dashboard
+MAX_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# Cores each job may spread its own fits over, so the workers together do
+# not start more threads or processes than there are cores
+JOB_CORES = max(1, (os.cpu_count() or 1) // MAX_WORKERS)
+# spawn: forking a process that runs Streamlit's threads is unsafe
+_SPAWN = multiprocessing.get_context('spawn')
+
+_pool = None
+# job id -> Future of the jobs submitted from this server process, shared by all sessions
+_running = {}
+_lock = threading.Lock()
+
+# Set inside a worker while it runs a job, for report_progress
+_current_progress_file = None
+
+
+def job_id(key):
+    """Stable file-safe id of a job key, which must have a deterministic repr."""
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+def _paths(job, job_dir):
+    base = os.path.join(job_dir, job)
+    return base + '.pkl', base + '.progress'
+
+
+def _write_atomic(path, data):
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def report_progress(fraction, message=''):
+    """Record the progress of the running job; a no-op outside a job."""
+    if _current_progress_file is not None:
+        _write_atomic(_current_progress_file, json.dumps({'fraction': fraction, 'message': message}).encode())
+
+
+def job_cores():
+    """Cores the caller may parallelize over: JOB_CORES inside a job, every core outside one."""
+    return JOB_CORES if _current_progress_file is not None else os.cpu_count() or 1
+
+
+def _run(job, job_dir, func, args):
+    # Runs in a worker: the result file is only written once complete
+    global _current_progress_file
+    # Imported here so the pages do not load them; they cap the joblib pools
+    # and OpenMP/BLAS threads that library code starts without an explicit n_jobs
+    from joblib import parallel_config
+    from threadpoolctl import threadpool_limits
+    result_path, _current_progress_file = _paths(job, job_dir)
+    try:
+        report_progress(0.0, 'Starting')
+        with parallel_config(n_jobs=JOB_CORES), threadpool_limits(JOB_CORES):
+            result = func(*args)
+        _write_atomic(result_path, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+    finally:
+        os.remove(_current_progress_file)
+        _current_progress_file = None
+    prune_pickles(job_dir, JOB_DIR_BYTES)
+
+
+def _start_pool():
+    # Streamlit installs the page script as __main__, which spawn would re-run
+    # in every new worker. All workers are started here, once per pool, so
+    # __main__ is only swapped for an empty module while they launch.
+    pool = ProcessPoolExecutor(MAX_WORKERS, mp_context=_SPAWN)
+    main = sys.modules['__main__']
+    bare = sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        # A worker is spawned on each submit that finds none idle; these land
+        # long before the first worker is up, so each starts its own worker
+        for _ in range(MAX_WORKERS):
+            pool.submit(os.getpid)
+    finally:
+        # Keep the script of a session that started running meanwhile
+        if sys.modules['__main__'] is bare:
+            sys.modules['__main__'] = main
+    return pool
+
+
+def _executor(restart=False):
+    # Called with _lock held
+    global _pool
+    if _pool is None or restart:
+        _pool = _start_pool()
+    return _pool
+
+
+def submit_job(key, func, *args, job_dir=JOB_DIR):
+    """Run func(*args) in the worker pool unless its result exists or it is already running.
+
+    func must be importable from a module (not defined in the Streamlit
+    script) and may call report_progress. Identical keys submitted by
+    several sessions share one run; a failed job runs again when
+    resubmitted.
+    """
+    job = job_id(key)
+    os.makedirs(job_dir, exist_ok=True)
+    with _lock:
+        running = _running.get(job)
+        if running is not None and not running.done():
+            return job
+        if os.path.exists(_paths(job, job_dir)[0]):
+            return job
+        try:
+            _running[job] = _executor().submit(_run, job, job_dir, func, args)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); start a fresh pool
+            _running[job] = _executor(restart=True).submit(_run, job, job_dir, func, args)
+    return job
+
+
+def _load_result(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def job_status(key, job_dir=JOB_DIR):
+    """State of the job for key.
+
+    Returns {'state': 'done', 'result': ...}, {'state': 'running',
+    'fraction': 0..1, 'message': ...}, {'state': 'failed', 'error': ...}
+    or {'state': 'idle'} for a job that was never submitted (or whose
+    result was pruned). Finished results are read from job_dir, so they
+    survive restarts.
+    """
+    job = job_id(key)
+    result_path, progress_path = _paths(job, job_dir)
+    try:
+        # Loaded once per result file, then served from the model cache. Results
+        # are replaced, never rewritten in place, so the inode tells files apart
+        # and the mtime is free to mark the result recently used for pruning.
+        inode = os.stat(result_path).st_ino
+        result = cached_model(('job', result_path, inode), lambda: _load_result(result_path))
+        os.utime(result_path)
+        return {'state': 'done', 'result': result}
+    except FileNotFoundError:
+        pass
+
+    with _lock:
+        running = _running.get(job)
+    if running is None or (running.done() and running.exception() is None):
+        return {'state': 'idle'}
+    if running.done():
+        return {'state': 'failed', 'error': repr(running.exception())}
+
+    try:
+        with open(progress_path) as f:
+            progress = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        progress = {'fraction': 0.0, 'message': 'Waiting for a worker'}
+    return {'state': 'running', **progress}
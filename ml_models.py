@@ -0,0 +1,499 @@
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy.cluster.hierarchy import dendrogram, fcluster
+from sklearn.cluster import DBSCAN, KMeans, MiniBatchKMeans
+from sklearn.ensemble import (HistGradientBoostingClassifier, HistGradientBoostingRegressor,
+                              RandomForestClassifier, RandomForestRegressor)
+from sklearn.inspection import permutation_importance
+from sklearn.metrics import (accuracy_score, mean_absolute_error, mean_squared_error, r2_score,
+                             roc_auc_score, silhouette_score)
+from sklearn.model_selection import train_test_split
+from sklearn.neighbors import KDTree
+from sklearn.preprocessing import StandardScaler
+
+from data_access import file_fingerprint, load_transactions
+from jobs import job_cores, report_progress
+from model_cache import cached_model
+from rfm_engine import as_of_cutoff, compute_rfm, customer_features, transactions_as_of
+from snapshot import load_ml_data
+
+# Settings shared by every K-Means fit on the ML page
+KMEANS_PARAMS = {'random_state': 42, 'n_init': 10}
+
+# K sweep: candidate cluster counts and the MiniBatchKMeans settings. Each K
+# is fitted on at most SWEEP_FIT_SAMPLE customers, so the sweep takes about
+# the same time whatever the number of customers.
+SWEEP_K = tuple(range(2, 11))
+SWEEP_FIT_SAMPLE = 100_000
+MINIBATCH_PARAMS = {'random_state': 42, 'n_init': 3, 'batch_size': 4096}
+
+# Hierarchical view: customers are first summarized by MICRO_CLUSTERS
+# MiniBatchKMeans centroids, and only those are linked
+MICRO_CLUSTERS = 200
+DENDROGRAM_LEAVES = 40
+
+# DBSCAN: neighbourhood queries go through a KD-tree over the distinct
+# scaled vectors; eps is suggested from the k-distance curve of a sample
+DBSCAN_ALGORITHM = 'kd_tree'
+EPS_SAMPLE = 10_000
+
+# Silhouette is O(n^2), so above SILHOUETTE_SAMPLE customers it is averaged
+# over SILHOUETTE_REPEATS stratified samples of that size
+SILHOUETTE_SAMPLE = 2_000
+SILHOUETTE_REPEATS = 5
+CONFIDENCE_Z = 1.96
+
+# Churn and CLV models learn from the features of customers as of
+# as_of - horizon and what they did over the following horizon days
+PREDICTION_FEATURES = ['Recency', 'Frequency', 'Monetary', 'Tenure', 'AvgOrderValue', 'SpendingStd', 'ProductVariety']
+PREDICTION_TARGETS = {'churn': 'Churned', 'clv': 'Future_Spend'}
+ENGINES = ('Random Forest', 'Histogram Gradient Boosting')
+TEST_SIZE = 0.2
+
+# Random forest on the job_cores() cores: up to FOREST_TREES trees of at most
+# FOREST_MAX_DEPTH levels, each on at most FOREST_MAX_SAMPLES bootstrap
+# rows. Above FOREST_FULL_ROWS training rows the number of trees shrinks
+# in proportion, down to FOREST_MIN_TREES.
+FOREST_TREES = 100
+FOREST_MIN_TREES = 30
+FOREST_FULL_ROWS = 50_000
+FOREST_MAX_DEPTH = 12
+FOREST_MAX_SAMPLES = 50_000
+FOREST_PARAMS = {'min_samples_leaf': 5, 'random_state': 42}
+
+# Histogram gradient boosting stops once the validation loss stalls;
+# without built-in importances it gets permutation importance on a sample
+BOOSTING_PARAMS = {'max_iter': 300, 'early_stopping': True, 'validation_fraction': 0.1,
+                   'n_iter_no_change': 10, 'random_state': 42}
+IMPORTANCE_SAMPLE = 10_000
+IMPORTANCE_REPEATS = 3
+
+
+def scaled_features(data_key, ml_data, features):
+    """StandardScaler fitted on the feature columns and the scaled matrix.
+
+    data_key identifies the version of ml_data (file fingerprint and as-of
+    date); the result is cached per data_key and feature tuple.
+    """
+    def fit():
+        scaler = StandardScaler()
+        return {'scaler': scaler, 'X': scaler.fit_transform(ml_data[list(features)])}
+    return cached_model(('scaled', data_key, features), fit)
+
+
+def stratified_sample(labels, size, rng):
+    """Row positions of a sample of about size rows keeping each label's share."""
+    _, codes, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    quotas = np.maximum(np.round(counts * size / len(labels)).astype(int), 1)
+    # Rows grouped by label: label i owns order[starts[i]:starts[i] + counts[i]]
+    order = np.argsort(codes, kind='stable')
+    starts = np.cumsum(counts) - counts
+    return np.concatenate([
+        order[start + rng.choice(count, min(quota, count), replace=False)]
+        for start, count, quota in zip(starts, counts, quotas)
+    ])
+
+
+def sampled_silhouette(X, labels, sample_size=SILHOUETTE_SAMPLE, repeats=SILHOUETTE_REPEATS, seed=0):
+    """Silhouette score with a confidence interval: (mean, low, high).
+
+    Exact when X has at most sample_size rows; otherwise averaged over
+    stratified samples, with a normal-approximation interval on the mean.
+    """
+    if len(X) <= sample_size:
+        score = float(silhouette_score(X, labels))
+        return score, score, score
+    rng = np.random.default_rng(seed)
+    scores = []
+    for _ in range(repeats):
+        rows = stratified_sample(labels, sample_size, rng)
+        scores.append(silhouette_score(X[rows], labels[rows]))
+    mean = float(np.mean(scores))
+    margin = CONFIDENCE_Z * float(np.std(scores, ddof=1)) / float(np.sqrt(repeats))
+    return mean, mean - margin, mean + margin
+
+
+def kmeans_segments(data_key, ml_data, features, n_clusters):
+    """K-Means fitted on the scaled features, its labels and silhouette score with bounds."""
+    def fit():
+        X = scaled_features(data_key, ml_data, features)['X']
+        model = KMeans(n_clusters=n_clusters, **KMEANS_PARAMS).fit(X)
+        silhouette, low, high = sampled_silhouette(X, model.labels_)
+        return {
+            'model': model,
+            'labels': model.labels_,
+            'silhouette': silhouette,
+            'silhouette_low': low,
+            'silhouette_high': high,
+        }
+    return cached_model(('kmeans', data_key, features, n_clusters, tuple(KMEANS_PARAMS.items())), fit)
+
+
+def _sweep_one(X, k):
+    start = time.perf_counter()
+    model = MiniBatchKMeans(n_clusters=k, **MINIBATCH_PARAMS).fit(X)
+    silhouette, low, high = sampled_silhouette(X, model.labels_)
+    return {
+        'K': k,
+        'Inertia': model.inertia_ / len(X),
+        'Silhouette': silhouette,
+        'Silhouette_Low': low,
+        'Silhouette_High': high,
+        'Seconds': time.perf_counter() - start,
+    }
+
+
+def kmeans_sweep(data_key, ml_data, features, k_values=SWEEP_K, progress=None):
+    """Elbow and silhouette curve over k_values, fitted in parallel with MiniBatchKMeans.
+
+    Returns {'curve': one row per K (inertia per customer, silhouette and
+    its bounds, fit seconds), 'customers': customers fitted on,
+    'seconds': wall time}. K values of at least the number of customers
+    are skipped, since the silhouette needs fewer clusters than customers.
+    progress(fraction, message) is called as each K finishes.
+    """
+    def fit():
+        start = time.perf_counter()
+        X = scaled_features(data_key, ml_data, features)['X']
+        if len(X) > SWEEP_FIT_SAMPLE:
+            X = X[np.random.default_rng(0).choice(len(X), SWEEP_FIT_SAMPLE, replace=False)]
+        fitted_k = [k for k in k_values if k < len(X)]
+        # Threads suffice: the k-means and distance kernels release the GIL
+        jobs = min(len(fitted_k), job_cores())
+        fits = Parallel(n_jobs=jobs, prefer='threads', return_as='generator_unordered')(
+            delayed(_sweep_one)(X, k) for k in fitted_k)
+        rows = []
+        for row in fits:
+            rows.append(row)
+            if progress is not None:
+                progress(len(rows) / len(fitted_k), f"Fitted K={row['K']}")
+        return {
+            'curve': pd.DataFrame(rows).sort_values('K', ignore_index=True),
+            'customers': len(X),
+            'seconds': time.perf_counter() - start,
+        }
+    return cached_model(('kmeans_sweep', data_key, features, tuple(k_values), tuple(MINIBATCH_PARAMS.items())), fit)
+
+
+def weighted_ward(centroids, weights):
+    """Ward linkage of weighted points, as a scipy linkage matrix.
+
+    Merging clusters a and b costs w_a * w_b / (w_a + w_b) * |c_a - c_b|^2,
+    so a centroid standing for many customers counts as that many points.
+    The third column holds sqrt(2 * cost), the distance scipy's ward
+    linkage reports, and the fourth the number of centroids merged (scipy
+    rejects any other count); customers per node are returned separately.
+    Takes O(m^2) memory and O(m^3) time, for the few hundred centroids.
+    """
+    m = len(centroids)
+    centers = np.asarray(centroids, dtype=float).copy()
+    customers = np.asarray(weights, dtype=float).copy()
+    points = np.ones(m)
+    node = np.arange(m)
+    node_customers = np.concatenate([customers, np.zeros(m - 1)])
+    Z = np.empty((m - 1, 4))
+
+    def merge_costs(i):
+        w = customers[i] * customers / (customers[i] + customers)
+        return w * ((centers - centers[i]) ** 2).sum(axis=1)
+
+    costs = np.stack([merge_costs(i) for i in range(m)])
+    np.fill_diagonal(costs, np.inf)
+    for step in range(m - 1):
+        a, b = np.unravel_index(np.argmin(costs), costs.shape)
+        Z[step] = [min(node[a], node[b]), max(node[a], node[b]), np.sqrt(2 * costs[a, b]), points[a] + points[b]]
+
+        # The merged cluster takes slot a; slot b is retired
+        total = customers[a] + customers[b]
+        centers[a] = (customers[a] * centers[a] + customers[b] * centers[b]) / total
+        customers[a], points[a], node[a] = total, points[a] + points[b], m + step
+        node_customers[m + step] = total
+        costs[b, :] = costs[:, b] = np.inf
+        row = merge_costs(a)
+        retired = np.isinf(costs[a])
+        row[retired] = np.inf
+        row[a] = np.inf
+        costs[a, :] = costs[:, a] = row
+    return Z, node_customers
+
+
+def hierarchical_tree(data_key, ml_data, features, n_micro=MICRO_CLUSTERS, progress=None):
+    """Two-stage hierarchical clustering: MiniBatchKMeans micro-clusters, then weighted Ward.
+
+    Returns {'micro_labels': micro-cluster per customer, 'linkage': scipy
+    linkage matrix over the micro-clusters, 'node_customers': customers
+    under every node of the tree}. Use cut_tree for customer segments.
+    """
+    def fit():
+        X = scaled_features(data_key, ml_data, features)['X']
+        if progress is not None:
+            progress(0.1, f"Summarizing {len(X):,} customers into micro-clusters")
+        micro = MiniBatchKMeans(n_clusters=min(n_micro, len(X)), **MINIBATCH_PARAMS).fit(X)
+        # Empty micro-clusters would add weightless leaves; drop them
+        used, micro_labels = np.unique(micro.labels_, return_inverse=True)
+        weights = np.bincount(micro_labels)
+        if progress is not None:
+            progress(0.8, f"Linking {len(used)} micro-clusters")
+        linkage_matrix, node_customers = weighted_ward(micro.cluster_centers_[used], weights)
+        return {'micro_labels': micro_labels, 'linkage': linkage_matrix, 'node_customers': node_customers}
+    return cached_model(('hierarchical', data_key, features, n_micro, tuple(MINIBATCH_PARAMS.items())), fit)
+
+
+def cut_tree(tree, n_clusters):
+    """Customer segments (1..n_clusters) from cutting a hierarchical_tree."""
+    micro_segments = fcluster(tree['linkage'], n_clusters, criterion='maxclust')
+    return micro_segments[tree['micro_labels']]
+
+
+def dendrogram_lines(tree, n_clusters, leaves=DENDROGRAM_LEAVES):
+    """Line segments of the dendrogram truncated to its top leaves, for plotting.
+
+    Returns {'lines': (xs, ys, colour index) per link, 'ticks': leaf x
+    positions, 'labels': customers under each leaf, 'threshold': height
+    of the cut into n_clusters}.
+    """
+    # Ward heights only grow, so the last n_clusters - 1 merges lie above the cut
+    heights = tree['linkage'][:, 2]
+    n_clusters = min(n_clusters, len(heights) + 1)
+    below = heights[-n_clusters] if n_clusters <= len(heights) else 0.0
+    threshold = (below + heights[-(n_clusters - 1)]) / 2
+    customers = tree['node_customers']
+    plot = dendrogram(
+        tree['linkage'], no_plot=True, truncate_mode='lastp', p=leaves,
+        color_threshold=threshold, above_threshold_color='above',
+        leaf_label_func=lambda node: f"{int(customers[node]):,}",
+    )
+    colours = sorted(set(plot['color_list']) - {'above'})
+    lines = [
+        (xs, ys, colours.index(colour) if colour in colours else None)
+        for xs, ys, colour in zip(plot['icoord'], plot['dcoord'], plot['color_list'])
+    ]
+    ticks = 5 + 10 * np.arange(len(plot['ivl']))
+    return {'lines': lines, 'ticks': ticks, 'labels': plot['ivl'], 'threshold': threshold}
+
+
+def distinct_points(data_key, ml_data, features, decimals=None):
+    """Distinct scaled feature vectors, the vector of each customer and customers per vector.
+
+    With decimals set, scaled values are rounded first, so customers closer
+    than about 10**-decimals standard deviations share a vector.
+    """
+    def fit():
+        X = scaled_features(data_key, ml_data, features)['X']
+        if decimals is not None:
+            X = np.round(X, decimals)
+        points, inverse, counts = np.unique(X, axis=0, return_inverse=True, return_counts=True)
+        return {'points': points, 'inverse': inverse.ravel(), 'counts': counts}
+    return cached_model(('distinct', data_key, features, decimals), fit)
+
+
+def knee(curve):
+    """Position of the knee of an increasing curve: the point furthest below its chord."""
+    x = np.linspace(0, 1, len(curve))
+    span = curve[-1] - curve[0]
+    y = (curve - curve[0]) / span if span > 0 else x
+    return int(np.argmax(x - y))
+
+
+def suggest_eps(data_key, ml_data, features, min_samples, decimals=None):
+    """eps at the knee of the sorted k-distance curve of a customer sample.
+
+    A customer's k-distance is the radius holding min_samples customers,
+    itself included and duplicates counted, i.e. the eps at which it would
+    become a core point. Returns {'eps': suggestion, 'curve': sorted k-distances}.
+    """
+    def fit():
+        distinct = distinct_points(data_key, ml_data, features, decimals)
+        points, counts = distinct['points'], distinct['counts']
+        customers = len(distinct['inverse'])
+        sample = np.random.default_rng(0).choice(customers, min(EPS_SAMPLE, customers), replace=False)
+        queries = points[distinct['inverse'][sample]]
+
+        # min_samples distinct neighbours always hold at least min_samples customers
+        k = min(min_samples, len(points))
+        distances, neighbours = KDTree(points).query(queries, k=k)
+        reached = np.cumsum(counts[neighbours], axis=1) >= min_samples
+        first = np.where(reached.any(axis=1), reached.argmax(axis=1), k - 1)
+        curve = np.sort(distances[np.arange(len(queries)), first])
+        return {'eps': float(max(curve[knee(curve)], 1e-6)), 'curve': curve}
+    return cached_model(('eps', data_key, features, min_samples, decimals), fit)
+
+
+def dbscan_segments(data_key, ml_data, features, eps, min_samples, decimals=None):
+    """DBSCAN over the distinct scaled vectors, weighted by customers per vector.
+
+    Weighting a vector by its customer count gives the same clusters as
+    running DBSCAN on every customer, while each neighbourhood query and
+    neighbour list only sees distinct vectors. Returns per-customer
+    'labels' (-1 for noise) and 'core' flags, and the number of distinct
+    'points'. As in any DBSCAN, a border customer within reach of two
+    clusters may join either.
+    """
+    def fit():
+        distinct = distinct_points(data_key, ml_data, features, decimals)
+        model = DBSCAN(eps=eps, min_samples=min_samples, algorithm=DBSCAN_ALGORITHM, n_jobs=job_cores())
+        model.fit(distinct['points'], sample_weight=distinct['counts'])
+        core = np.zeros(len(distinct['points']), dtype=bool)
+        core[model.core_sample_indices_] = True
+        return {
+            'labels': model.labels_[distinct['inverse']],
+            'core': core[distinct['inverse']],
+            'points': len(distinct['points']),
+        }
+    return cached_model(('dbscan', data_key, features, eps, min_samples, decimals), fit)
+
+
+def customer_table(transactions, as_of):
+    """RFM values and behavioural features of every customer from the purchases up to as_of."""
+    history = transactions_as_of(transactions, as_of)
+    rfm = compute_rfm(history, np.datetime64(as_of, 'D'), scores=False)
+    return rfm.merge(customer_features(history), on='CustomerID')
+
+
+def labelled_customers(transactions, as_of, horizon_days):
+    """Customer features as of as_of - horizon_days with what happened in the horizon after.
+
+    Churned is True for customers without a purchase in the horizon and
+    Future_Spend is what they spent in it, so no feature sees the outcome.
+    """
+    start = np.datetime64(as_of, 'D') - np.timedelta64(horizon_days, 'D')
+    labelled = customer_table(transactions, start)
+    dates = transactions['PurchaseDate']
+    later = transactions[(dates >= as_of_cutoff(start)) & (dates < as_of_cutoff(as_of))]
+    spend = later.groupby('CustomerID')['TransactionAmount'].sum()
+    labelled['Future_Spend'] = labelled['CustomerID'].map(spend).fillna(0.0)
+    labelled['Churned'] = ~labelled['CustomerID'].isin(later['CustomerID'])
+    return labelled
+
+
+def forest_params(n_rows):
+    """Random forest settings for n_rows training rows: fewer trees and bootstrap rows as data grows."""
+    trees = int(np.clip(FOREST_TREES * FOREST_FULL_ROWS / max(n_rows, 1), FOREST_MIN_TREES, FOREST_TREES))
+    return {
+        'n_estimators': trees,
+        'max_depth': FOREST_MAX_DEPTH,
+        'max_samples': min(1.0, FOREST_MAX_SAMPLES / max(n_rows, 1)),
+        'n_jobs': job_cores(),
+        **FOREST_PARAMS,
+    }
+
+
+def make_model(kind, engine, n_rows):
+    """Unfitted churn classifier or CLV regressor for the engine."""
+    if engine == 'Random Forest':
+        model = RandomForestClassifier if kind == 'churn' else RandomForestRegressor
+        return model(**forest_params(n_rows))
+    if engine == 'Histogram Gradient Boosting':
+        model = HistGradientBoostingClassifier if kind == 'churn' else HistGradientBoostingRegressor
+        return model(**BOOSTING_PARAMS)
+    raise ValueError(f"Unknown engine {engine!r}; expected one of {list(ENGINES)}")
+
+
+def train_model(kind, engine, labelled, current, progress=None):
+    """Fit a churn ('churn') or customer value ('clv') model and score the current customers.
+
+    labelled comes from labelled_customers and current from customer_table.
+    Returns the test 'metrics', feature 'importance', per-customer
+    'predictions' (churn probability or spend over the next horizon), the
+    'iterations' fitted (trees or boosting rounds), training 'rows' and
+    the seconds spent in each stage under 'timings'.
+    """
+    timings = {}
+    clock = time.perf_counter()
+
+    def stage(name, fraction):
+        nonlocal clock
+        now = time.perf_counter()
+        timings[name] = now - clock
+        clock = now
+        if progress is not None:
+            progress(fraction, f"{name} done")
+
+    X = labelled[PREDICTION_FEATURES].to_numpy(dtype=np.float64)
+    y = labelled[PREDICTION_TARGETS[kind]].to_numpy()
+    if kind == 'churn' and len(np.unique(y)) < 2:
+        raise ValueError("Every customer has the same churn outcome over this horizon; try another horizon or as-of date")
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=TEST_SIZE, random_state=42, stratify=y if kind == 'churn' else None)
+    stage('Split', 0.05)
+
+    model = make_model(kind, engine, len(X_train)).fit(X_train, y_train)
+    stage('Fit', 0.7)
+
+    if kind == 'churn':
+        probability = model.predict_proba(X_test)[:, 1]
+        metrics = {
+            'Accuracy': accuracy_score(y_test, probability >= 0.5),
+            'ROC AUC': roc_auc_score(y_test, probability) if len(np.unique(y_test)) > 1 else np.nan,
+            'Churn rate': float(np.mean(y)),
+        }
+    else:
+        predicted = model.predict(X_test)
+        metrics = {
+            'RMSE': float(np.sqrt(mean_squared_error(y_test, predicted))),
+            'MAE': mean_absolute_error(y_test, predicted),
+            'R2': r2_score(y_test, predicted),
+        }
+    stage('Evaluate', 0.8)
+
+    if hasattr(model, 'feature_importances_'):
+        importance = model.feature_importances_
+    else:
+        rows = np.random.default_rng(0).choice(len(X_test), min(IMPORTANCE_SAMPLE, len(X_test)), replace=False)
+        importance = permutation_importance(model, X_test[rows], y_test[rows], n_repeats=IMPORTANCE_REPEATS,
+                                            random_state=42, n_jobs=job_cores()).importances_mean
+    stage('Importance', 0.9)
+
+    X_current = current[PREDICTION_FEATURES].to_numpy(dtype=np.float64)
+    scores = model.predict_proba(X_current)[:, 1] if kind == 'churn' else np.maximum(model.predict(X_current), 0.0)
+    stage('Score', 1.0)
+
+    return {
+        'metrics': metrics,
+        'importance': pd.Series(importance, index=PREDICTION_FEATURES).sort_values(ascending=False),
+        'predictions': pd.DataFrame({'CustomerID': current['CustomerID'].to_numpy(), 'Prediction': scores}),
+        'iterations': model.n_estimators if engine == 'Random Forest' else model.n_iter_,
+        'rows': len(X_train),
+        'timings': timings,
+    }
+
+
+def job_key(job, data_key, *args):
+    """Key of a background ML job: the job, the data version, its arguments and the fit settings."""
+    settings = (SWEEP_K, tuple(MINIBATCH_PARAMS.items()), MICRO_CLUSTERS, SILHOUETTE_SAMPLE, SILHOUETTE_REPEATS,
+                tuple(PREDICTION_FEATURES), FOREST_TREES, FOREST_MIN_TREES, FOREST_FULL_ROWS, FOREST_MAX_DEPTH,
+                FOREST_MAX_SAMPLES, tuple(FOREST_PARAMS.items()), tuple(BOOSTING_PARAMS.items()))
+    return (job.__name__, data_key, args, settings)
+
+
+def _job_data(path, as_of):
+    # Jobs load the data in the worker instead of pickling it from the page
+    return (*file_fingerprint(path), as_of), load_ml_data(as_of, path)
+
+
+def sweep_job(path, as_of, features):
+    """kmeans_sweep as a background job (see jobs.submit_job)."""
+    data_key, ml_data = _job_data(path, as_of)
+    return kmeans_sweep(data_key, ml_data, features, progress=report_progress)
+
+
+def hierarchical_job(path, as_of, features):
+    """hierarchical_tree as a background job (see jobs.submit_job)."""
+    data_key, ml_data = _job_data(path, as_of)
+    return hierarchical_tree(data_key, ml_data, features, progress=report_progress)
+
+
+def training_job(path, as_of, kind, engine, horizon_days):
+    """train_model on the transactions up to as_of as a background job (see jobs.submit_job)."""
+    start = time.perf_counter()
+    transactions = load_transactions(path)
+    labelled = labelled_customers(transactions, as_of, horizon_days)
+    current = customer_table(transactions, as_of)
+    load_seconds = time.perf_counter() - start
+    report_progress(0.02, "Features built")
+    result = train_model(kind, engine, labelled, current, progress=report_progress)
+    result['timings'] = {'Features': load_seconds, **result['timings']}
+    return result
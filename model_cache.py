@@ -0,0 +1,123 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Upper bound on the memory held by cached models, matrices and predictions
+MODEL_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def size_of(value, _seen=None):
+    """Approximate bytes held by value: arrays, frames and the attributes of fitted estimators."""
+    if _seen is None:
+        _seen = set()
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    if isinstance(value, dict):
+        return sum(size_of(item, _seen) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(size_of(item, _seen) for item in value)
+    if hasattr(value, '__dict__'):
+        return sys.getsizeof(value) + size_of(vars(value), _seen)
+    return sys.getsizeof(value)
+
+
+class SizedLRU:
+    """Thread-safe cache that evicts its least recently used entries beyond a total size.
+
+    size_of(value) gives the size each entry counts against max_bytes. A
+    value larger than max_bytes on its own is returned uncached. Cached
+    values are shared between reruns and sessions, so callers must not
+    modify them.
+    """
+
+    def __init__(self, max_bytes, size_of):
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        # key -> (value, bytes), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'bytes': 0, 'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key, build, max_bytes=None):
+        """Return the value stored under key, calling build() and storing its result on a miss."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return self._entries[key][0]
+            self._stats['misses'] += 1
+
+        value = build()
+        nbytes = self.size_of(value)
+        if nbytes > max_bytes:
+            return value
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, nbytes)
+                self._stats['bytes'] += nbytes
+            while self._stats['bytes'] > max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._stats['bytes'] -= evicted
+                self._stats['evictions'] += 1
+            return self._entries[key][0] if key in self._entries else value
+
+    def lookup(self, key, default=None):
+        """The value stored under key, or default on a miss; nothing is built."""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return self._entries[key][0]
+
+    def info(self):
+        """Entries, bytes held, hits, misses and evictions."""
+        with self._lock:
+            return {'entries': len(self._entries), **self._stats}
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._stats['bytes'] = 0
+
+
+_models = SizedLRU(MODEL_CACHE_BYTES, size_of)
+
+
+def cached_model(key, fit, max_bytes=MODEL_CACHE_BYTES):
+    """Return the value stored under key, calling fit() and storing its result on a miss.
+
+    key must be hashable and should name everything the result depends on:
+    the kind of model, the data version, the feature set and hyperparameters.
+    Least recently used entries are evicted once the cache holds more than
+    max_bytes; a result larger than that on its own is returned uncached.
+    Cached values are shared between reruns and sessions, so callers must
+    not modify them.
+    """
+    return _models.get(key, fit, max_bytes)
+
+
+def lookup_model(key, default=None):
+    """The value cached under key, or default on a miss; nothing is fitted."""
+    return _models.lookup(key, default)
+
+
+def model_cache_info():
+    """Entries, bytes held, hits, misses and evictions of the model cache."""
+    return _models.info()
+
+
+def clear_model_cache():
+    """Drop every cached model."""
+    _models.clear()
@@ -0,0 +1,111 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from data_access import DATA_FILE, file_fingerprint, load_transactions
+from search_index import load_search_index, search as search_rows
+
+@lru_cache(maxsize=2)
+def _sort_keys(path, mtime_ns, size):
+    # Row order by (PurchaseDate, OrderID) then file position, the sorted key columns and each row's rank
+    data = load_transactions(path)
+    dates = data['PurchaseDate'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    orders = data['OrderID'].to_numpy()
+    order = np.lexsort((orders, dates))
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return {'order': order, 'dates': dates[order], 'orders': orders[order], 'rank': rank}
+
+
+def _stats(data, rows, ranks, keys):
+    if rows is not None and not len(rows):
+        return {'records': 0, 'customers': 0, 'first_date': None, 'last_date': None, 'revenue': 0.0}
+    customers = data['CustomerID'].to_numpy()
+    amounts = data['TransactionAmount'].to_numpy()
+    if rows is not None:
+        customers, amounts = customers[rows], amounts[rows]
+    first = keys['dates'][0 if ranks is None else ranks[0]]
+    last = keys['dates'][-1 if ranks is None else ranks[-1]]
+    return {
+        'records': len(customers),
+        'customers': len(pd.unique(customers)),
+        'first_date': pd.Timestamp(first),
+        'last_date': pd.Timestamp(last),
+        'revenue': float(amounts.sum()),
+    }
+
+
+@lru_cache(maxsize=32)
+def _filtered(path, mtime_ns, size, search):
+    # Sorted ranks of the rows matching search (None for all rows) and their stats
+    data = load_transactions(path)
+    keys = _sort_keys(path, mtime_ns, size)
+    rows = ranks = None
+    if search:
+        rows = search_rows(load_search_index(path), search)
+        ranks = np.sort(keys['rank'][rows])
+    return ranks, _stats(data, rows, ranks, keys)
+
+
+def _key_rank(keys, cursor, side):
+    # Position of a (PurchaseDate, OrderID, rank) cursor in the full sort order.
+    # The lines of one order share its date and OrderID, so the rank breaks
+    # the tie; it is clamped to the rows with that date and OrderID in case
+    # the file changed since the cursor was taken.
+    date = pd.Timestamp(cursor[0]).as_unit('ns').value
+    lo = np.searchsorted(keys['dates'], date, side='left')
+    hi = np.searchsorted(keys['dates'], date, side='right')
+    first = lo + np.searchsorted(keys['orders'][lo:hi], cursor[1], side='left')
+    last = lo + np.searchsorted(keys['orders'][lo:hi], cursor[1], side='right')
+    return int(np.clip(cursor[2] + (side == 'right'), first, last))
+
+
+def query_page(path=DATA_FILE, search=None, rows_per_page=10, after=None, before=None, page=0):
+    """One page of preview rows plus statistics for the whole filtered set.
+
+    Rows are ordered by (PurchaseDate, OrderID), the lines of an order in
+    file order. Pass the last key of the current page as after (or the
+    first key as before) for keyset paging; otherwise page selects a page
+    by number. Only the requested rows are materialized, and the filter
+    result and its statistics are cached per file version and search term.
+
+    Returns a dict with 'rows', 'start' (position of the first row), 'page',
+    'pages', 'first_key', 'last_key' ((PurchaseDate, OrderID, rank) keys)
+    and 'stats' (records, customers, first_date, last_date, revenue).
+    """
+    fingerprint = file_fingerprint(path)
+    keys = _sort_keys(*fingerprint)
+    ranks, stats = _filtered(*fingerprint, search or None)
+    total = stats['records']
+
+    def filtered_position(rank):
+        return rank if ranks is None else np.searchsorted(ranks, rank)
+
+    if after is not None:
+        start = int(filtered_position(_key_rank(keys, after, 'right')))
+    elif before is not None:
+        start = max(int(filtered_position(_key_rank(keys, before, 'left'))) - rows_per_page, 0)
+    else:
+        start = page * rows_per_page
+    start = min(start, max(total - 1, 0))
+    stop = min(start + rows_per_page, total)
+
+    if ranks is None:
+        page_ranks = np.arange(start, stop)
+    else:
+        page_ranks = ranks[start:stop]
+    rows = load_transactions(path).take(keys['order'][page_ranks])
+
+    def key_at(rank):
+        return pd.Timestamp(keys['dates'][rank]), int(keys['orders'][rank]), int(rank)
+
+    return {
+        'rows': rows,
+        'start': start,
+        'page': start // rows_per_page,
+        'pages': max(-(-total // rows_per_page), 1),
+        'first_key': key_at(page_ranks[0]) if len(page_ranks) else None,
+        'last_key': key_at(page_ranks[-1]) if len(page_ranks) else None,
+        'stats': stats,
+    }
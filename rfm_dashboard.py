@@ -4,17 +4,16 @@ import plotly.express as px
 import streamlit as st
 import streamlit.components.v1 as components
 import numpy as np
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.cluster import KMeans, DBSCAN
-from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
-from sklearn.metrics import silhouette_score, accuracy_score, classification_report, mean_squared_error
-from sklearn.model_selection import train_test_split
-from scipy.cluster.hierarchy import linkage, dendrogram
-import matplotlib.pyplot as plt
 import plotly.graph_objects as go
-from prophet import Prophet
 from collections import defaultdict, Counter
-from mlxtend.frequent_patterns import apriori, association_rules
+from charts import box_figure, histogram_figure, scatter_figure
+from data_access import DATA_FILE, file_fingerprint
+from figure_cache import cached_figure
+from jobs import job_id, job_status, submit_job
+from rfm_engine import quartiles, revenue_trend, segment_transitions
+from snapshot import load_as_of_tables, load_ml_data, load_revenue_tables, load_rfm_history, purchase_date_range
+from time_buckets import GRANULARITIES, period_ends
+from pagination import query_page
 
 # Set page configuration
 st.set_page_config(
@@ -98,6 +97,54 @@ if 'current_page' not in st.session_state:
 def change_page(page):
     st.session_state.current_page = page
 
+def set_page_cursor(cursor):
+    st.session_state.page_cursor = cursor
+
+def set_as_of():
+    st.session_state.as_of = st.session_state.as_of_input
+
+# Progress of a background job, refreshed every second without rerunning the page
+@st.fragment(run_every=1)
+def show_job_progress(key, label):
+    status = job_status(key)
+    if status['state'] == 'running':
+        st.progress(status['fraction'], text=f"{label}: {status['message']}")
+    else:
+        st.rerun()
+
+# Long ML fits run in the worker pool; returns the result once finished, else None
+def background_job(key, func, *args, label="Working"):
+    status = job_status(key)
+    if status['state'] == 'idle':
+        submit_job(key, func, *args)
+        status = job_status(key)
+    if status['state'] == 'done':
+        return status['result']
+    if status['state'] == 'failed':
+        st.error(f"{label} failed: {status['error']}")
+        st.button("Retry", key=f"retry_{job_id(key)}", on_click=submit_job, args=(key, func, *args))
+        return None
+    show_job_progress(key, label)
+    return None
+
+# Shared "as of" date for recency; the latest purchase by default
+def as_of_date(file_path=DATA_FILE):
+    first, last = purchase_date_range(file_path)
+    latest_allowed = max(dt.date.today(), last)
+    if 'as_of' not in st.session_state:
+        st.session_state.as_of = last
+    st.session_state.as_of = min(max(st.session_state.as_of, first), latest_allowed)
+    st.sidebar.date_input(
+        "As of date:",
+        value=st.session_state.as_of,
+        min_value=first,
+        max_value=latest_allowed,
+        key='as_of_input',
+        on_change=set_as_of,
+        help="Recency is counted back from this date and later purchases are ignored."
+    )
+    return st.session_state.as_of
+
 # Enhanced navigation function
 def show_navigation():
     st.sidebar.title("📱 Navigation")
@@ -140,26 +187,13 @@ def show_navigation():
 def show_dashboard():
     st.title("📊 RFM Analysis Dashboard")
     
-    # Load the data
-    df = pd.read_csv('rfm_data.csv')
-    
-    # Convert PurchaseDate to datetime
-    df['PurchaseDate'] = pd.to_datetime(df['PurchaseDate'])
-    
-    # Define reference date for recency calculation
-    reference_date = dt.datetime(2023, 7, 1)
-    
-    # Calculate RFM metrics
-    rfm = df.groupby('CustomerID').agg({
-        'PurchaseDate': lambda x: (reference_date - x.max()).days,
-        'OrderID': 'count',
-        'TransactionAmount': 'sum'
-    }).reset_index()
+    # RFM metrics, scores and segments as of the selected date
+    as_of = as_of_date()
+    tables = load_as_of_tables(as_of)
+    rfm = tables['rfm'].rename(columns={'Segment': 'Customer_Segment'})
     
-    rfm.columns = ['CustomerID', 'Recency', 'Frequency', 'Monetary']
-    
-    # Filter out non-positive monetary values
-    rfm = rfm[rfm['Monetary'] > 0]
+    # Figures are cached per data version and as-of date
+    version = (*file_fingerprint(DATA_FILE), as_of)
     
     # Create three columns for key metrics
     col1, col2, col3 = st.columns(3)
@@ -192,50 +226,23 @@ def show_dashboard():
     
     with col1:
         st.subheader("Customer Distribution by RFM Score")
-        # Calculate RFM score
-        rfm['R_Score'] = pd.qcut(rfm['Recency'], 4, ['1', '2', '3', '4'])
-        rfm['F_Score'] = pd.qcut(rfm['Frequency'].rank(method='first'), 4, ['4', '3', '2', '1'])
-        rfm['M_Score'] = pd.qcut(rfm['Monetary'], 4, ['4', '3', '2', '1'])
-        rfm['RFM_Score'] = rfm[['R_Score', 'F_Score', 'M_Score']].sum(axis=1).astype(int)
-        
-        fig = px.histogram(rfm, x='RFM_Score', nbins=20,
-                          title='Distribution of Customer RFM Scores')
-        fig.update_layout(height=400)
+        fig = cached_figure(('dashboard_scores', version), lambda: histogram_figure(
+            rfm, 'RFM_Score', nbins=20, title='Distribution of Customer RFM Scores'
+        ).update_layout(height=400))
         st.plotly_chart(fig, use_container_width=True)
     
     with col2:
         st.subheader("Customer Value vs Recency")
-        fig = px.scatter(rfm, x='Recency', y='Monetary',
-                        title='Customer Value vs Recency',
-                        color='RFM_Score')
-        fig.update_layout(height=400)
+        fig = cached_figure(('dashboard_value_recency', version), lambda: scatter_figure(
+            rfm, x='Recency', y='Monetary', title='Customer Value vs Recency', color='RFM_Score'
+        ).update_layout(height=400))
         st.plotly_chart(fig, use_container_width=True)
     
     # Customer Segments Analysis
     st.subheader("Customer Segments Analysis")
-    # Define RFM segments
-    def rfm_segment(df):
-        if df['RFM_Score'] >= 9:
-            return 'Champions'
-        elif df['RFM_Score'] >= 8:
-            return 'Loyal Customers'
-        elif df['RFM_Score'] >= 7:
-            return 'Potential Loyalists'
-        elif df['RFM_Score'] >= 6:
-            return 'Recent Customers'
-        elif df['RFM_Score'] >= 5:
-            return 'Promising'
-        elif df['RFM_Score'] >= 4:
-            return 'Need Attention'
-        elif df['RFM_Score'] >= 3:
-            return 'At Risk'
-        else:
-            return 'Lost'
-    
-    rfm['Customer_Segment'] = rfm.apply(rfm_segment, axis=1)
     segments = rfm['Customer_Segment'].value_counts()
-    fig = px.pie(values=segments.values, names=segments.index,
-                 title='Distribution of Customer Segments')
+    fig = cached_figure(('dashboard_segments', version), lambda: px.pie(
+        values=segments.values, names=segments.index, title='Distribution of Customer Segments'))
     st.plotly_chart(fig, use_container_width=True)
     
     # Top Customers Table
@@ -294,56 +301,15 @@ def show_rfm_analysis():
         return translations.get(language, translations['English'])
 
     # Load data
-    file_path = 'rfm_data.csv'  # Change this to the actual path if necessary
-    data = pd.read_csv(file_path)
-
-    # Convert PurchaseDate to datetime
-    data['PurchaseDate'] = pd.to_datetime(data['PurchaseDate'])
-
-    # Define reference date for recency calculation
-    reference_date = dt.datetime(2023, 7, 1)
-
-    # Calculate RFM metrics
-    rfm = data.groupby('CustomerID').agg({
-        'PurchaseDate': lambda x: (reference_date - x.max()).days,
-        'OrderID': 'count',
-        'TransactionAmount': 'sum'
-    }).reset_index()
-
-    rfm.columns = ['CustomerID', 'Recency', 'Frequency', 'Monetary']
-
-    # Filter out non-positive monetary values
-    rfm = rfm[rfm['Monetary'] > 0]
-
-    # Define RFM score thresholds
-    rfm['R_Score'] = pd.qcut(rfm['Recency'], 4, ['1', '2', '3', '4'])
-    rfm['F_Score'] = pd.qcut(rfm['Frequency'].rank(method='first'), 4, ['4', '3', '2', '1'])
-    rfm['M_Score'] = pd.qcut(rfm['Monetary'], 4, ['4', '3', '2', '1'])
-
-    # Concatenate RFM score to a single RFM segment
-    rfm['RFM_Segment'] = rfm['R_Score'].astype(str) + rfm['F_Score'].astype(str) + rfm['M_Score'].astype(str)
-    rfm['RFM_Score'] = rfm[['R_Score', 'F_Score', 'M_Score']].sum(axis=1).astype(int)
-
-    # Define RFM segments
-    def rfm_segment(df):
-        if df['RFM_Score'] >= 9:
-            return 'Champions'
-        elif df['RFM_Score'] >= 8:
-            return 'Loyal Customers'
-        elif df['RFM_Score'] >= 7:
-            return 'Potential Loyalists'
-        elif df['RFM_Score'] >= 6:
-            return 'Recent Customers'
-        elif df['RFM_Score'] >= 5:
-            return 'Promising'
-        elif df['RFM_Score'] >= 4:
-            return 'Need Attention'
-        elif df['RFM_Score'] >= 3:
-            return 'At Risk'
-        else:
-            return 'Lost'
+    file_path = DATA_FILE  # set with the RFM_DATA_FILE environment variable
 
-    rfm['RFM_Segment'] = rfm.apply(rfm_segment, axis=1)
+    # RFM metrics, scores, segments and monthly rollup as of the selected date
+    as_of = as_of_date(file_path)
+    tables = load_as_of_tables(as_of, file_path)
+    rfm = tables['rfm'].rename(columns={'Segment': 'RFM_Segment'})
+    
+    # Figures depend on the data and as-of date only, not on the theme or language
+    version = (*file_fingerprint(file_path), as_of)
 
     # Count of customers in each segment
     segment_counts = rfm['RFM_Segment'].value_counts().reset_index()
@@ -997,7 +963,7 @@ def show_rfm_analysis():
     # Data Preview Button with Toggle and Enhanced Display
     if 'data_preview' not in st.session_state:
         st.session_state.data_preview = False
-        st.session_state.page_number = 0
+        st.session_state.page_cursor = {}
         st.session_state.rows_per_page = 10
         st.session_state.search_term = ""
 
@@ -1017,56 +983,60 @@ def show_rfm_analysis():
     if st.session_state.data_preview:
         # Search functionality with enhanced styling
         st.markdown("<div class='search-container'>", unsafe_allow_html=True)
-        search = st.text_input('🔍 Search in data:', key='search_input')
+        search = st.text_input('🔍 Search in data:', key='search_input', placeholder='e.g. Tokyo or location:Tokyo')
         st.markdown("</div>", unsafe_allow_html=True)
         
-        # Filter data based on search term
-        if search:
-            filtered_data = data[data.astype(str).apply(lambda x: x.str.contains(search, case=False)).any(axis=1)]
-        else:
-            filtered_data = data
+        # Start from the first page whenever the search term changes
+        if search != st.session_state.search_term:
+            st.session_state.search_term = search
+            st.session_state.page_cursor = {}
+
+        rows_per_page = st.select_slider('Rows per page:', options=[10, 25, 50, 100], key='rows_per_page')
+
+        # Fetch only the current page; "Tokyo" or "location:Tokyo" filters the rows
+        result = query_page(file_path, search, rows_per_page, **st.session_state.page_cursor)
+        page_data = result['rows']
+        stats = result['stats']
+        start_idx = result['start']
 
         # Pagination with enhanced styling
-        total_pages = len(filtered_data) // st.session_state.rows_per_page
-        
         st.markdown("<div class='pagination-container'>", unsafe_allow_html=True)
         col1, col2, col3 = st.columns([1, 2, 1])
         
         with col1:
-            if st.button('◀ Previous', disabled=st.session_state.page_number == 0):
-                st.session_state.page_number -= 1
+            st.button('◀ Previous', disabled=start_idx == 0,
+                      on_click=set_page_cursor, args=({'before': result['first_key']},))
         
         with col2:
-            st.markdown(f"<p class='page-info'>Page {st.session_state.page_number + 1} of {total_pages + 1}</p>", unsafe_allow_html=True)
+            st.markdown(f"<p class='page-info'>Page {result['page'] + 1} of {result['pages']}</p>", unsafe_allow_html=True)
         
         with col3:
-            if st.button('Next ▶', disabled=st.session_state.page_number >= total_pages):
-                st.session_state.page_number += 1
+            st.button('Next ▶', disabled=start_idx + len(page_data) >= stats['records'],
+                      on_click=set_page_cursor, args=({'after': result['last_key']},))
         st.markdown("</div>", unsafe_allow_html=True)
 
-        # Display paginated data
-        start_idx = st.session_state.page_number * st.session_state.rows_per_page
-        end_idx = start_idx + st.session_state.rows_per_page
-        
         # Show data with styling
         st.markdown("<div class='data-preview-container'>", unsafe_allow_html=True)
         st.dataframe(
-            filtered_data.iloc[start_idx:end_idx],
+            page_data,
             height=400
         )
         st.markdown("</div>", unsafe_allow_html=True)
 
         # Display data statistics with enhanced styling
+        date_range = "-"
+        if stats['records']:
+            date_range = f"{stats['first_date'].strftime('%Y-%m-%d')} to {stats['last_date'].strftime('%Y-%m-%d')}"
         st.markdown("<div class='stats-container'>", unsafe_allow_html=True)
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("📊 Total Records", len(filtered_data))
+            st.metric("📊 Total Records", stats['records'])
         with col2:
-            st.metric("👥 Unique Customers", filtered_data['CustomerID'].nunique())
+            st.metric("👥 Unique Customers", stats['customers'])
         with col3:
-            st.metric("📅 Date Range", f"{filtered_data['PurchaseDate'].min().strftime('%Y-%m-%d')} to {filtered_data['PurchaseDate'].max().strftime('%Y-%m-%d')}")
+            st.metric("📅 Date Range", date_range)
         with col4:
-            st.metric("💰 Total Revenue", f"${filtered_data['TransactionAmount'].sum():,.2f}")
+            st.metric("💰 Total Revenue", f"${stats['revenue']:,.2f}")
         st.markdown("</div>", unsafe_allow_html=True)
 
     # Metrics
@@ -1104,7 +1074,8 @@ def show_rfm_analysis():
         "Customer Value Distribution",
         "Segment Performance Metrics",
         "Customer Loyalty Trends",
-        "Revenue Impact Analysis"
+        "Revenue Impact Analysis",
+        "Segment Migration"
     ])
 
     # Add settings section below analysis options in the sidebar
@@ -1215,15 +1186,14 @@ def show_rfm_analysis():
         """, unsafe_allow_html=True)
         
         # Bar chart of segment counts
-        fig_bar = px.bar(
+        fig_bar = cached_figure(('rfm_segments', version), lambda: update_graph_layout(px.bar(
             segment_counts, 
             x='RFM_Segment', 
             y='Count',
             color='RFM_Segment',
             color_discrete_sequence=px.colors.qualitative.Bold,
             title='Customer Distribution Across Segments'
-        )
-        fig_bar = update_graph_layout(fig_bar)
+        )))
         
         st.plotly_chart(fig_bar, use_container_width=True)
 
@@ -1251,31 +1221,30 @@ def show_rfm_analysis():
         purchase_freq = pd.DataFrame(rfm['Frequency'].value_counts()).reset_index()
         purchase_freq.columns = ['Purchase Count', 'Number of Customers']
         
-        fig_freq = px.bar(
+        fig_freq = cached_figure(('rfm_frequency', version), lambda: update_graph_layout(px.bar(
             purchase_freq,
             x='Purchase Count',
             y='Number of Customers',
             title='Purchase Frequency Distribution',
             color='Number of Customers',
             color_continuous_scale='Viridis'
-        )
-        fig_freq = update_graph_layout(fig_freq)
+        )))
         
         st.plotly_chart(fig_freq, use_container_width=True)
 
         # Purchase timing analysis
-        data['Month'] = data['PurchaseDate'].dt.month
-        monthly_purchases = data.groupby('Month')['OrderID'].count().reset_index()
+        monthly_revenue = tables['monthly_revenue']
+        purchase_month = pd.to_datetime(monthly_revenue['Month']).dt.month
+        monthly_purchases = monthly_revenue.groupby(purchase_month)['Number_of_Orders'].sum().reset_index()
+        monthly_purchases.columns = ['Month', 'OrderID']
         
-        fig_monthly = px.line(
+        fig_monthly = cached_figure(('rfm_monthly_purchases', version), lambda: update_graph_layout(px.line(
             monthly_purchases,
             x='Month',
             y='OrderID',
             title='Monthly Purchase Trends',
             markers=True
-        )
-        fig_monthly.update_traces(line_color='#1f77b4')
-        fig_monthly = update_graph_layout(fig_monthly)
+        ).update_traces(line_color='#1f77b4')))
         
         st.plotly_chart(fig_monthly, use_container_width=True)
 
@@ -1288,32 +1257,29 @@ def show_rfm_analysis():
         """, unsafe_allow_html=True)
         
         # Monetary value distribution
-        fig_monetary = px.histogram(
+        fig_monetary = cached_figure(('rfm_monetary', version), lambda: update_graph_layout(histogram_figure(
             rfm,
-            x='Monetary',
+            'Monetary',
             nbins=30,
             title='Customer Spending Distribution',
-            color_discrete_sequence=['#2575fc']
-        )
-        fig_monetary = update_graph_layout(fig_monetary)
+            color='#2575fc'
+        )))
         
         st.plotly_chart(fig_monetary, use_container_width=True)
 
-        # Value segments - Fix for the pie chart error
-        value_segments = pd.qcut(rfm['Monetary'], q=4, labels=['Bronze', 'Silver', 'Gold', 'Platinum'])
+        # Value segments; ties are ranked apart when few customers share few spend values
+        value_segments = quartiles(rfm['Monetary'], ['Bronze', 'Silver', 'Gold', 'Platinum'])
         value_dist = pd.DataFrame(value_segments.value_counts())
         value_dist.reset_index(inplace=True)
         value_dist.columns = ['Category', 'Count']
         
-        fig_value = px.pie(
+        fig_value = cached_figure(('rfm_value_segments', version), lambda: update_graph_layout(px.pie(
             value_dist,
             values='Count',
             names='Category',
             title='Customer Value Segments',
             color_discrete_sequence=px.colors.sequential.Viridis
-        )
-        fig_value.update_traces(textfont_color='black')
-        fig_value = update_graph_layout(fig_value)
+        ).update_traces(textfont_color='black')))
         
         st.plotly_chart(fig_value, use_container_width=True)
 
@@ -1336,15 +1302,14 @@ def show_rfm_analysis():
         segment_metrics = segment_metrics.reset_index()
         
         # Revenue contribution
-        fig_revenue = px.bar(
+        fig_revenue = cached_figure(('rfm_segment_revenue', version), lambda: update_graph_layout(px.bar(
             segment_metrics,
             x='RFM_Segment',
             y='Total Revenue',
             title='Revenue Contribution by Segment',
             color='RFM_Segment',
             color_discrete_sequence=px.colors.qualitative.Bold
-        )
-        fig_revenue = update_graph_layout(fig_revenue)
+        )))
         
         st.plotly_chart(fig_revenue, use_container_width=True)
 
@@ -1357,29 +1322,26 @@ def show_rfm_analysis():
         """, unsafe_allow_html=True)
         
         # Recency distribution
-        fig_recency = px.histogram(
+        fig_recency = cached_figure(('rfm_recency', version), lambda: update_graph_layout(histogram_figure(
             rfm,
-            x='Recency',
+            'Recency',
             nbins=30,
             title='Customer Recency Distribution',
-            color_discrete_sequence=['#6a11cb']
-        )
-        fig_recency = update_graph_layout(fig_recency)
+            color='#6a11cb'
+        )))
         
         st.plotly_chart(fig_recency, use_container_width=True)
 
         # Loyalty score calculation
         rfm['Loyalty_Score'] = (rfm['Frequency'] * 0.5 + rfm['Monetary'] * 0.3 + (100 - rfm['Recency']) * 0.2)
         
-        fig_loyalty = px.box(
+        fig_loyalty = cached_figure(('rfm_loyalty', version), lambda: update_graph_layout(box_figure(
             rfm,
-            x='RFM_Segment',
-            y='Loyalty_Score',
+            'RFM_Segment',
+            'Loyalty_Score',
             title='Loyalty Score by Segment',
-            color='RFM_Segment',
-            color_discrete_sequence=px.colors.qualitative.Bold
-        )
-        fig_loyalty = update_graph_layout(fig_loyalty)
+            colors=px.colors.qualitative.Bold
+        )))
         
         st.plotly_chart(fig_loyalty, use_container_width=True)
 
@@ -1392,17 +1354,16 @@ def show_rfm_analysis():
         """, unsafe_allow_html=True)
         
         # Revenue trends
-        monthly_revenue = data.groupby(data['PurchaseDate'].dt.strftime('%Y-%m'))['TransactionAmount'].sum().reset_index()
+        monthly_revenue = tables['monthly_revenue'][['Month', 'Total_Revenue']]
+        monthly_revenue.columns = ['PurchaseDate', 'TransactionAmount']
         
-        fig_revenue_trend = px.line(
+        fig_revenue_trend = cached_figure(('rfm_revenue_trend', version), lambda: update_graph_layout(px.line(
             monthly_revenue,
             x='PurchaseDate',
             y='TransactionAmount',
             title='Monthly Revenue Trends',
             markers=True
-        )
-        fig_revenue_trend.update_traces(line_color='#1f77b4')
-        fig_revenue_trend = update_graph_layout(fig_revenue_trend)
+        ).update_traces(line_color='#1f77b4')))
         
         st.plotly_chart(fig_revenue_trend, use_container_width=True)
 
@@ -1410,15 +1371,13 @@ def show_rfm_analysis():
         segment_revenue = rfm.groupby('RFM_Segment')['Monetary'].sum().reset_index()
         segment_revenue['Percentage'] = (segment_revenue['Monetary'] / segment_revenue['Monetary'].sum() * 100).round(1)
         
-        fig_revenue_pie = px.pie(
+        fig_revenue_pie = cached_figure(('rfm_revenue_share', version), lambda: update_graph_layout(px.pie(
             segment_revenue,
             values='Monetary',
             names='RFM_Segment',
             title='Revenue Contribution by Segment',
             color_discrete_sequence=px.colors.qualitative.Bold
-        )
-        fig_revenue_pie.update_traces(textfont_color='black')
-        fig_revenue_pie = update_graph_layout(fig_revenue_pie)
+        ).update_traces(textfont_color='black')))
         
         st.plotly_chart(fig_revenue_pie, use_container_width=True)
 
@@ -1432,6 +1391,49 @@ def show_rfm_analysis():
                 f"{row['Percentage']}% of total revenue"
             )
 
+    elif analysis_type == "Segment Migration":
+        st.markdown("""
+            <div class='segment'>
+                <h3>Segment Migration</h3>
+                <p>Follow customers between segments from one period end to the next, up to the selected as-of date.</p>
+            </div>
+        """, unsafe_allow_html=True)
+        
+        # RFM at every period end, computed in one pass over the purchase history
+        period = st.radio("Compare every:", ['W', 'M', 'Q'], index=1,
+                          format_func=GRANULARITIES.get, horizontal=True)
+        first_purchase, _ = purchase_date_range(file_path)
+        history = load_rfm_history(period_ends(first_purchase, as_of, period), file_path)
+        transitions = segment_transitions(history)
+        
+        if transitions.empty:
+            st.info("Pick a later as-of date or a shorter period to compare at least two period ends.")
+        else:
+            # One node per (period end, segment), linked by the customers moving between them
+            nodes = pd.concat([
+                transitions[['FromAsOf', 'From']].set_axis(['AsOf', 'Segment'], axis=1),
+                transitions[['ToAsOf', 'To']].set_axis(['AsOf', 'Segment'], axis=1),
+            ]).drop_duplicates(ignore_index=True)
+            node_ids = pd.MultiIndex.from_frame(nodes)
+            fig_migration = cached_figure(('rfm_migration', version, period), lambda: update_graph_layout(go.Figure(go.Sankey(
+                node=dict(
+                    label=[f"{segment} ({date:%Y-%m-%d})" for date, segment in node_ids],
+                    pad=15,
+                    thickness=20
+                ),
+                link=dict(
+                    source=node_ids.get_indexer(pd.MultiIndex.from_frame(transitions[['FromAsOf', 'From']])),
+                    target=node_ids.get_indexer(pd.MultiIndex.from_frame(transitions[['ToAsOf', 'To']])),
+                    value=transitions['Customers']
+                )
+            )).update_layout(title='Customer Flow Between Segments', height=600)))
+            
+            st.plotly_chart(fig_migration, use_container_width=True)
+            
+            # Latest step as a from/to matrix
+            latest_step = transitions[transitions['ToAsOf'] == transitions['ToAsOf'].max()]
+            st.dataframe(latest_step.pivot_table(index='From', columns='To', values='Customers', fill_value=0))
+
     # Concluding Lines
     st.markdown("""
     <div class='segment'>
@@ -1491,18 +1493,13 @@ def show_rfm_analysis():
 def show_customers_analysis():
     st.title("👥 Customer Analysis")
     
-    # Load the data
-    df = pd.read_csv('rfm_data.csv')
-    df['PurchaseDate'] = pd.to_datetime(df['PurchaseDate'])
-    
-    # Calculate customer metrics
-    customer_metrics = df.groupby('CustomerID').agg({
-        'OrderID': 'count',
-        'TransactionAmount': 'sum',
-        'PurchaseDate': lambda x: (df['PurchaseDate'].max() - x.max()).days
-    }).reset_index()
+    # Customer metrics and monthly rollup as of the selected date
+    as_of = as_of_date()
+    tables = load_as_of_tables(as_of)
+    customer_metrics = tables['customer_metrics'].copy()
     
-    customer_metrics.columns = ['CustomerID', 'Total_Orders', 'Total_Spent', 'Days_Since_Last_Purchase']
+    # Figures are cached per data version and as-of date
+    version = (*file_fingerprint(DATA_FILE), as_of)
     
     # Create three columns for key metrics
     col1, col2, col3 = st.columns(3)
@@ -1534,10 +1531,9 @@ def show_customers_analysis():
     st.subheader("Customer Segments Analysis")
     
     # Define customer segments based on spending
-    customer_metrics['Segment'] = pd.qcut(
+    customer_metrics['Segment'] = quartiles(
         customer_metrics['Total_Spent'],
-        q=4,
-        labels=['Bronze', 'Silver', 'Gold', 'Platinum']
+        ['Bronze', 'Silver', 'Gold', 'Platinum']
     )
     
     # Create two columns for charts
@@ -1546,45 +1542,37 @@ def show_customers_analysis():
     with col1:
         # Customer segment distribution
         segment_counts = customer_metrics['Segment'].value_counts()
-        fig = px.pie(
+        fig = cached_figure(('customers_segments', version), lambda: px.pie(
             values=segment_counts.values,
             names=segment_counts.index,
             title='Customer Distribution by Segment'
-        )
-        fig.update_layout(height=400)
+        ).update_layout(height=400))
         st.plotly_chart(fig, use_container_width=True)
     
     with col2:
         # Average value by segment
         segment_avg = customer_metrics.groupby('Segment')['Total_Spent'].mean()
-        fig = px.bar(
+        fig = cached_figure(('customers_segment_value', version), lambda: px.bar(
             x=segment_avg.index,
             y=segment_avg.values,
             title='Average Customer Value by Segment'
-        )
-        fig.update_layout(height=400)
+        ).update_layout(height=400))
         st.plotly_chart(fig, use_container_width=True)
     
     # Customer Activity Timeline
     st.subheader("Customer Activity Timeline")
     
     # Monthly customer activity
-    monthly_activity = df.groupby(df['PurchaseDate'].dt.strftime('%Y-%m')).agg({
-        'CustomerID': 'nunique',
-        'OrderID': 'count',
-        'TransactionAmount': 'sum'
-    }).reset_index()
-    
+    monthly_activity = tables['monthly_revenue'][['Month', 'Active_Customers', 'Number_of_Orders', 'Total_Revenue']]
     monthly_activity.columns = ['Month', 'Active_Customers', 'Total_Orders', 'Total_Revenue']
     
-    fig = px.line(
+    fig = cached_figure(('customers_activity', version), lambda: px.line(
         monthly_activity,
         x='Month',
         y=['Active_Customers', 'Total_Orders'],
         title='Monthly Customer Activity',
         markers=True
-    )
-    fig.update_layout(height=400)
+    ).update_layout(height=400))
     st.plotly_chart(fig, use_container_width=True)
     
     # Top Customers Table
@@ -1596,22 +1584,20 @@ def show_customers_analysis():
 def show_revenue_analysis():
     st.title("💰 Revenue Analysis")
     
-    # Load the data
-    df = pd.read_csv('rfm_data.csv')
-    df['PurchaseDate'] = pd.to_datetime(df['PurchaseDate'])
+    # Load the precomputed revenue rollups
+    tables = load_revenue_tables()
     
-    # Calculate revenue metrics
-    revenue_metrics = df.groupby(df['PurchaseDate'].dt.strftime('%Y-%m')).agg({
-        'TransactionAmount': ['sum', 'mean', 'count']
-    }).reset_index()
+    # Figures are cached per data version
+    version = file_fingerprint(DATA_FILE)
     
-    revenue_metrics.columns = ['Month', 'Total_Revenue', 'Average_Order_Value', 'Number_of_Orders']
+    # Monthly revenue metrics
+    revenue_metrics = tables['monthly_revenue']
     
     # Create three columns for key metrics
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        total_revenue = df['TransactionAmount'].sum()
+        total_revenue = revenue_metrics['Total_Revenue'].sum()
         st.metric(
             label="Total Revenue",
             value=f"${total_revenue:,.2f}",
@@ -1619,7 +1605,7 @@ def show_revenue_analysis():
         )
     
     with col2:
-        avg_order_value = df['TransactionAmount'].mean()
+        avg_order_value = revenue_metrics['Total_Revenue'].sum() / revenue_metrics['Number_of_Orders'].sum()
         st.metric(
             label="Average Order Value",
             value=f"${avg_order_value:,.2f}",
@@ -1627,7 +1613,7 @@ def show_revenue_analysis():
         )
     
     with col3:
-        total_orders = len(df)
+        total_orders = revenue_metrics['Number_of_Orders'].sum()
         st.metric(
             label="Total Orders",
             value=f"{total_orders:,}",
@@ -1637,46 +1623,48 @@ def show_revenue_analysis():
     # Revenue Trends
     st.subheader("Revenue Trends")
     
+    # Roll the daily rollup up to the selected period
+    granularity = st.radio("Group by:", list(GRANULARITIES), index=2,
+                           format_func=GRANULARITIES.get, horizontal=True)
+    trend = revenue_trend(tables['daily_revenue'], granularity)
+    
     # Create two columns for charts
     col1, col2 = st.columns(2)
     
     with col1:
-        # Monthly revenue trend
-        fig = px.line(
-            revenue_metrics,
-            x='Month',
+        # Revenue trend
+        fig = cached_figure(('revenue_trend', version, granularity), lambda: px.line(
+            trend,
+            x='Period',
             y='Total_Revenue',
-            title='Monthly Revenue Trend',
+            title=f'{GRANULARITIES[granularity]} Revenue Trend',
             markers=True
-        )
-        fig.update_layout(height=400)
+        ).update_layout(height=400))
         st.plotly_chart(fig, use_container_width=True)
     
     with col2:
         # Average order value trend
-        fig = px.line(
-            revenue_metrics,
-            x='Month',
+        fig = cached_figure(('revenue_order_value', version, granularity), lambda: px.line(
+            trend,
+            x='Period',
             y='Average_Order_Value',
             title='Average Order Value Trend',
             markers=True
-        )
-        fig.update_layout(height=400)
+        ).update_layout(height=400))
         st.plotly_chart(fig, use_container_width=True)
     
     # Revenue Distribution
     st.subheader("Revenue Distribution")
     
     # Daily revenue distribution
-    daily_revenue = df.groupby(df['PurchaseDate'].dt.date)['TransactionAmount'].sum().reset_index()
+    daily_revenue = tables['daily_revenue']
     
-    fig = px.histogram(
+    fig = cached_figure(('revenue_daily', version), lambda: px.histogram(
         daily_revenue,
         x='TransactionAmount',
         nbins=30,
         title='Daily Revenue Distribution'
-    )
-    fig.update_layout(height=400)
+    ).update_layout(height=400))
     st.plotly_chart(fig, use_container_width=True)
     
     # Top Revenue Days
@@ -1684,8 +1672,69 @@ def show_revenue_analysis():
     top_days = daily_revenue.nlargest(10, 'TransactionAmount')
     st.dataframe(top_days)
 
+# Churn or customer value model trained in the background, with its timings and scores
+def show_model_training(kind, file_path, as_of, data_key, ml_data):
+    from ml_models import ENGINES, job_key, training_job
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        engine = st.radio("Engine:", ENGINES, horizontal=True, key=f"{kind}_engine",
+                          help="Histogram gradient boosting bins the features and stops early, so it trains fastest on large tables")
+    with col2:
+        horizon = st.slider("Prediction horizon (days):", min_value=7, max_value=90, value=30, key=f"{kind}_horizon")
+    
+    if not st.toggle("Train model", key=f"{kind}_train"):
+        return
+    result = background_job(job_key(training_job, data_key, kind, engine, horizon),
+                            training_job, file_path, as_of, kind, engine, horizon, label="Training")
+    if result is None:
+        return
+    
+    # Test-set metrics
+    columns = st.columns(len(result['metrics']))
+    for column, (name, value) in zip(columns, result['metrics'].items()):
+        column.metric(name, f"{value:.1%}" if name in ('Accuracy', 'Churn rate') else f"{value:,.3f}")
+    
+    timings = pd.Series(result['timings'])
+    st.caption(f"Trained on {result['rows']:,} customers with {result['iterations']} "
+               f"{'trees' if engine == 'Random Forest' else 'boosting rounds'} in {timings.sum():.2f}s.")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        fig = px.bar(x=result['importance'].values, y=result['importance'].index, orientation='h',
+                     title='Feature Importance', labels={'x': 'Importance', 'y': 'Feature'})
+        fig.update_layout(height=400, yaxis={'categoryorder': 'total ascending'})
+        st.plotly_chart(fig, use_container_width=True)
+    with col2:
+        fig = px.bar(x=timings.index, y=timings.values, title='Seconds per Training Stage',
+                     labels={'x': 'Stage', 'y': 'Seconds'})
+        fig.update_layout(height=400)
+        st.plotly_chart(fig, use_container_width=True)
+    
+    # Customers with the highest predicted churn risk or value
+    label = 'Churn_Probability' if kind == 'churn' else f'Predicted_Spend_{horizon}d'
+    top = result['predictions'].nlargest(20, 'Prediction').rename(columns={'Prediction': label})
+    top = top.merge(ml_data[['CustomerID', 'Recency', 'Frequency', 'Monetary']], on='CustomerID', how='left')
+    st.subheader("Most Likely to Churn" if kind == 'churn' else "Highest Predicted Value")
+    st.dataframe(top.round(3), hide_index=True)
+
 # ML Analysis page
 def show_ml_analysis():
+    # The ML stack is slow to import, so only load it once this page is opened
+    from ml_models import (
+        SWEEP_K,
+        cut_tree,
+        dbscan_segments,
+        dendrogram_lines,
+        hierarchical_job,
+        job_key,
+        kmeans_segments,
+        suggest_eps,
+        sweep_job,
+    )
+    from baskets import BASKET_COLUMNS, basket_rules
+    from forecasting import FORECAST_GROUPS, forecast_job, forecast_job_key, prophet_available
+
     st.title("🤖 Machine Learning Analysis")
     
     # Add custom CSS with animations
@@ -1717,58 +1766,18 @@ def show_ml_analysis():
     """, unsafe_allow_html=True)
     
     # Load data
-    file_path = 'rfm_data.csv'
+    file_path = DATA_FILE
     try:
-        data = pd.read_csv(file_path)
+        as_of = as_of_date(file_path)
     except FileNotFoundError:
-        st.error("Data file not found. Please make sure 'rfm_data.csv' exists in the current directory.")
+        st.error(f"Data file not found. Please make sure '{file_path}' exists.")
         return
     
-    # Convert PurchaseDate to datetime
-    data['PurchaseDate'] = pd.to_datetime(data['PurchaseDate'])
-    
-    # Define reference date for recency calculation
-    reference_date = dt.datetime(2023, 7, 1)
-    
-    # Calculate RFM metrics
-    rfm = data.groupby('CustomerID').agg({
-        'PurchaseDate': lambda x: (reference_date - x.max()).days,
-        'OrderID': 'count',
-        'TransactionAmount': 'sum'
-    }).reset_index()
-    
-    rfm.columns = ['CustomerID', 'Recency', 'Frequency', 'Monetary']
-    
-    # Filter out non-positive monetary values
-    rfm = rfm[rfm['Monetary'] > 0]
-    
-    # Add additional features for ML
-    customer_data = data.groupby('CustomerID').agg({
-        'PurchaseDate': [
-            lambda x: (x.max() - x.min()).days if len(x) > 1 else 0,  # Customer tenure
-            'count'  # Total transactions
-        ],
-        'TransactionAmount': [
-            'mean',  # Average order value
-            'std',   # Variability in spending
-            'sum'    # Total spending
-        ],
-        'ProductInformation': [
-            lambda x: x.nunique(),  # Product variety
-            'count'  # Total products purchased
-        ]
-    }).reset_index()
-    
-    # Flatten the column names
-    customer_data.columns = ['CustomerID', 'Tenure', 'TransactionCount', 
-                            'AvgOrderValue', 'SpendingStd', 'TotalSpending',
-                            'ProductVariety', 'TotalProducts']
-    
-    # Replace NaN values in SpendingStd with 0 (for customers with only one transaction)
-    customer_data['SpendingStd'].fillna(0, inplace=True)
-    
-    # Merge with RFM data
-    ml_data = pd.merge(rfm, customer_data, on='CustomerID')
+    # RFM metrics as of the selected date merged with the behavioural features
+    ml_data = load_ml_data(as_of, file_path)
+    
+    # Version of ml_data that fitted models are cached under
+    data_key = (*file_fingerprint(file_path), as_of)
     
     # Create tabs for different ML analyses
     tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
@@ -1801,14 +1810,361 @@ def show_ml_analysis():
             default=cluster_features
         )
         
+        # The silhouette score needs fewer clusters than customers
+        max_clusters = min(SWEEP_K[-1], len(ml_data) - 1)
+        
         if not selected_features:
             st.warning("Please select at least one feature for clustering.")
+        elif max_clusters < SWEEP_K[0]:
+            st.info(f"Only {len(ml_data)} customers had purchased by {as_of:%Y-%m-%d}; "
+                    f"clustering needs at least {SWEEP_K[0] + 1}. Pick a later as-of date.")
         else:
+            # Elbow and silhouette curves over every candidate K, fitted on a bounded sample
+            if st.toggle(f"Sweep K from {SWEEP_K[0]} to {max_clusters}",
+                         help="Compare cluster counts before picking one below"):
+                features = tuple(selected_features)
+                sweep = background_job(job_key(sweep_job, data_key, features),
+                                       sweep_job, file_path, as_of, features, label="Sweeping K")
+            else:
+                sweep = None
+            
+            if sweep is not None:
+                curve = sweep['curve']
+                best_k = int(curve.loc[curve['Silhouette'].idxmax(), 'K'])
+                
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    fig = px.line(curve, x='K', y='Inertia', markers=True,
+                                  title='Elbow Curve (inertia per customer)')
+                    fig.update_layout(height=400)
+                    st.plotly_chart(fig, use_container_width=True)
+                
+                with col2:
+                    # Silhouette estimate with its confidence band
+                    fig = go.Figure([
+                        go.Scatter(x=curve['K'], y=curve['Silhouette_High'], mode='lines',
+                                   line=dict(width=0), showlegend=False, hoverinfo='skip'),
+                        go.Scatter(x=curve['K'], y=curve['Silhouette_Low'], mode='lines',
+                                   line=dict(width=0), fill='tonexty', fillcolor='rgba(75, 0, 130, 0.15)',
+                                   name='95% interval'),
+                        go.Scatter(x=curve['K'], y=curve['Silhouette'], mode='lines+markers',
+                                   line=dict(color='#4B0082'), name='Silhouette'),
+                    ])
+                    fig.update_layout(title='Silhouette Score by K', xaxis_title='K', height=400)
+                    st.plotly_chart(fig, use_container_width=True)
+                
+                st.caption(f"Fitted {len(curve)} values of K on {sweep['customers']:,} customers "
+                           f"in {sweep['seconds']:.1f}s. Best silhouette at K={best_k}.")
+            
             # Number of clusters
-            n_clusters = st.slider("Number of clusters:", min_value=2, max_value=10, value=5)
+            if max_clusters > SWEEP_K[0]:
+                n_clusters = st.slider("Number of clusters:", min_value=SWEEP_K[0], max_value=max_clusters,
+                                       value=min(5, max_clusters))
+            else:
+                n_clusters = SWEEP_K[0]
+                st.caption(f"{len(ml_data)} customers as of this date leave room for {n_clusters} clusters only.")
+            
+            # Scaled features and the fitted model, reused across reruns with the same settings
+            segmentation = kmeans_segments(data_key, ml_data, tuple(selected_features), n_clusters)
+            clustered = ml_data.assign(Cluster=segmentation['labels'].astype(str))
+            cluster_sizes = clustered['Cluster'].value_counts().sort_index()
+            
+            st.metric("Silhouette Score", f"{segmentation['silhouette']:.3f}",
+                      help=f"From -1 to 1; higher means better separated clusters. 95% interval "
+                           f"{segmentation['silhouette_low']:.3f} to {segmentation['silhouette_high']:.3f}")
+            
+            # Create two columns for charts
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                # Cluster sizes
+                fig = px.pie(values=cluster_sizes.values, names=cluster_sizes.index,
+                             title='Customers per Cluster')
+                fig.update_layout(height=400)
+                st.plotly_chart(fig, use_container_width=True)
+            
+            with col2:
+                # Clusters on two of the selected features
+                x_feature = selected_features[0]
+                y_feature = selected_features[1] if len(selected_features) > 1 else 'Monetary'
+                fig = scatter_figure(clustered, x=x_feature, y=y_feature, color='Cluster',
+                                     title=f'Clusters by {x_feature} and {y_feature}')
+                fig.update_layout(height=400)
+                st.plotly_chart(fig, use_container_width=True)
+            
+            # Average feature values per cluster
+            st.subheader("Cluster Profiles")
+            profile = clustered.groupby('Cluster')[selected_features].mean().round(2)
+            profile['Customers'] = cluster_sizes
+            st.dataframe(profile)
+    
+    with tab2:
+        st.markdown('<h3 class="ml-header">Churn Prediction</h3>', unsafe_allow_html=True)
+        
+        st.markdown("""
+        <div class="info-box">
+        The model learns from customers as they were one horizon before the as-of date and whether they bought again
+        within it, then scores every customer today. Random forest trees are built on the training job's share of the
+        cores with capped depth and sample size; histogram gradient boosting stops as soon as validation loss stops
+        improving.
+        </div>
+        """, unsafe_allow_html=True)
+        
+        show_model_training('churn', file_path, as_of, data_key, ml_data)
+    
+    with tab3:
+        st.markdown('<h3 class="ml-header">Customer Lifetime Value</h3>', unsafe_allow_html=True)
+        
+        st.markdown("""
+        <div class="info-box">
+        Predicts what each customer will spend over the next horizon, learnt from what customers spent in the horizon
+        after an earlier cut-off date.
+        </div>
+        """, unsafe_allow_html=True)
+        
+        show_model_training('clv', file_path, as_of, data_key, ml_data)
+    
+    with tab5:
+        st.markdown('<h3 class="ml-header">Revenue Forecasting</h3>', unsafe_allow_html=True)
+        
+        st.markdown("""
+        <div class="info-box">
+        Revenue is forecast separately for every location, product or segment. Series with at least two full seasons
+        of history are fitted with Prophet in parallel worker processes; shorter ones use a fast seasonal naive or
+        exponential smoothing baseline.
+        </div>
+        """, unsafe_allow_html=True)
+        
+        if not prophet_available():
+            st.info("Prophet is not installed, so every series uses the baseline forecast.")
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            forecast_by = st.selectbox("Forecast revenue per:", ["Total"] + FORECAST_GROUPS)
+        with col2:
+            forecast_granularity = st.radio("Period:", list(GRANULARITIES), format_func=GRANULARITIES.get,
+                                            horizontal=True, key="forecast_granularity")
+        with col3:
+            horizon = st.slider("Periods ahead:", min_value=1, max_value=60, value=14)
+        
+        by = None if forecast_by == "Total" else forecast_by
+        forecasts = background_job(forecast_job_key(data_key, by, forecast_granularity, horizon),
+                                   forecast_job, file_path, as_of, by, forecast_granularity, horizon,
+                                   label="Forecasting")
+        
+        if forecasts is not None:
+            # Largest series first
+            totals = forecasts.groupby('Series')['Revenue'].sum().sort_values(ascending=False)
+            shown = st.multiselect("Series to plot:", options=list(totals.index), default=list(totals.index[:5]))
+            
+            fig = go.Figure()
+            palette = px.colors.qualitative.Bold
+            for i, name in enumerate(shown):
+                series = forecasts[forecasts['Series'] == name]
+                colour = palette[i % len(palette)]
+                future = series[series['Forecast'].notna()]
+                fig.add_trace(go.Scatter(x=series['Date'], y=series['Revenue'], mode='lines',
+                                         name=name, line=dict(color=colour)))
+                fig.add_trace(go.Scatter(x=future['Date'], y=future['Forecast'], mode='lines',
+                                         name=f"{name} forecast", line=dict(color=colour, dash='dash')))
+                fig.add_trace(go.Scatter(
+                    x=np.concatenate([future['Date'].to_numpy(), future['Date'].to_numpy()[::-1]]),
+                    y=np.concatenate([future['Upper'].to_numpy(), future['Lower'].to_numpy()[::-1]]),
+                    fill='toself', fillcolor=colour, opacity=0.15, line=dict(width=0),
+                    hoverinfo='skip', showlegend=False
+                ))
+            fig.update_layout(
+                title=f'{GRANULARITIES[forecast_granularity]} Revenue Forecast (80% interval)',
+                xaxis_title='Period',
+                yaxis_title='Revenue',
+                height=500
+            )
+            st.plotly_chart(fig, use_container_width=True)
+            
+            # Model and forecast total per series
+            st.subheader("Forecast Summary")
+            summary = forecasts.groupby('Series').agg(
+                Model=('Model', 'first'),
+                Revenue_To_Date=('Revenue', 'sum'),
+                Forecast_Revenue=('Forecast', 'sum'),
+            ).loc[totals.index].round(2)
+            st.dataframe(summary)
+    
+    with tab6:
+        st.markdown('<h3 class="ml-header">Enhanced Customer Segmentation</h3>', unsafe_allow_html=True)
+        
+        segmentation_method = st.radio("Method:", ["Hierarchical", "DBSCAN"], horizontal=True)
+        
+        if segmentation_method == "Hierarchical":
+            st.markdown("""
+            <div class="info-box">
+            Hierarchical clustering shows how customer groups nest inside each other. Customers are first summarized
+            into a few hundred micro-clusters, which are then linked with Ward's method weighted by their customer counts,
+            so the tree stays fast and small however many customers there are.
+            </div>
+            """, unsafe_allow_html=True)
+            
+            hierarchy_features = st.multiselect(
+                "Select features for hierarchical clustering:",
+                options=cluster_features,
+                default=cluster_features
+            )
+        
+            if not hierarchy_features:
+                st.warning("Please select at least one feature for clustering.")
+            else:
+                n_segments = st.slider("Number of segments:", min_value=2, max_value=10, value=4)
+            
+                # Micro-clusters and their linkage are fitted in the background; cutting the tree is cheap
+                features = tuple(hierarchy_features)
+                tree = background_job(job_key(hierarchical_job, data_key, features),
+                                      hierarchical_job, file_path, as_of, features, label="Building the tree")
+                
+                if tree is not None:
+                    segmented = ml_data.assign(Segment=cut_tree(tree, n_segments).astype(str))
+                    
+                    # Dendrogram of the top of the tree, with the cut drawn across it
+                    dendro = dendrogram_lines(tree, n_segments)
+                    palette = px.colors.qualitative.Bold
+                    fig = go.Figure()
+                    for xs, ys, colour in dendro['lines']:
+                        fig.add_trace(go.Scatter(
+                            x=xs, y=ys, mode='lines', hoverinfo='skip', showlegend=False,
+                            line=dict(color='#999999' if colour is None else palette[colour % len(palette)], width=1.5)
+                        ))
+                    fig.add_hline(y=dendro['threshold'], line_dash='dash', line_color='#4B0082',
+                                  annotation_text=f"{n_segments} segments")
+                    fig.update_layout(
+                        title='Customer Dendrogram (leaves labelled with customer counts)',
+                        xaxis=dict(tickmode='array', tickvals=dendro['ticks'], ticktext=dendro['labels'], tickangle=-90),
+                        yaxis_title='Ward distance',
+                        height=500
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
+                    st.caption(f"Linked {len(tree['linkage']) + 1} micro-clusters summarizing {len(ml_data):,} customers.")
+                    
+                    # Average feature values per segment
+                    st.subheader("Segment Profiles")
+                    profile = segmented.groupby('Segment')[hierarchy_features].mean().round(2)
+                    profile['Customers'] = segmented['Segment'].value_counts()
+                    st.dataframe(profile)
+        
+        else:
+            st.markdown("""
+            <div class="info-box">
+            DBSCAN finds dense groups of customers of any shape and leaves customers in sparse regions as noise.
+            Customers with identical scaled features are clustered once, weighted by their count, and eps is
+            suggested from the knee of the k-distance curve.
+            </div>
+            """, unsafe_allow_html=True)
+            
+            dbscan_features = st.multiselect(
+                "Select features for DBSCAN:",
+                options=cluster_features,
+                default=['Recency', 'Frequency', 'Monetary']
+            )
+            
+            if not dbscan_features:
+                st.warning("Please select at least one feature for clustering.")
+            else:
+                col1, col2 = st.columns(2)
+                with col1:
+                    min_samples = st.slider("Minimum customers per dense region:", min_value=3, max_value=50, value=10)
+                with col2:
+                    precision = st.selectbox(
+                        "Merge customers closer than:",
+                        [None, 2, 1],
+                        format_func=lambda decimals: "Exact matches only" if decimals is None else f"{10.0 ** -decimals:g} std",
+                        help="Rounding the scaled features merges near-identical customers, which speeds up large data sets"
+                    )
+                
+                features = tuple(dbscan_features)
+                suggestion = suggest_eps(data_key, ml_data, features, min_samples, precision)
+                if st.checkbox("Use the suggested eps", value=True):
+                    eps = suggestion['eps']
+                else:
+                    eps = st.number_input("eps:", min_value=0.01, value=round(suggestion['eps'], 2), step=0.05)
+                
+                result = dbscan_segments(data_key, ml_data, features, eps, min_samples, precision)
+                labels = result['labels']
+                clustered = ml_data.assign(Cluster=np.where(labels < 0, 'Noise', labels.astype(str)))
+                
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Clusters", labels.max() + 1)
+                col2.metric("Noise", f"{(labels < 0).mean():.1%}")
+                col3.metric("eps", f"{eps:.3f}")
+                
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    # Sorted k-distance curve with the chosen eps
+                    fig = px.line(y=suggestion['curve'], title=f'{min_samples}-Distance Curve (sampled customers)',
+                                  labels={'x': 'Customers, sorted', 'y': f'Distance to {min_samples}th neighbour'})
+                    fig.add_hline(y=eps, line_dash='dash', line_color='#4B0082', annotation_text='eps')
+                    fig.update_layout(height=400)
+                    st.plotly_chart(fig, use_container_width=True)
+                
+                with col2:
+                    x_feature = dbscan_features[0]
+                    y_feature = dbscan_features[1] if len(dbscan_features) > 1 else 'Monetary'
+                    fig = scatter_figure(clustered, x=x_feature, y=y_feature, color='Cluster',
+                                         title=f'Clusters by {x_feature} and {y_feature}')
+                    fig.update_layout(height=400)
+                    st.plotly_chart(fig, use_container_width=True)
+                
+                st.caption(f"Clustered {result['points']:,} distinct feature vectors standing for {len(ml_data):,} customers.")
+                
+                # Average feature values per cluster
+                st.subheader("Cluster Profiles")
+                profile = clustered.groupby('Cluster')[dbscan_features].mean().round(2)
+                profile['Customers'] = clustered['Cluster'].value_counts()
+                st.dataframe(profile)
+    
+    with tab7:
+        st.markdown('<h3 class="ml-header">Market Basket Analysis</h3>', unsafe_allow_html=True)
+        
+        st.markdown("""
+        <div class="info-box">
+        Association rules show which products are bought together. Baskets are kept as a sparse order-by-product
+        matrix and itemsets are counted by intersecting the lists of baskets holding each product, so memory grows
+        with the purchases rather than with orders times products.
+        </div>
+        """, unsafe_allow_html=True)
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            basket = st.radio("Basket:", list(BASKET_COLUMNS), format_func=BASKET_COLUMNS.get, horizontal=True,
+                              help="Products in one order, or every product a customer has bought")
+        with col2:
+            min_support = st.slider("Minimum support:", min_value=0.001, max_value=0.5, value=0.01, format="%.3f")
+        with col3:
+            min_confidence = st.slider("Minimum confidence:", min_value=0.0, max_value=1.0, value=0.2)
+        
+        result = basket_rules(file_path, as_of, basket, min_support, min_confidence)
+        itemsets, rules = result['itemsets'], result['rules']
+        
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Baskets", f"{result['baskets']:,}")
+        col2.metric("Frequent itemsets", f"{len(itemsets):,}")
+        col3.metric("Rules", f"{len(rules):,}")
+        
+        if rules.empty:
+            st.info("No rules at these thresholds. Try a lower support or confidence, or customer baskets.")
+        else:
+            # Item lists as text for the chart and table
+            shown = rules.assign(
+                antecedents=rules['antecedents'].map(lambda items: ', '.join(sorted(items))),
+                consequents=rules['consequents'].map(lambda items: ', '.join(sorted(items))),
+            ).sort_values('lift', ascending=False)
             
-            # Prepare data for clustering
-            X = ml_data[selected_features].copy()
+            fig = px.scatter(shown, x='support', y='confidence', color='lift', size='support',
+                             hover_data=['antecedents', 'consequents'],
+                             title='Association Rules by Support, Confidence and Lift')
+            fig.update_layout(height=400)
+            st.plotly_chart(fig, use_container_width=True)
             
-            # Scale the data
-            scaler = StandardSca
+            st.subheader("Top Rules by Lift")
+            st.dataframe(shown.head(50).round(4), hide_index=True)
+        
+        st.caption(f"{result['pairs']:,} basket-product pairs across {result['items']:,} products.")
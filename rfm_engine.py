@@ -0,0 +1,307 @@
+import numpy as np
+import pandas as pd
+
+from time_buckets import aggregate_by_period, bucket_keys, bucket_starts
+
+# RFM segments, checked from the highest minimum RFM_Score down
+SEGMENT_THRESHOLDS = [
+    (9, 'Champions'),
+    (8, 'Loyal Customers'),
+    (7, 'Potential Loyalists'),
+    (6, 'Recent Customers'),
+    (5, 'Promising'),
+    (4, 'Need Attention'),
+    (3, 'At Risk'),
+]
+DEFAULT_SEGMENT = 'Lost'
+
+ONE_DAY = np.timedelta64(1, 'D')
+CENTS = 100
+
+
+def days_between(reference_date, dates):
+    """Whole days from each date to reference_date, floored like timedelta.days.
+
+    reference_date may be a single date or an array aligned with dates.
+    """
+    reference = np.asarray(reference_date, dtype='datetime64[ns]')
+    return (reference - np.asarray(dates, dtype='datetime64[ns]')) // ONE_DAY
+
+
+def as_of_cutoff(as_of):
+    """First instant after the as-of day; purchases before it count as of that date."""
+    return np.datetime64(as_of, 'D') + ONE_DAY
+
+
+def amount_cents(amounts):
+    """Transaction amounts as int64 cents.
+
+    Sums of cents are exact whatever order the rows are added in, so a
+    table built from the whole file and one folded together batch by batch
+    (see ingest) agree to the last bit.
+    """
+    return np.rint(np.asarray(amounts, dtype=np.float64) * CENTS).astype(np.int64)
+
+
+def spending_std(count, cents, squared_cents):
+    """Sample standard deviation of order amounts from per-customer sums of cents and squared cents.
+
+    Computed from exact integer sums, so it does not depend on the order
+    the orders were summed in; customers with a single order get 0.
+    """
+    count = np.asarray(count, dtype=np.float64)
+    cents = np.asarray(cents, dtype=np.float64)
+    spread = np.maximum(np.asarray(squared_cents, dtype=np.float64) - cents * cents / count, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(count > 1, np.sqrt(spread / (count - 1)) / CENTS, 0.0)
+
+
+def _with_cents(transactions, columns):
+    # The given columns plus Cents, the amounts as int64 cents
+    return transactions[columns].assign(Cents=amount_cents(transactions['TransactionAmount']))
+
+
+def transactions_as_of(transactions, as_of):
+    """The transactions made on or before the as-of date."""
+    return transactions[transactions['PurchaseDate'] < as_of_cutoff(as_of)]
+
+
+def assign_segments(rfm_score):
+    """Map RFM_Score values to segment names without a per-row callback."""
+    rfm_score = np.asarray(rfm_score)
+    conditions = [rfm_score >= threshold for threshold, _ in SEGMENT_THRESHOLDS]
+    labels = [label for _, label in SEGMENT_THRESHOLDS]
+    return np.select(conditions, labels, default=DEFAULT_SEGMENT)
+
+
+def quartiles(values, labels):
+    """pd.qcut into quartiles, ranking ties apart when the quantiles are not distinct.
+
+    Only small tables need the fallback, e.g. RFM as of an early date.
+    """
+    try:
+        return pd.qcut(values, 4, labels)
+    except ValueError:
+        return pd.qcut(values.rank(method='first'), 4, labels)
+
+
+def score_rfm(rfm):
+    """Add R/F/M quartile scores, RFM_Code, RFM_Score and Segment to an RFM table.
+
+    RFM_Code joins the three quartile digits (R, F, M) into one integer,
+    e.g. R=3, F=1, M=1 gives 311. RFM_Score is their sum (3 to 12), which
+    the segments are assigned from.
+    """
+    rfm['R_Score'] = quartiles(rfm['Recency'], ['1', '2', '3', '4'])
+    rfm['F_Score'] = pd.qcut(rfm['Frequency'].rank(method='first'), 4, ['4', '3', '2', '1'])
+    rfm['M_Score'] = quartiles(rfm['Monetary'], ['4', '3', '2', '1'])
+
+    digits = [rfm[col].astype(int).to_numpy() for col in ('R_Score', 'F_Score', 'M_Score')]
+    rfm['RFM_Code'] = digits[0] * 100 + digits[1] * 10 + digits[2]
+    rfm['RFM_Score'] = digits[0] + digits[1] + digits[2]
+    rfm['Segment'] = assign_segments(rfm['RFM_Score'])
+    return rfm
+
+
+def compute_rfm(transactions, reference_date=None, scores=True):
+    """Compute per-customer Recency, Frequency and Monetary values.
+
+    Recency is counted back from reference_date, or from the latest purchase
+    in transactions when it is None. Customers with non-positive Monetary value are dropped. With scores=True
+    the quartile scores and segment labels from score_rfm are added too.
+    """
+    aggregates = _with_cents(transactions, ['CustomerID', 'PurchaseDate', 'OrderID']).groupby('CustomerID').agg(
+        LastPurchase=('PurchaseDate', 'max'),
+        Frequency=('OrderID', 'count'),
+        Cents=('Cents', 'sum'),
+    ).reset_index()
+    aggregates['Monetary'] = aggregates.pop('Cents') / CENTS
+    return rfm_from_aggregates(aggregates, reference_date, scores)
+
+
+def rfm_from_aggregates(aggregates, reference_date=None, scores=True):
+    """Build the RFM table from per-customer LastPurchase, Frequency and Monetary.
+
+    aggregates must be sorted by CustomerID with a default index, as a
+    groupby(...).reset_index() produces.
+    """
+    rfm = aggregates[['CustomerID', 'Frequency', 'Monetary']].copy()
+    if reference_date is None:
+        reference_date = aggregates['LastPurchase'].max()
+    recency = days_between(reference_date, aggregates['LastPurchase'])
+    rfm.insert(1, 'Recency', recency)
+
+    # Filter out non-positive monetary values
+    rfm = rfm[rfm['Monetary'] > 0].copy()
+
+    if scores:
+        rfm = score_rfm(rfm)
+    return rfm
+
+
+def purchase_history(transactions):
+    """Purchases sorted by customer and date with running spend, for rfm_history."""
+    codes, customers = pd.factorize(transactions['CustomerID'], sort=True)
+    dates = transactions['PurchaseDate'].to_numpy(dtype='datetime64[ns]')
+    order = np.lexsort((dates, codes))
+    codes, dates = codes[order], dates[order]
+    cents = amount_cents(transactions['TransactionAmount'])[order]
+
+    # Running spend restarts for every customer; in cents it matches compute_rfm exactly
+    spend = pd.Series(cents).groupby(codes).cumsum().to_numpy() / CENTS
+
+    # One sorted search key per purchase: the customer code, then the day
+    days = dates.astype('datetime64[D]').astype(np.int64)
+    first_day = int(days.min())
+    span = int(days.max()) - first_day + 2
+    return {
+        'customers': np.asarray(customers),
+        'starts': np.searchsorted(codes, np.arange(len(customers))),
+        'keys': codes.astype(np.int64) * span + (days - first_day),
+        'dates': dates,
+        'spend': spend,
+        'first_day': first_day,
+        'span': span,
+    }
+
+
+def rfm_history(history, as_of_dates, scores=True):
+    """RFM tables for many as-of dates from one purchase_history.
+
+    The purchases of each customer up to each date are found with a single
+    binary search over the sorted keys, so no date needs its own groupby.
+    Returns the compute_rfm columns after an AsOf column, one block of rows
+    per distinct date in date order.
+    """
+    as_of = np.unique(np.array([np.datetime64(date, 'D') for date in as_of_dates], dtype='datetime64[D]'))
+    customers = np.arange(len(history['customers']), dtype=np.int64)
+
+    # A day offset of -1 searches to just before the customer's first key.
+    # Laid out customer by customer the search keys are already sorted, which
+    # keeps the search cache friendly; the transpose puts dates first again.
+    offsets = np.clip(as_of.astype(np.int64) - history['first_day'], -1, history['span'] - 1)
+    search_keys = customers[:, None] * history['span'] + offsets[None, :]
+    ends = np.searchsorted(history['keys'], search_keys, side='right').T.ravel()
+    frequency = ends - np.tile(history['starts'], len(as_of))
+
+    bought = frequency > 0
+    last = ends[bought] - 1
+    reference = np.repeat(as_of.astype('datetime64[ns]'), len(customers))[bought]
+    rfm = pd.DataFrame({
+        'AsOf': reference,
+        'CustomerID': np.tile(history['customers'], len(as_of))[bought],
+        'Recency': days_between(reference, history['dates'][last]),
+        'Frequency': frequency[bought],
+        'Monetary': history['spend'][last],
+    })
+
+    # Filter out non-positive monetary values
+    rfm = rfm[rfm['Monetary'] > 0]
+
+    if scores and len(rfm):
+        rfm = pd.concat([score_rfm(block.copy()) for _, block in rfm.groupby('AsOf', sort=False)])
+    return rfm.reset_index(drop=True)
+
+
+def segment_transitions(history):
+    """Customers moving between segments from each as-of date in an rfm_history to the next.
+
+    Customers without purchases at the earlier date come from 'New'.
+    """
+    dates = history['AsOf'].unique()
+    steps = []
+    for before, after in zip(dates[:-1], dates[1:]):
+        moves = pd.merge(
+            history.loc[history['AsOf'] == before, ['CustomerID', 'Segment']],
+            history.loc[history['AsOf'] == after, ['CustomerID', 'Segment']],
+            on='CustomerID', how='right', suffixes=('_From', '_To'),
+        )
+        step = moves.fillna({'Segment_From': 'New'}).groupby(['Segment_From', 'Segment_To']).size()
+        step = step.rename_axis(['From', 'To']).reset_index(name='Customers')
+        step.insert(0, 'FromAsOf', before)
+        step.insert(1, 'ToAsOf', after)
+        steps.append(step)
+    return pd.concat(steps, ignore_index=True) if steps else pd.DataFrame(
+        columns=['FromAsOf', 'ToAsOf', 'From', 'To', 'Customers'])
+
+
+def customer_metrics(transactions, reference_date=None):
+    """Orders, spend and days since last purchase per customer (Customers page).
+
+    Days are counted back from reference_date, or from the latest purchase
+    in the data set when it is None.
+    """
+    metrics = _with_cents(transactions, ['CustomerID', 'OrderID', 'PurchaseDate']).groupby('CustomerID').agg(
+        Total_Orders=('OrderID', 'count'),
+        Total_Spent=('Cents', 'sum'),
+        LastPurchase=('PurchaseDate', 'max'),
+    ).reset_index()
+    metrics['Total_Spent'] = metrics['Total_Spent'] / CENTS
+    last_purchase = metrics.pop('LastPurchase')
+    if reference_date is None:
+        reference_date = last_purchase.max()
+    metrics['Days_Since_Last_Purchase'] = days_between(reference_date, last_purchase)
+    return metrics
+
+
+def customer_features(transactions):
+    """Behavioural features per customer used by the ML page."""
+    grouped = _with_cents(transactions, ['CustomerID', 'PurchaseDate', 'ProductInformation'])
+    grouped['SquaredCents'] = grouped['Cents'] ** 2
+    features = grouped.groupby('CustomerID').agg(
+        FirstPurchase=('PurchaseDate', 'min'),
+        LastPurchase=('PurchaseDate', 'max'),
+        TransactionCount=('PurchaseDate', 'count'),
+        Cents=('Cents', 'sum'),
+        SquaredCents=('SquaredCents', 'sum'),
+        ProductVariety=('ProductInformation', 'nunique'),
+        TotalProducts=('ProductInformation', 'count'),
+    ).reset_index()
+
+    # Customer tenure; zero for customers with a single transaction
+    tenure = days_between(features.pop('LastPurchase'), features.pop('FirstPurchase'))
+    features.insert(1, 'Tenure', tenure)
+
+    # Spending from the exact cent sums; the deviation is 0 for customers with only one transaction
+    cents, squared = features.pop('Cents'), features.pop('SquaredCents')
+    count = features['TransactionCount']
+    features.insert(3, 'AvgOrderValue', cents / CENTS / count)
+    features.insert(4, 'SpendingStd', spending_std(count, cents, squared))
+    features.insert(5, 'TotalSpending', cents / CENTS)
+    return features
+
+
+def monthly_revenue(transactions):
+    """Revenue, order and active-customer rollup per calendar month."""
+    monthly = aggregate_by_period(
+        _with_cents(transactions, ['CustomerID', 'PurchaseDate']), 'PurchaseDate', 'M', label='Month',
+        Total_Revenue=('Cents', 'sum'),
+        Number_of_Orders=('Cents', 'count'),
+        Active_Customers=('CustomerID', 'nunique'),
+    )
+    monthly['Total_Revenue'] = monthly['Total_Revenue'] / CENTS
+    monthly.insert(2, 'Average_Order_Value', monthly['Total_Revenue'] / monthly['Number_of_Orders'])
+    return monthly
+
+
+def daily_revenue(transactions):
+    """Total revenue and order count per purchase day."""
+    days = bucket_keys(transactions['PurchaseDate'], 'D')
+    daily = _with_cents(transactions, ['PurchaseDate']).groupby(days).agg(
+        TransactionAmount=('Cents', 'sum'),
+        Number_of_Orders=('Cents', 'count'),
+    )
+    daily['TransactionAmount'] = daily['TransactionAmount'] / CENTS
+    daily.insert(0, 'PurchaseDate', bucket_starts(daily.index, 'D').astype(object))
+    return daily.reset_index(drop=True)
+
+
+def revenue_trend(daily, granularity='M'):
+    """Roll the daily revenue table up to day, week, month or quarter buckets."""
+    trend = aggregate_by_period(
+        daily, 'PurchaseDate', granularity,
+        Total_Revenue=('TransactionAmount', 'sum'),
+        Number_of_Orders=('Number_of_Orders', 'sum'),
+    )
+    trend['Average_Order_Value'] = trend['Total_Revenue'] / trend['Number_of_Orders']
+    return trend
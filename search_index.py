@@ -0,0 +1,163 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from data_access import DATA_FILE, file_fingerprint, load_transactions
+
+# Columns the data preview search looks in, with the prefixes that pick one
+# column, e.g. "location:Tokyo"
+SEARCH_COLUMNS = {
+    'CustomerID': ('customerid', 'customer'),
+    'OrderID': ('orderid', 'order'),
+    'ProductInformation': ('productinformation', 'product'),
+    'Location': ('location',),
+    'PurchaseDate': ('purchasedate', 'date'),
+}
+DATE_FORMAT = '%Y-%m-%d'
+NGRAM = 3
+CODEPOINT_BITS = 21
+
+
+def _column_strings(series):
+    # Factorize first so each distinct value is formatted and lowercased once
+    codes, uniques = pd.factorize(series)
+    if series.name == 'PurchaseDate':
+        strings = pd.DatetimeIndex(uniques).strftime(DATE_FORMAT)
+    else:
+        strings = pd.Index(uniques).astype(str)
+    return codes, pd.Series(strings, dtype=object).str.lower()
+
+
+def _encode(codepoints):
+    # Pack NGRAM code points (each < 2**21) into one int64 key
+    key = np.zeros(codepoints[0].shape, dtype=np.int64)
+    for cp in codepoints:
+        key = (key << CODEPOINT_BITS) | cp.astype(np.int64)
+    return key
+
+
+def _ngram_postings(values):
+    # Sorted trigram keys and, per key, the ids of the values containing it.
+    # Values are padded with NUL code points, so every position of a value
+    # starts a trigram and shorter terms can be found by key prefix.
+    width = int(values.str.len().max() or 0) + NGRAM - 1
+    codepoints = values.to_numpy().astype(f'U{width}').view(np.uint32).reshape(len(values), width)
+    ids = np.arange(len(values), dtype=np.int64)
+    grams, owners = [], []
+    for start in range(width - NGRAM + 1):
+        window = codepoints[:, start:start + NGRAM]
+        starts_in_value = window[:, 0] != 0
+        grams.append(_encode(window[starts_in_value].T))
+        owners.append(ids[starts_in_value])
+    grams, owners = np.concatenate(grams), np.concatenate(owners)
+
+    order = np.lexsort((owners, grams))
+    grams, owners = grams[order], owners[order]
+    distinct = np.ones(len(grams), dtype=bool)
+    distinct[1:] = (grams[1:] != grams[:-1]) | (owners[1:] != owners[:-1])
+    grams, owners = grams[distinct], owners[distinct]
+
+    keys, starts = np.unique(grams, return_index=True)
+    return keys, np.append(starts, len(grams)), owners
+
+
+def build_search_index(transactions):
+    """Index the searchable columns of a transaction frame.
+
+    For each column this keeps the distinct lowercased strings, the row ids
+    grouped by distinct value, and a trigram index over the distinct strings.
+    """
+    columns = {}
+    for column in SEARCH_COLUMNS:
+        codes, values = _column_strings(transactions[column])
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes, minlength=len(values))
+        keys, offsets, ids = _ngram_postings(values)
+        columns[column] = {
+            'values': values,
+            'order': order,
+            'counts': counts,
+            'gram_keys': keys,
+            'gram_offsets': offsets,
+            'gram_ids': ids,
+        }
+    return {'rows': len(transactions), 'columns': columns}
+
+
+def _term_codepoints(term):
+    return np.frombuffer(term.encode('utf-32-le'), dtype=np.uint32)
+
+
+def _posting_range(entry, low, high):
+    # Value ids listed under every key in [low, high]
+    keys, offsets = entry['gram_keys'], entry['gram_offsets']
+    lo = np.searchsorted(keys, low, side='left')
+    hi = np.searchsorted(keys, high, side='right')
+    return entry['gram_ids'][offsets[lo]:offsets[hi]]
+
+
+def _matching_values(entry, term):
+    # Boolean mask over the distinct values that contain term
+    values = entry['values']
+    mask = np.zeros(len(values), dtype=bool)
+    codepoints = _term_codepoints(term)
+
+    if len(codepoints) < NGRAM:
+        # Every occurrence starts some trigram: look up all keys with this prefix
+        low = np.zeros(NGRAM, dtype=np.uint32)
+        high = np.full(NGRAM, (1 << CODEPOINT_BITS) - 1, dtype=np.uint32)
+        low[:len(codepoints)] = high[:len(codepoints)] = codepoints
+        mask[_posting_range(entry, _encode(low[:, None])[0], _encode(high[:, None])[0])] = True
+        return mask
+
+    candidates = None
+    for start in range(len(codepoints) - NGRAM + 1):
+        key = _encode(codepoints[start:start + NGRAM, None])[0]
+        ids = _posting_range(entry, key, key)
+        candidates = ids if candidates is None else np.intersect1d(candidates, ids, assume_unique=True)
+        if not len(candidates):
+            return mask
+
+    # Trigrams only narrow the candidates; confirm the full substring
+    confirmed = values.iloc[candidates].str.contains(term, regex=False).to_numpy()
+    mask[candidates[confirmed]] = True
+    return mask
+
+
+def parse_query(query):
+    """Split "column:term" into (column or None, lowercased term)."""
+    prefix, sep, rest = query.partition(':')
+    if sep:
+        for column, aliases in SEARCH_COLUMNS.items():
+            if prefix.strip().lower() in aliases:
+                return column, rest.strip().lower()
+    return None, query.lower()
+
+
+def search(index, query):
+    """Sorted positions of the rows matching query (case-insensitive substring).
+
+    A "column:term" query only looks in that column; otherwise a row matches
+    when any searchable column contains the term.
+    """
+    column, term = parse_query(query)
+    columns = [column] if column else list(SEARCH_COLUMNS)
+
+    row_mask = np.zeros(index['rows'], dtype=bool)
+    for name in columns:
+        entry = index['columns'][name]
+        value_mask = _matching_values(entry, term)
+        if value_mask.any():
+            row_mask[entry['order'][np.repeat(value_mask, entry['counts'])]] = True
+    return np.flatnonzero(row_mask)
+
+
+@lru_cache(maxsize=2)
+def _load_search_index(path, mtime_ns, size):
+    return build_search_index(load_transactions(path))
+
+
+def load_search_index(path=DATA_FILE):
+    """Search index for the transaction file, built once per file version."""
+    return _load_search_index(*file_fingerprint(path))
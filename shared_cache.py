@@ -0,0 +1,176 @@
+import contextlib
+import functools
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+try:
+    import fcntl
+except ImportError:  # Windows: the disk tier works without locking across processes
+    fcntl = None
+
+# Directory shared by every server and worker process on the host, or None
+# to keep the derived tables in this process's memory only
+SHARED_CACHE_DIR = os.environ.get('RFM_SHARED_CACHE_DIR') or None
+# Upper bound on the pickled tables kept in SHARED_CACHE_DIR
+SHARED_CACHE_DISK_BYTES = 4 * 1024 * 1024 * 1024
+
+# name -> cache_info of every function wrapped by shared_cache
+_registry = {}
+# Result handed to waiting callers when the computing thread was stopped
+_ABANDONED = object()
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on path (created if missing) across processes; without fcntl (Windows) it only creates the file."""
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def prune_pickles(directory, max_bytes):
+    """Delete the least recently modified .pkl files (and their .lock files) until the rest fit in max_bytes.
+
+    Readers touch a pickle's mtime when they use it, so this drops the
+    least recently used first. Returns how many were deleted.
+    """
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.endswith('.pkl'):
+                with contextlib.suppress(FileNotFoundError):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        for stale in (path, path[:-len('.pkl')] + '.lock'):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(stale)
+        total -= size
+        removed += 1
+    return removed
+
+
+def _load_or_compute(directory, name, args, compute, max_bytes):
+    # (value, whether it came from disk, pickles evicted to make room)
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, hashlib.sha1(repr((name, args)).encode()).hexdigest())
+    with file_lock(base + '.lock'):
+        try:
+            with open(base + '.pkl', 'rb') as f:
+                value = pickle.load(f)
+            # Mark it recently used for prune_pickles
+            os.utime(base + '.pkl')
+            return value, True, 0
+        except FileNotFoundError:
+            pass
+        value = compute()
+        tmp = f'{base}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, base + '.pkl')
+    return value, False, prune_pickles(directory, max_bytes)
+
+
+def shared_cache(maxsize=128, disk_dir=SHARED_CACHE_DIR, disk_bytes=SHARED_CACHE_DISK_BYTES):
+    """Decorator like functools.lru_cache, with one computation per key however many callers ask.
+
+    The first caller of a key computes it while concurrent callers of the
+    same key (other sessions' script threads) wait for that result instead
+    of computing it again; if the computation raises, they all get the
+    error. With disk_dir, results are also pickled there, keyed by the
+    function and the repr of its arguments, so other server and worker
+    processes load them instead of computing them, again once per key.
+    Arguments must be hashable with a deterministic repr, and the results
+    are shared, so callers must not modify them.
+
+    The wrapper gains cache_info() (entries, hits, misses, waits, disk hits
+    and evictions) and cache_clear(), which leaves the disk tier alone.
+    """
+    def decorate(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        entries = OrderedDict()
+        # key -> Future of the computation in progress
+        running = {}
+        lock = threading.Lock()
+        stats = {'hits': 0, 'misses': 0, 'waits': 0, 'disk_hits': 0, 'evictions': 0, 'disk_evictions': 0}
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            while True:
+                with lock:
+                    if args in entries:
+                        entries.move_to_end(args)
+                        stats['hits'] += 1
+                        return entries[args]
+                    future = running.get(args)
+                    if future is None:
+                        future = running[args] = Future()
+                        stats['misses'] += 1
+                        break
+                    stats['waits'] += 1
+                value = future.result()
+                if value is not _ABANDONED:
+                    return value
+                # The computing thread was stopped (e.g. its session rerun); compute again
+
+            try:
+                if disk_dir is None:
+                    value, from_disk, pruned = func(*args), False, 0
+                else:
+                    value, from_disk, pruned = _load_or_compute(
+                        disk_dir, name, args, lambda: func(*args), disk_bytes)
+            except Exception as error:
+                with lock:
+                    del running[args]
+                future.set_exception(error)
+                raise
+            except BaseException:
+                with lock:
+                    del running[args]
+                future.set_result(_ABANDONED)
+                raise
+
+            with lock:
+                entries[args] = value
+                del running[args]
+                stats['disk_hits'] += from_disk
+                stats['disk_evictions'] += pruned
+                while len(entries) > maxsize:
+                    entries.popitem(last=False)
+                    stats['evictions'] += 1
+            future.set_result(value)
+            return value
+
+        def cache_info():
+            """Entries, hits, misses, waits, disk hits and evictions of this cache."""
+            with lock:
+                return {'entries': len(entries), **stats}
+
+        def cache_clear():
+            """Drop the entries held in memory."""
+            with lock:
+                entries.clear()
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        _registry[name] = cache_info
+        return wrapper
+    return decorate
+
+
+def shared_cache_info():
+    """cache_info() of every shared cache, by function name."""
+    return {name: info() for name, info in _registry.items()}
@@ -0,0 +1,300 @@
+import argparse
+import datetime as dt
+import json
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from data_access import DATA_FILE, file_fingerprint, load_transactions, transaction_format
+from ingest import state_tables, stream_tables, update_state
+from rfm_engine import (
+    as_of_cutoff,
+    compute_rfm,
+    customer_features,
+    customer_metrics,
+    daily_revenue,
+    monthly_revenue,
+    purchase_history,
+    rfm_history,
+)
+from shared_cache import shared_cache
+
+# Directory holding the prebuilt customer tables and their manifest
+SNAPSHOT_DIR = 'rfm_snapshot'
+MANIFEST_FILE = 'manifest.json'
+SNAPSHOT_VERSION = 4
+# Accumulator state kept inside the snapshot directory for incremental builds
+STATE_DIR = 'state'
+# Transaction files above this size are aggregated chunk by chunk instead of loaded whole
+STREAMING_THRESHOLD_BYTES = 512 * 1024 * 1024
+# Transaction columns the revenue rollups (and the purchase history) and the
+# RFM tables are computed from; Parquet and Arrow files are read for just these
+REVENUE_COLUMNS = ['CustomerID', 'PurchaseDate', 'TransactionAmount']
+RFM_COLUMNS = REVENUE_COLUMNS + ['OrderID']
+FEATURE_COLUMNS = REVENUE_COLUMNS + ['ProductInformation']
+REVENUE_TABLES = ('monthly_revenue', 'daily_revenue')
+# Tables load_as_of_tables recomputes for an as-of date
+AS_OF_TABLES = ('rfm', 'customer_metrics', 'monthly_revenue')
+# Point-in-time RFM tables kept in memory, one entry per (file version, as-of date).
+# Derived tables are computed once per key for all sessions (see shared_cache).
+AS_OF_CACHE_SIZE = 32
+
+
+def build_tables(transactions):
+    """Compute every customer-level table and revenue rollup the pages read.
+
+    Recency is counted back from the latest purchase in transactions.
+    """
+    return {
+        'rfm': compute_rfm(transactions),
+        'customer_metrics': customer_metrics(transactions),
+        'customer_features': customer_features(transactions),
+        'monthly_revenue': monthly_revenue(transactions),
+        'daily_revenue': daily_revenue(transactions),
+    }
+
+
+def build_snapshot(path=DATA_FILE, out_dir=SNAPSHOT_DIR, incremental=False, streaming=False):
+    """Write the tables for the transaction file at path as Feather files plus a manifest.
+
+    With incremental=True only rows appended since the previous incremental
+    build are read and folded into the per-customer state kept next to the
+    snapshot (see ingest.update_state). With streaming=True the file is
+    aggregated chunk by chunk instead of being loaded whole.
+    """
+    if incremental and transaction_format(path) != 'csv':
+        raise ValueError('incremental builds read rows appended to a CSV; rebuild columnar files in full')
+    source, mtime_ns, size = file_fingerprint(path)
+    new_rows = None
+    if incremental:
+        state, meta, new_rows = update_state(path, os.path.join(out_dir, STATE_DIR))
+        tables = state_tables(state)
+        # A last row without its newline is left out until it is complete, so
+        # the manifest covers only the bytes ingested and is_current stays
+        # false while the file holds more
+        size = meta['offset']
+    elif streaming:
+        tables = stream_tables(path)
+    else:
+        tables = build_tables(load_transactions(path))
+
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'built_at': dt.datetime.now().isoformat(timespec='seconds'),
+        'source': {'path': source, 'mtime_ns': mtime_ns, 'size': size},
+        'reference_date': latest_purchase(tables).isoformat(),
+        'incremental': incremental,
+        'streaming': streaming,
+        'new_rows': new_rows,
+        'tables': {},
+    }
+    for name, table in tables.items():
+        file_name = f'{name}.feather'
+        # Uncompressed so the dashboard can memory-map the columns directly
+        feather.write_feather(table, os.path.join(out_dir, file_name), compression='uncompressed')
+        manifest['tables'][name] = {'file': file_name, 'rows': len(table)}
+
+    # Write the manifest last so readers never see it before its tables
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+
+def latest_purchase(tables):
+    """Date of the latest purchase, which the tables' recency is counted back from."""
+    return tables['daily_revenue']['PurchaseDate'].iloc[-1]
+
+
+def read_manifest(out_dir=SNAPSHOT_DIR):
+    """Return the snapshot manifest, or None when no snapshot has been built."""
+    try:
+        with open(os.path.join(out_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def is_current(manifest, path=DATA_FILE):
+    """Whether a manifest was built from the current version of the transaction file."""
+    if manifest is None or manifest.get('version') != SNAPSHOT_VERSION:
+        return False
+    source, mtime_ns, size = file_fingerprint(path)
+    return manifest['source'] == {'path': source, 'mtime_ns': mtime_ns, 'size': size}
+
+
+# Mapping is cheap and the frames point into the files, so this stays in memory
+@shared_cache(maxsize=2, disk_dir=None)
+def _map_snapshot(out_dir, manifest_mtime_ns):
+    manifest = read_manifest(out_dir)
+    tables = {}
+    for name, entry in manifest['tables'].items():
+        with pa.memory_map(os.path.join(out_dir, entry['file'])) as source:
+            tables[name] = feather.read_table(source, memory_map=True).to_pandas(split_blocks=True)
+    return manifest, tables
+
+
+@shared_cache(maxsize=2)
+def _compute_tables(path, mtime_ns, size):
+    if size > STREAMING_THRESHOLD_BYTES:
+        return stream_tables(path)
+    return build_tables(load_transactions(path))
+
+
+def load_tables(path=DATA_FILE, out_dir=SNAPSHOT_DIR):
+    """Customer tables for the transaction file at path.
+
+    Reads the snapshot when one was built from the current file version and
+    falls back to computing the tables from the transactions otherwise,
+    streaming files larger than STREAMING_THRESHOLD_BYTES. The
+    returned frames are shared, so pages must copy before adding columns.
+    """
+    manifest = read_manifest(out_dir)
+    if is_current(manifest, path):
+        manifest_mtime = os.stat(os.path.join(out_dir, MANIFEST_FILE)).st_mtime_ns
+        return _map_snapshot(os.path.abspath(out_dir), manifest_mtime)[1]
+    return _compute_tables(*file_fingerprint(path))
+
+
+@shared_cache(maxsize=2)
+def _compute_revenue_tables(path, mtime_ns, size):
+    if size > STREAMING_THRESHOLD_BYTES:
+        tables = _compute_tables(path, mtime_ns, size)
+        return {name: tables[name] for name in REVENUE_TABLES}
+    transactions = load_transactions(path, columns=REVENUE_COLUMNS)
+    return {'monthly_revenue': monthly_revenue(transactions), 'daily_revenue': daily_revenue(transactions)}
+
+
+def load_revenue_tables(path=DATA_FILE, out_dir=SNAPSHOT_DIR):
+    """The 'monthly_revenue' and 'daily_revenue' tables of load_tables.
+
+    Without a current snapshot only these are computed, from the
+    REVENUE_COLUMNS of the transactions, so the revenue views and the date
+    range never read the product and location columns.
+    """
+    if is_current(read_manifest(out_dir), path):
+        return load_tables(path, out_dir)
+    return _compute_revenue_tables(*file_fingerprint(path))
+
+
+def purchase_date_range(path=DATA_FILE, out_dir=SNAPSHOT_DIR):
+    """Dates of the first and the latest purchase in the transaction file."""
+    daily = load_revenue_tables(path, out_dir)['daily_revenue']['PurchaseDate']
+    return daily.iloc[0], daily.iloc[-1]
+
+
+@shared_cache(maxsize=AS_OF_CACHE_SIZE)
+def _as_of_tables(path, mtime_ns, size, out_dir, as_of):
+    latest = latest_purchase(load_revenue_tables(path, out_dir))
+    streamed = size > STREAMING_THRESHOLD_BYTES
+    if as_of >= latest and (streamed or is_current(read_manifest(out_dir), path)):
+        tables = load_tables(path, out_dir)
+        # Every purchase counts: only recency moves, by the same number of days
+        # for every customer, which leaves the quartile scores unchanged
+        shift = (as_of - latest).days
+        rfm = tables['rfm'].copy()
+        rfm['Recency'] += shift
+        metrics = tables['customer_metrics'].copy()
+        metrics['Days_Since_Last_Purchase'] += shift
+        return {'rfm': rfm, 'customer_metrics': metrics, 'monthly_revenue': tables['monthly_revenue']}
+
+    if streamed:
+        tables = stream_tables(path, as_of)
+        return {name: tables[name] for name in AS_OF_TABLES}
+    # Purchases after the as-of date are skipped while reading
+    transactions = load_transactions(path, columns=RFM_COLUMNS, end=as_of_cutoff(as_of))
+    return {
+        'rfm': compute_rfm(transactions, as_of),
+        'customer_metrics': customer_metrics(transactions, as_of),
+        'monthly_revenue': monthly_revenue(transactions),
+    }
+
+
+def load_as_of_tables(as_of=None, path=DATA_FILE, out_dir=SNAPSHOT_DIR):
+    """The 'rfm', 'customer_metrics' and 'monthly_revenue' tables as of a date (default: the latest purchase).
+
+    Purchases after as_of are left out and recency is counted back from it.
+    Results are cached per file version and as-of date, so returning to a
+    date is free; dates on or after the latest purchase reuse the snapshot.
+    The returned frames are shared, so pages must copy before adding columns.
+    """
+    if as_of is None:
+        return load_tables(path, out_dir)
+    # One cache key per calendar day, whether a date, datetime or string is passed
+    as_of = np.datetime64(as_of, 'D').astype(object)
+    return _as_of_tables(*file_fingerprint(path), os.path.abspath(out_dir), as_of)
+
+
+# The sorted history is as large as the transactions, so it is kept in memory only
+@shared_cache(maxsize=2, disk_dir=None)
+def _purchase_history(path, mtime_ns, size):
+    return purchase_history(load_transactions(path, columns=REVENUE_COLUMNS))
+
+
+@shared_cache(maxsize=AS_OF_CACHE_SIZE)
+def _rfm_history(path, mtime_ns, size, as_of_dates):
+    return rfm_history(_purchase_history(path, mtime_ns, size), as_of_dates)
+
+
+def load_rfm_history(as_of_dates, path=DATA_FILE):
+    """RFM for every customer at each as-of date (see rfm_engine.rfm_history).
+
+    The sorted purchase history is built once per file version and each
+    set of dates is cached, so revisiting a migration view is free.
+    """
+    as_of_dates = tuple(np.unique(np.array(as_of_dates, dtype='datetime64[D]')).astype(object))
+    return _rfm_history(*file_fingerprint(path), as_of_dates)
+
+
+@shared_cache(maxsize=AS_OF_CACHE_SIZE)
+def _ml_data(path, mtime_ns, size, out_dir, as_of):
+    if as_of >= latest_purchase(load_revenue_tables(path, out_dir)):
+        # Every purchase counts, so the full-history features are the ones as of this date
+        rfm = _as_of_tables(path, mtime_ns, size, out_dir, as_of)['rfm']
+        features = load_tables(path, out_dir)['customer_features']
+    elif size > STREAMING_THRESHOLD_BYTES:
+        tables = stream_tables(path, as_of)
+        rfm, features = tables['rfm'], tables['customer_features']
+    else:
+        # Features from later purchases would leak the future into the models
+        rfm = _as_of_tables(path, mtime_ns, size, out_dir, as_of)['rfm']
+        features = customer_features(
+            load_transactions(path, columns=FEATURE_COLUMNS, end=as_of_cutoff(as_of)))
+    return rfm[['CustomerID', 'Recency', 'Frequency', 'Monetary']].merge(features, on='CustomerID')
+
+
+def load_ml_data(as_of, path=DATA_FILE, out_dir=SNAPSHOT_DIR):
+    """RFM values as of a date joined with the behavioural features, for the ML page.
+
+    Both leave out purchases after as_of, like load_as_of_tables. Built
+    once per file version and as-of date; the frame is shared, so callers
+    must copy before adding columns.
+    """
+    as_of = np.datetime64(as_of, 'D').astype(object)
+    return _ml_data(*file_fingerprint(path), os.path.abspath(out_dir), as_of)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the precomputed RFM snapshot')
+    parser.add_argument('--data', default=DATA_FILE, help='transaction CSV to aggregate')
+    parser.add_argument('--out', default=SNAPSHOT_DIR, help='snapshot output directory')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only read rows appended since the last incremental build')
+    parser.add_argument('--streaming', action='store_true',
+                        help='aggregate the file chunk by chunk instead of loading it whole')
+    args = parser.parse_args()
+
+    manifest = build_snapshot(args.data, args.out, incremental=args.incremental,
+                              streaming=args.streaming)
+    if args.incremental:
+        print(f"{manifest['new_rows']:,} new transaction rows")
+    for name, entry in manifest['tables'].items():
+        print(f"{name}: {entry['rows']:,} rows -> {os.path.join(args.out, entry['file'])}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+import pytest
+
+from benchmarks import make_transactions
+
+
+@pytest.fixture(autouse=True)
+def scratch_dir(tmp_path, monkeypatch):
+    # Caches with relative default paths (transaction_cache/, job_cache/) go to the test's directory
+    monkeypatch.chdir(tmp_path)
+
+
+@pytest.fixture
+def transactions():
+    """Synthetic transactions in purchase order, as exports arrive."""
+    return make_transactions(500).sort_values('PurchaseDate', kind='stable', ignore_index=True)
+
+
+@pytest.fixture
+def csv_path(tmp_path, transactions):
+    path = tmp_path / 'rfm_data.csv'
+    transactions.to_csv(path, index=False)
+    return str(path)
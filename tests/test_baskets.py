@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+from mlxtend.frequent_patterns import apriori
+from mlxtend.frequent_patterns import association_rules as mlxtend_rules
+
+from baskets import RULE_COLUMNS, association_rules, basket_matrix, frequent_itemsets
+
+
+@pytest.fixture
+def lines():
+    # Popular items and a few that are usually bought together
+    rng = np.random.default_rng(0)
+    rows = []
+    for order in range(400):
+        items = set(rng.choice(list('ABCDEFGHIJ'), size=rng.integers(1, 5), p=np.linspace(2, 0.2, 10) / 11))
+        if 'A' in items and rng.random() < 0.6:
+            items |= {'B', 'C'}
+        rows += [(order, item) for item in items]
+        if rng.random() < 0.1:
+            # The same item twice in one order
+            rows.append((order, next(iter(items))))
+    return pd.DataFrame(rows, columns=['OrderID', 'ProductInformation'])
+
+
+def one_hot(lines):
+    return pd.crosstab(lines['OrderID'], lines['ProductInformation']).astype(bool)
+
+
+def by_itemset(frame):
+    return frame.set_index(frame['itemsets'].map(sorted_items))['support'].sort_index()
+
+
+def sorted_items(itemset):
+    # Frozensets only order by inclusion, so index by sorted tuples
+    return tuple(sorted(itemset))
+
+
+def test_basket_matrix_marks_each_item_bought():
+    lines = pd.DataFrame({'OrderID': [7, 7, 3, 7], 'ProductInformation': ['B', 'A', 'B', 'B']})
+    baskets = basket_matrix(lines)
+    assert baskets['items'].tolist() == ['A', 'B']
+    assert baskets['matrix'].toarray().tolist() == [[True, True], [False, True]]
+
+
+@pytest.mark.parametrize('min_support, max_len', [(0.02, 3), (0.05, 2), (0.01, None)])
+def test_frequent_itemsets_match_apriori(lines, min_support, max_len):
+    baskets = basket_matrix(lines)
+    itemsets = frequent_itemsets(baskets['matrix'], baskets['items'], min_support, max_len)
+    expected = apriori(one_hot(lines), min_support=min_support, use_colnames=True, max_len=max_len)
+
+    assert itemsets['itemsets'].map(len).is_monotonic_increasing
+    pd.testing.assert_series_equal(by_itemset(itemsets), by_itemset(expected))
+
+
+def test_association_rules_match_mlxtend(lines):
+    baskets = basket_matrix(lines)
+    itemsets = frequent_itemsets(baskets['matrix'], baskets['items'], 0.02, 3)
+    rules = association_rules(itemsets, min_confidence=0.4)
+    # A confidence of exactly 0.4 may divide to just below it, which mlxtend drops
+    expected = mlxtend_rules(apriori(one_hot(lines), min_support=0.02, use_colnames=True, max_len=3),
+                             num_itemsets=len(baskets['items']), metric='confidence', min_threshold=0.4 - 1e-12)
+
+    def by_rule(frame):
+        index = pd.MultiIndex.from_arrays([frame['antecedents'].map(sorted_items),
+                                           frame['consequents'].map(sorted_items)])
+        return frame[RULE_COLUMNS[2:]].set_axis(index).sort_index()
+
+    rules, expected = by_rule(rules), by_rule(expected)
+    assert len(rules) > 0
+    pd.testing.assert_frame_equal(rules, expected)
@@ -0,0 +1,114 @@
+import threading
+import time
+
+import numpy as np
+import plotly.graph_objects as go
+import pytest
+
+from figure_cache import cached_figure, clear_figure_cache, figure_cache_info
+from model_cache import SizedLRU, size_of
+from shared_cache import prune_pickles, shared_cache
+
+
+def test_concurrent_callers_of_a_key_share_one_computation():
+    calls = []
+
+    @shared_cache(maxsize=4, disk_dir=None)
+    def slow(x):
+        calls.append(x)
+        time.sleep(0.2)
+        return [x]
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(slow(1))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [1]
+    assert all(result is results[0] for result in results)
+    info = slow.cache_info()
+    assert info['misses'] == 1 and info['hits'] + info['waits'] == 3
+
+
+def test_errors_reach_every_caller_and_are_not_cached():
+    calls = []
+
+    @shared_cache(maxsize=4, disk_dir=None)
+    def failing(x):
+        calls.append(x)
+        raise ValueError(x)
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            failing(1)
+    assert calls == [1, 1]
+
+
+def test_memory_tier_evicts_least_recently_used():
+    @shared_cache(maxsize=2, disk_dir=None)
+    def square(x):
+        return x * x
+
+    for x in (1, 2, 1, 3, 1):
+        square(x)
+    assert square.cache_info()['misses'] == 3
+    square(2)
+    assert square.cache_info()['misses'] == 4
+    assert square.cache_info()['evictions'] == 2
+
+    square.cache_clear()
+    assert square.cache_info()['entries'] == 0
+
+
+def test_disk_tier_is_shared_and_pruned(tmp_path):
+    calls = []
+
+    def make():
+        @shared_cache(maxsize=4, disk_dir=str(tmp_path), disk_bytes=10_000)
+        def blob(x):
+            calls.append(x)
+            return np.full(500, x, dtype=np.int64)
+        return blob
+
+    first, second = make(), make()
+    np.testing.assert_array_equal(first(1), second(1))
+    assert calls == [1] and second.cache_info()['disk_hits'] == 1
+
+    # Each pickle holds 4 KB, so only two fit in 10 KB
+    for x in (2, 3, 4):
+        first(x)
+    assert len(list(tmp_path.glob('*.pkl'))) == 2
+    assert prune_pickles(str(tmp_path), 0) == 2
+
+
+def test_sized_lru_evicts_by_size():
+    cache = SizedLRU(100, len)
+    cache.get('a', lambda: 'x' * 60)
+    cache.get('b', lambda: 'y' * 30)
+    assert cache.lookup('a') == 'x' * 60
+    cache.get('c', lambda: 'z' * 30)
+    assert cache.lookup('b') is None and cache.lookup('a') is not None
+    assert cache.get('huge', lambda: 'w' * 200) == 'w' * 200
+    assert cache.lookup('huge') is None
+    assert cache.info()['bytes'] == 90
+
+
+def test_size_of_counts_arrays_inside_containers():
+    array = np.zeros(1000)
+    assert size_of({'a': [array, array]}) == array.nbytes
+
+
+def test_cached_figure_is_built_once_per_key():
+    clear_figure_cache()
+    builds = []
+
+    def build():
+        builds.append(1)
+        return go.Figure(go.Bar(y=[1, 2, 3]))
+
+    figure = cached_figure(('chart', 1), build)
+    assert cached_figure(('chart', 1), build) is figure
+    assert len(builds) == 1
+    assert figure_cache_info()['bytes'] == len(figure.to_json())
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from charts import POINT_LIMIT, WEBGL_LIMIT, box_stats, density_grid, histogram_bins, scatter_figure
+
+
+def test_histogram_bins_count_every_value():
+    values = np.random.default_rng(0).normal(size=1000)
+    values[:10] = np.nan
+    bins = histogram_bins(values, nbins=20)
+
+    counts, edges = np.histogram(values[10:], bins=20)
+    assert bins['count'].tolist() == counts.tolist()
+    assert np.allclose(bins['left'], edges[:-1])
+    assert np.allclose(bins['center'], (edges[:-1] + edges[1:]) / 2)
+
+
+def test_density_grid_counts_every_point():
+    rng = np.random.default_rng(0)
+    x, y = rng.normal(size=5000), rng.exponential(size=5000)
+    grid = density_grid(x, y, bins=30)
+    assert grid['counts'].shape == (30, 30)
+    assert grid['counts'].sum() == 5000
+
+
+def test_box_stats_match_the_raw_points():
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({
+        'Segment': pd.Categorical(rng.choice(['a', 'b', 'c'], size=2000)),
+        'Monetary': rng.lognormal(5, 1, size=2000),
+    })
+    stats = box_stats(frame, 'Segment', 'Monetary')
+
+    for name, values in frame.groupby('Segment', observed=True)['Monetary']:
+        q1, median, q3 = values.quantile([0.25, 0.5, 0.75])
+        inside = values[(values >= q1 - 1.5 * (q3 - q1)) & (values <= q3 + 1.5 * (q3 - q1))]
+        assert stats.loc[name, ['q1', 'median', 'q3']].tolist() == pytest.approx([q1, median, q3])
+        assert stats.loc[name, 'lowerfence'] == inside.min()
+        assert stats.loc[name, 'upperfence'] == inside.max()
+        assert stats.loc[name, 'count'] == len(values)
+
+
+@pytest.mark.parametrize('rows, trace_type', [
+    (POINT_LIMIT, 'scatter'),
+    (POINT_LIMIT + 1, 'scattergl'),
+    (WEBGL_LIMIT + 1, 'heatmap'),
+])
+def test_scatter_figure_switches_with_the_row_count(rows, trace_type):
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({'x': rng.normal(size=rows), 'y': rng.normal(size=rows)})
+    assert scatter_figure(frame, 'x', 'y').data[0].type == trace_type
+
+
+def test_large_coloured_scatter_samples_every_category():
+    rows = WEBGL_LIMIT * 2
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({
+        'x': rng.normal(size=rows), 'y': rng.normal(size=rows),
+        'Segment': pd.Categorical(rng.choice(['a', 'b'], size=rows)),
+    })
+    fig = scatter_figure(frame, 'x', 'y', color='Segment', title='RFM')
+    assert {trace.type for trace in fig.data} == {'scattergl'}
+    assert {trace.name for trace in fig.data} == {'a', 'b'}
+    assert sum(len(trace.x) for trace in fig.data) <= WEBGL_LIMIT + 2
@@ -0,0 +1,58 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+from streamlit.testing.v1 import AppTest
+
+PAGES = ['show_dashboard', 'show_rfm_analysis', 'show_customers_analysis', 'show_revenue_analysis',
+         'show_ml_analysis']
+
+
+@pytest.mark.parametrize('page', PAGES)
+def test_page_renders_without_errors(csv_path, page):
+    # The test runs in the directory of csv_path, which is the default data file there
+    app = AppTest.from_string(f'import rfm_dashboard\nrfm_dashboard.{page}()\n', default_timeout=120).run()
+    assert [error.value for error in app.exception] == []
+
+
+@pytest.mark.parametrize('page, analysis', [
+    ('show_customers_analysis', None),
+    ('show_rfm_analysis', 'Customer Value Distribution'),
+    ('show_rfm_analysis', 'Purchase Pattern Analysis'),
+])
+def test_pages_render_as_of_a_date_with_tied_spend(tmp_path, transactions, page, analysis):
+    # On the first day every customer has spent the same, so plain quartiles have no distinct edges
+    first_day = transactions['PurchaseDate'] < '2023-01-02'
+    transactions.loc[first_day, 'TransactionAmount'] = 100.0
+    transactions.to_csv(tmp_path / 'rfm_data.csv', index=False)
+
+    app = AppTest.from_string(f'import rfm_dashboard\nrfm_dashboard.{page}()\n', default_timeout=120)
+    app.session_state['as_of'] = dt.date(2023, 1, 1)
+    app.run()
+    if analysis is not None:
+        choice = next(box for box in app.sidebar.selectbox if box.label == 'Choose Analysis Type:')
+        choice.select(analysis).run()
+    assert [error.value for error in app.exception] == []
+
+
+@pytest.mark.parametrize('customers', [2, 3, 8])
+def test_kmeans_tab_fits_the_customers_of_an_early_as_of_date(tmp_path, transactions, customers):
+    # Only the first few customers bought on the first day
+    first_day = transactions['PurchaseDate'] < '2023-01-02'
+    kept = transactions[first_day].drop_duplicates('CustomerID').head(customers)
+    pd.concat([kept, transactions[~first_day]]).to_csv(tmp_path / 'rfm_data.csv', index=False)
+
+    app = AppTest.from_string('import rfm_dashboard\nrfm_dashboard.show_ml_analysis()\n', default_timeout=120)
+    app.session_state['as_of'] = dt.date(2023, 1, 1)
+    app.run()
+    assert [error.value for error in app.exception] == []
+
+    sliders = [slider for slider in app.slider if slider.label == 'Number of clusters:']
+    toggles = [toggle.label for toggle in app.toggle if toggle.label.startswith('Sweep K')]
+    if customers < 3:
+        assert not sliders and not toggles
+        assert any('clustering needs at least 3' in info.value for info in app.info)
+    elif customers == 3:
+        assert not sliders and toggles == ['Sweep K from 2 to 2']
+    else:
+        assert sliders[0].max == customers - 1 and toggles == [f'Sweep K from 2 to {customers - 1}']
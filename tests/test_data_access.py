@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_access import (
+    file_fingerprint, load_transactions, map_transactions, read_columnar, read_transactions_csv,
+    select_transactions, write_columnar,
+)
+
+START, END = np.datetime64('2023-02-01', 'ns'), np.datetime64('2023-05-01', 'ns')
+
+
+def assert_same_rows(actual, expected):
+    # Columnar files are sorted by date, so compare the rows in one order
+    key = list(expected.columns)
+    actual, expected = (frame.sort_values(key, ignore_index=True) for frame in (actual, expected))
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, check_categorical=False)
+
+
+@pytest.mark.parametrize('name, partition_by', [
+    ('rfm_data.parquet', None),
+    ('rfm_data.feather', None),
+    ('rfm_data_by_location', 'Location'),
+])
+@pytest.mark.parametrize('selection', [
+    {},
+    {'columns': ['CustomerID', 'PurchaseDate', 'TransactionAmount']},
+    {'start': START, 'end': END},
+    {'locations': ['Paris', 'Tokyo']},
+    {'columns': ['CustomerID', 'PurchaseDate'], 'start': START, 'locations': ['London']},
+])
+def test_columnar_reads_match_the_csv_selection(tmp_path, csv_path, name, partition_by, selection):
+    out_path = str(tmp_path / name)
+    write_columnar(csv_path, out_path, partition_by=partition_by, row_group_rows=100)
+    expected = select_transactions(read_transactions_csv(csv_path), **selection)
+
+    actual = read_columnar(out_path, **selection)
+    assert_same_rows(actual[list(expected.columns)], expected)
+
+
+def test_load_transactions_filters_a_csv_in_memory(csv_path):
+    transactions = read_transactions_csv(csv_path)
+    loaded = load_transactions(csv_path, columns=['CustomerID', 'PurchaseDate'], start=START, end=END)
+    assert_same_rows(loaded, select_transactions(transactions, ['CustomerID', 'PurchaseDate'], START, END))
+
+
+def test_mapped_transactions_match_the_csv(tmp_path, csv_path, transactions):
+    cache_dir = str(tmp_path / 'transaction_cache')
+    mapped = map_transactions(*file_fingerprint(csv_path), cache_dir=cache_dir)
+    assert_same_rows(mapped, read_transactions_csv(csv_path))
+
+    # A new version of the file replaces the old copy
+    transactions.head(100).to_csv(csv_path, index=False)
+    mapped = map_transactions(*file_fingerprint(csv_path), cache_dir=cache_dir)
+    assert len(mapped) == 100
+    assert len(list((tmp_path / 'transaction_cache').glob('*.arrow'))) == 1
+
+
+def test_load_transactions_sees_a_rewritten_file(csv_path, transactions):
+    assert len(load_transactions(csv_path)) == len(transactions)
+    transactions.head(100).to_csv(csv_path, index=False)
+    assert len(load_transactions(csv_path)) == 100
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import forecasting
+from forecasting import TOTAL_SERIES, baseline_forecast, forecast_panel, revenue_panel
+
+
+def test_revenue_panel_matches_a_grouped_sum(transactions):
+    panel = revenue_panel(transactions, by='Location', granularity='W')
+    weeks = transactions['PurchaseDate'].dt.to_period('W-SUN')
+    expected = transactions.groupby(['Location', weeks], observed=True)['TransactionAmount'].sum().unstack(fill_value=0.0)
+
+    assert panel['names'].tolist() == expected.index.tolist()
+    assert len(panel['keys']) == expected.shape[1]
+    assert np.allclose(panel['values'], expected.to_numpy())
+
+
+def test_revenue_panel_by_segment_skips_customers_without_one(transactions):
+    segments = pd.DataFrame({'CustomerID': [0, 1, 2], 'Segment': ['Gold', 'Gold', 'Silver']})
+    panel = revenue_panel(transactions, by='Segment', segments=segments)
+    total = revenue_panel(transactions)
+
+    assert panel['names'].tolist() == ['Gold', 'Silver']
+    assert total['names'].tolist() == [TOTAL_SERIES]
+    expected = transactions.loc[transactions['CustomerID'] <= 2, 'TransactionAmount'].sum()
+    assert panel['values'].sum() == pytest.approx(expected)
+    assert total['values'].sum() == pytest.approx(transactions['TransactionAmount'].sum())
+
+
+def test_baseline_repeats_the_last_season_of_long_series():
+    season = np.array([1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0])
+    values = np.stack([np.tile(season, 4), np.r_[np.zeros(20), np.full(8, 5.0)]])
+    forecast, lower, upper, models = baseline_forecast(values, np.array([0, 20]), horizon=10, season=7)
+
+    assert models.tolist() == ['Seasonal naive', 'Exponential smoothing']
+    assert forecast[0].tolist() == np.tile(season, 2)[:10].tolist()
+    # A series that repeats exactly has no spread
+    assert np.array_equal(lower[0], upper[0])
+    assert np.allclose(forecast[1], 5.0)
+    assert (lower <= forecast).all() and (forecast <= upper).all()
+
+
+def test_forecast_panel_without_prophet_uses_the_baseline(transactions, monkeypatch):
+    monkeypatch.setattr(forecasting, 'prophet_available', lambda: False)
+    panel = revenue_panel(transactions, by='ProductInformation', granularity='D')
+    result = forecast_panel(panel, 'D', horizon=14)
+
+    assert set(result['Model']) <= {'Seasonal naive', 'Exponential smoothing'}
+    future = result[result['Forecast'].notna()]
+    assert future.groupby('Series', observed=True).size().tolist() == [14] * len(panel['names'])
+    assert (future['Date'] > transactions['PurchaseDate'].max()).all()
+    actual = result[result['Revenue'].notna()]
+    assert actual['Revenue'].sum() == pytest.approx(transactions['TransactionAmount'].sum())
+
+
+def test_prophet_forecasts_are_cached_per_series(transactions):
+    if not forecasting.prophet_available():
+        pytest.skip('Prophet is not installed')
+    panel = revenue_panel(transactions)
+    fits = []
+    first = forecast_panel(panel, 'D', horizon=7, progress=lambda fraction, message: fits.append(message), n_jobs=1)
+    again = forecast_panel(panel, 'D', horizon=7, progress=lambda fraction, message: fits.append(message), n_jobs=1)
+
+    assert set(first['Model']) == {'Prophet'}
+    assert fits == [f'Fitted {TOTAL_SERIES}']
+    pd.testing.assert_frame_equal(first, again)
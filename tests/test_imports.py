@@ -0,0 +1,37 @@
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules only the ML page may import
+HEAVY_MODULES = ['sklearn', 'scipy', 'prophet', 'mlxtend', 'matplotlib']
+# Seconds allowed for the cold start of the dashboard and its non-ML pages
+IMPORT_BUDGET = 2.5
+REPEAT = 3
+
+# Cold start of the dashboard and its non-ML pages, run in a fresh interpreter
+IMPORT_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import rfm_dashboard
+for page in (rfm_dashboard.show_dashboard, rfm_dashboard.show_rfm_analysis,
+             rfm_dashboard.show_customers_analysis, rfm_dashboard.show_revenue_analysis):
+    page()
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'heavy': [m for m in %r if m in sys.modules]}))
+''' % (HEAVY_MODULES,)
+
+
+def probe():
+    out = subprocess.run([sys.executable, '-c', IMPORT_PROBE], cwd=REPO_DIR,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def test_non_ml_pages_start_within_budget_without_the_ml_stack():
+    runs = [probe() for _ in range(REPEAT)]
+    assert sorted({m for run in runs for m in run['heavy']}) == []
+    best = min(run['seconds'] for run in runs)
+    assert best <= IMPORT_BUDGET, f"cold start took {best:.2f}s, over the {IMPORT_BUDGET:.2f}s budget"
@@ -0,0 +1,78 @@
+import math
+import operator
+import os
+import time
+
+from joblib import effective_n_jobs
+from threadpoolctl import threadpool_info
+
+import jobs
+from jobs import job_cores, job_id, job_status, submit_job
+
+
+def wait_for(key, job_dir, timeout=120):
+    deadline = time.monotonic() + timeout
+    while True:
+        status = job_status(key, job_dir)
+        if status['state'] not in ('running', 'idle') or time.monotonic() > deadline:
+            return status
+        time.sleep(0.1)
+
+
+def parallelism():
+    return {
+        'job_cores': job_cores(),
+        'joblib': effective_n_jobs(None),
+        'threads': {pool['num_threads'] for pool in threadpool_info()},
+    }
+
+
+def test_job_result_survives_in_the_job_dir(tmp_path):
+    job_dir = str(tmp_path / 'jobs')
+    key = ('test-add', 2, 3)
+    assert job_status(key, job_dir) == {'state': 'idle'}
+
+    submit_job(key, operator.add, 2, 3, job_dir=job_dir)
+    assert wait_for(key, job_dir) == {'state': 'done', 'result': 5}
+    assert os.path.exists(os.path.join(job_dir, job_id(key) + '.pkl'))
+    # Resubmitting a finished job reuses its result
+    assert submit_job(key, operator.add, 2, 3, job_dir=job_dir) == job_id(key)
+    assert not jobs._running[job_id(key)].running()
+
+
+def test_failed_job_reports_its_error(tmp_path):
+    job_dir = str(tmp_path / 'jobs')
+    key = ('test-sqrt', -1)
+    submit_job(key, math.sqrt, -1, job_dir=job_dir)
+    status = wait_for(key, job_dir)
+    assert status['state'] == 'failed'
+    assert 'ValueError' in status['error']
+
+
+def test_finished_jobs_prune_the_least_recently_used_results(tmp_path, monkeypatch):
+    # _run is what the workers execute; run it here so the smaller budget applies
+    job_dir = str(tmp_path / 'jobs')
+    os.makedirs(job_dir)
+    monkeypatch.setattr(jobs, 'JOB_DIR_BYTES', 25_000)
+    for i in range(4):
+        jobs._run(job_id(('test-bytes', i)), job_dir, bytes, (10_000,))
+        os.utime(os.path.join(job_dir, job_id(('test-bytes', i)) + '.pkl'), (i, i))
+
+    kept = [os.path.exists(os.path.join(job_dir, job_id(('test-bytes', i)) + '.pkl')) for i in range(4)]
+    assert kept == [False, False, True, True]
+    assert not [name for name in os.listdir(job_dir) if name.endswith('.progress')]
+
+
+def test_jobs_parallelize_over_their_share_of_the_cores(tmp_path, monkeypatch):
+    job_dir = str(tmp_path / 'jobs')
+    os.makedirs(job_dir)
+    monkeypatch.setattr(jobs, 'JOB_CORES', 2)
+    assert job_cores() == (os.cpu_count() or 1)
+
+    key = ('test-parallelism',)
+    jobs._run(job_id(key), job_dir, parallelism, ())
+    inside = job_status(key, job_dir)['result']
+    assert inside['job_cores'] == inside['joblib'] == 2
+    assert inside['threads'] <= {2}
+    # The limits end with the job
+    assert parallelism()['job_cores'] == (os.cpu_count() or 1)
@@ -0,0 +1,101 @@
+import datetime as dt
+
+import numpy as np
+import pytest
+from scipy.cluster.hierarchy import linkage
+from sklearn.cluster import DBSCAN
+from sklearn.preprocessing import StandardScaler
+
+from ml_models import (
+    ENGINES, PREDICTION_FEATURES, customer_table, dbscan_segments, kmeans_sweep, labelled_customers,
+    stratified_sample, train_model, weighted_ward,
+)
+from rfm_engine import transactions_as_of
+
+AS_OF = dt.date(2023, 6, 1)
+FEATURES = ('Recency', 'Frequency', 'Monetary')
+
+
+@pytest.fixture
+def ml_data(transactions):
+    return customer_table(transactions, AS_OF)
+
+
+def test_stratified_sample_keeps_each_label_share():
+    labels = np.repeat([0, 1, 2], [6000, 3000, 1000])
+    rows = stratified_sample(labels, 1000, np.random.default_rng(0))
+    assert len(np.unique(rows)) == len(rows)
+    assert np.bincount(labels[rows]).tolist() == [600, 300, 100]
+
+
+def test_weighted_ward_with_unit_weights_is_scipy_ward():
+    points = np.random.default_rng(0).normal(size=(60, 3))
+    Z, node_customers = weighted_ward(points, np.ones(60))
+    expected = linkage(points, method='ward')
+    assert np.allclose(Z[:, 2], expected[:, 2])
+    assert np.array_equal(Z[:, 3], expected[:, 3])
+    assert node_customers[-1] == 60
+
+
+def test_kmeans_sweep_fits_every_k(ml_data):
+    fractions = []
+    sweep = kmeans_sweep(('test-sweep',), ml_data, FEATURES, k_values=(2, 3, 4),
+                         progress=lambda fraction, message: fractions.append(fraction))
+    assert sweep['curve']['K'].tolist() == [2, 3, 4]
+    assert sweep['customers'] == len(ml_data)
+    assert sweep['curve']['Inertia'].is_monotonic_decreasing
+    assert sorted(fractions) == pytest.approx([1 / 3, 2 / 3, 1])
+
+
+def test_kmeans_sweep_skips_k_without_fewer_clusters_than_customers(ml_data):
+    few = ml_data.head(5)
+    sweep = kmeans_sweep(('test-sweep-few',), few, FEATURES)
+    assert sweep['curve']['K'].tolist() == [2, 3, 4]
+
+
+def test_dbscan_on_distinct_vectors_matches_dbscan_on_every_customer(ml_data):
+    # Frequency and rounded Recency give many customers the same vector
+    ml_data = ml_data.assign(Monetary=ml_data['Monetary'].round(-2))
+    features = ('Recency', 'Frequency', 'Monetary')
+    result = dbscan_segments(('test-dbscan',), ml_data, features, eps=0.3, min_samples=8)
+
+    X = StandardScaler().fit_transform(ml_data[list(features)])
+    plain = DBSCAN(eps=0.3, min_samples=8).fit(X)
+    core = np.zeros(len(X), dtype=bool)
+    core[plain.core_sample_indices_] = True
+    assert result['points'] < len(X)
+    assert np.array_equal(result['core'], core)
+    assert np.array_equal(result['labels'] == -1, plain.labels_ == -1)
+    # Core customers fall in the same clusters, whatever their numbering
+    pairs = set(zip(result['labels'][core], plain.labels_[core]))
+    assert len(pairs) == len({a for a, _ in pairs}) == len({b for _, b in pairs})
+
+
+def test_labelled_customers_only_see_purchases_before_the_horizon(transactions):
+    labelled = labelled_customers(transactions, AS_OF, horizon_days=60)
+    start = dt.date(2023, 4, 2)
+    assert labelled.set_index('CustomerID')[PREDICTION_FEATURES].equals(
+        customer_table(transactions, start).set_index('CustomerID')[PREDICTION_FEATURES])
+
+    later = transactions_as_of(transactions, AS_OF)
+    later = later[later['PurchaseDate'] >= np.datetime64(start + dt.timedelta(days=1))]
+    spend = later.groupby('CustomerID')['TransactionAmount'].sum()
+    expected = labelled['CustomerID'].map(spend).fillna(0.0)
+    assert np.allclose(labelled['Future_Spend'], expected)
+    assert (labelled['Churned'] == ~labelled['CustomerID'].isin(later['CustomerID'])).all()
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('kind', ['churn', 'clv'])
+def test_train_model_scores_every_current_customer(transactions, kind, engine):
+    labelled = labelled_customers(transactions, AS_OF, horizon_days=60)
+    current = customer_table(transactions, AS_OF)
+    result = train_model(kind, engine, labelled, current)
+
+    assert result['predictions']['CustomerID'].tolist() == current['CustomerID'].tolist()
+    assert sorted(result['importance'].index) == sorted(PREDICTION_FEATURES)
+    predictions = result['predictions']['Prediction']
+    assert (predictions >= 0).all()
+    if kind == 'churn':
+        assert (predictions <= 1).all()
+        assert 0 <= result['metrics']['ROC AUC'] <= 1
@@ -0,0 +1,69 @@
+import pytest
+
+from pagination import query_page
+
+ROW_COLUMNS = ['CustomerID', 'OrderID', 'TransactionAmount']
+
+
+def row_tuples(frame):
+    return list(frame[ROW_COLUMNS].itertuples(index=False, name=None))
+
+
+def preview_order(transactions):
+    return transactions.sort_values(['PurchaseDate', 'OrderID'], kind='stable', ignore_index=True)
+
+
+def page_forward(path, rows_per_page, search=None):
+    rows, result = [], query_page(path, search, rows_per_page)
+    while True:
+        rows += row_tuples(result['rows'])
+        if result['start'] + rows_per_page >= result['stats']['records']:
+            return rows
+        result = query_page(path, search, rows_per_page, after=result['last_key'])
+
+
+@pytest.mark.parametrize('rows_per_page', [7, 50])
+def test_keyset_paging_returns_every_row_once_in_order(csv_path, transactions, rows_per_page):
+    assert page_forward(csv_path, rows_per_page) == row_tuples(preview_order(transactions))
+
+
+@pytest.mark.parametrize('rows_per_page', [1, 2, 3, 10])
+def test_keyset_paging_returns_every_line_of_multi_line_orders_once(tmp_path, transactions, rows_per_page):
+    # Orders of one to four lines, so pages end between lines sharing a date and OrderID
+    orders = transactions.head(100)
+    lines = orders.loc[orders.index.repeat(orders.index % 4 + 1)].reset_index(drop=True)
+    lines['TransactionAmount'] = lines.index / 100
+    path = str(tmp_path / 'lines.csv')
+    lines.to_csv(path, index=False)
+
+    rows = page_forward(path, rows_per_page)
+    assert len(set(rows)) == len(rows) == len(lines)
+    assert rows == row_tuples(preview_order(lines))
+
+    last = query_page(path, rows_per_page=rows_per_page, page=len(lines) // rows_per_page - 1)
+    back = query_page(path, rows_per_page=rows_per_page, before=last['first_key'])
+    assert back['start'] == last['start'] - rows_per_page
+
+
+def test_before_goes_back_one_page(csv_path):
+    third = query_page(csv_path, rows_per_page=10, page=2)
+    second = query_page(csv_path, rows_per_page=10, before=third['first_key'])
+    assert second['start'] == 10
+    assert row_tuples(second['rows']) == row_tuples(query_page(csv_path, rows_per_page=10, page=1)['rows'])
+
+
+def test_search_pages_and_stats_cover_the_matching_rows(csv_path, transactions):
+    tokyo = preview_order(transactions[transactions['Location'] == 'Tokyo'])
+    assert page_forward(csv_path, 20, 'location:tokyo') == row_tuples(tokyo)
+
+    stats = query_page(csv_path, 'location:tokyo')['stats']
+    assert stats['records'] == len(tokyo)
+    assert stats['customers'] == tokyo['CustomerID'].nunique()
+    assert stats['revenue'] == pytest.approx(tokyo['TransactionAmount'].sum())
+    assert stats['first_date'] == tokyo['PurchaseDate'].min()
+    assert stats['last_date'] == tokyo['PurchaseDate'].max()
+
+
+def test_no_match(csv_path):
+    result = query_page(csv_path, 'nothing like this')
+    assert result['stats']['records'] == 0 and result['rows'].empty and result['pages'] == 1
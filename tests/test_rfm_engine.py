@@ -0,0 +1,36 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import LEGACY_REFERENCE_DATE, legacy_rfm
+from data_access import read_transactions_csv
+from rfm_engine import compute_rfm
+
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rfm_data.csv')
+
+
+# The thresholds of the pre-series rfm_segment, highest first
+LEGACY_SEGMENTS = [(9, 'Champions'), (8, 'Loyal Customers'), (7, 'Potential Loyalists'),
+                   (6, 'Recent Customers'), (5, 'Promising'), (4, 'Need Attention'), (3, 'At Risk')]
+
+
+def legacy_segment(score):
+    return next((label for threshold, label in LEGACY_SEGMENTS if score >= threshold), 'Lost')
+
+
+def test_compute_rfm_matches_the_pre_series_code_on_the_sample():
+    raw = pd.read_csv(SAMPLE_CSV)
+    raw['PurchaseDate'] = pd.to_datetime(raw['PurchaseDate'])
+    old = legacy_rfm(raw).reset_index(drop=True)
+    new = compute_rfm(read_transactions_csv(SAMPLE_CSV), LEGACY_REFERENCE_DATE).reset_index(drop=True)
+
+    columns = ['CustomerID', 'Recency', 'Frequency', 'Monetary', 'R_Score', 'F_Score', 'M_Score']
+    pd.testing.assert_frame_equal(new[columns], old[columns], check_dtype=False, check_categorical=False)
+
+    # The old RFM_Score summed the string scores, which joined their digits
+    np.testing.assert_array_equal(new['RFM_Code'], old['RFM_Score'])
+    digits = old[['R_Score', 'F_Score', 'M_Score']].astype(int)
+    np.testing.assert_array_equal(new['RFM_Score'], digits.sum(axis=1))
+    assert new['Segment'].tolist() == [legacy_segment(score) for score in digits.sum(axis=1)]
+    assert new['Segment'].nunique() > 1
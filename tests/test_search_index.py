@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from search_index import DATE_FORMAT, SEARCH_COLUMNS, build_search_index, parse_query, search
+
+
+def brute_force(transactions, query):
+    # The rows whose searchable columns, formatted as the preview shows them, contain the term
+    column, term = parse_query(query)
+    matches = np.zeros(len(transactions), dtype=bool)
+    for name in [column] if column else SEARCH_COLUMNS:
+        values = transactions[name]
+        strings = values.dt.strftime(DATE_FORMAT) if name == 'PurchaseDate' else values.astype(str)
+        matches |= strings.str.lower().str.contains(term, regex=False).to_numpy()
+    return np.flatnonzero(matches)
+
+
+@pytest.mark.parametrize('query', ['tokyo', 'TOK', 'o', 'Product C', '2023-04', 'location:lon',
+                                   'product:b', 'nothing like this'])
+def test_search_finds_every_row_containing_the_term(transactions, query):
+    index = build_search_index(transactions)
+    np.testing.assert_array_equal(search(index, query), brute_force(transactions, query))
+
+
+def test_column_queries_only_look_in_that_column(transactions):
+    index = build_search_index(transactions)
+    rows = search(index, 'location:tokyo')
+    assert len(rows) and (transactions['Location'].iloc[rows] == 'Tokyo').all()
+    assert parse_query('unknown:tokyo') == (None, 'unknown:tokyo')
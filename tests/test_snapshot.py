@@ -0,0 +1,98 @@
+import datetime as dt
+
+import pandas as pd
+import pytest
+
+import snapshot
+from data_access import read_transactions_csv
+from rfm_engine import compute_rfm, customer_features, customer_metrics, monthly_revenue, transactions_as_of
+from snapshot import (
+    build_snapshot, build_tables, is_current, load_as_of_tables, load_ml_data, load_rfm_history,
+    load_tables, purchase_date_range, read_manifest,
+)
+
+
+def assert_same_frame(actual, expected):
+    pd.testing.assert_frame_equal(
+        actual.reset_index(drop=True), expected.reset_index(drop=True),
+        check_dtype=False, check_categorical=False)
+
+
+@pytest.fixture
+def out_dir(tmp_path):
+    return str(tmp_path / 'rfm_snapshot')
+
+
+def test_snapshot_matches_the_computed_tables(csv_path, out_dir):
+    assert not is_current(read_manifest(out_dir), csv_path)
+    computed = load_tables(csv_path, out_dir)
+    build_snapshot(csv_path, out_dir)
+
+    assert is_current(read_manifest(out_dir), csv_path)
+    snapshot = load_tables(csv_path, out_dir)
+    assert snapshot.keys() == computed.keys()
+    for name in computed:
+        assert_same_frame(snapshot[name], computed[name])
+
+
+@pytest.mark.parametrize('days_back', [0, 30, 90])
+def test_as_of_tables_leave_out_later_purchases(csv_path, out_dir, days_back):
+    transactions = read_transactions_csv(csv_path)
+    as_of = purchase_date_range(csv_path, out_dir)[1] - dt.timedelta(days=days_back)
+    tables = load_as_of_tables(as_of, csv_path, out_dir)
+
+    earlier = transactions_as_of(transactions, as_of)
+    assert_same_frame(tables['rfm'], compute_rfm(earlier, as_of))
+    assert_same_frame(tables['customer_metrics'], customer_metrics(earlier, as_of))
+    assert_same_frame(tables['monthly_revenue'], monthly_revenue(earlier))
+
+
+def test_as_of_after_the_latest_purchase_shifts_recency(csv_path, out_dir):
+    build_snapshot(csv_path, out_dir)
+    latest = purchase_date_range(csv_path, out_dir)[1]
+    as_of = latest + dt.timedelta(days=10)
+    tables = load_as_of_tables(as_of, csv_path, out_dir)
+
+    expected = compute_rfm(read_transactions_csv(csv_path), as_of)
+    assert_same_frame(tables['rfm'], expected)
+    assert_same_frame(tables['monthly_revenue'], monthly_revenue(read_transactions_csv(csv_path)))
+    assert (tables['rfm']['Recency'] == load_tables(csv_path, out_dir)['rfm']['Recency'] + 10).all()
+
+
+def test_streamed_as_of_tables_match_the_loaded_ones(csv_path, out_dir, monkeypatch):
+    monkeypatch.setattr(snapshot, 'STREAMING_THRESHOLD_BYTES', 0)
+    as_of = dt.date(2023, 3, 1)
+    tables = load_as_of_tables(as_of, csv_path, out_dir)
+
+    earlier = transactions_as_of(read_transactions_csv(csv_path), as_of)
+    assert_same_frame(tables['rfm'], compute_rfm(earlier, as_of))
+    assert_same_frame(tables['monthly_revenue'], monthly_revenue(earlier))
+
+
+def test_rfm_history_matches_each_date(csv_path):
+    transactions = read_transactions_csv(csv_path)
+    dates = [dt.date(2023, 2, 1), dt.date(2023, 4, 15), dt.date(2023, 6, 29)]
+    history = load_rfm_history(dates, csv_path)
+
+    assert sorted(history['AsOf'].unique()) == sorted(pd.to_datetime(dates))
+    for date in dates:
+        rows = history[history['AsOf'] == pd.Timestamp(date)].drop(columns='AsOf')
+        assert_same_frame(rows, compute_rfm(transactions_as_of(transactions, date), date))
+
+
+def test_ml_data_uses_only_purchases_up_to_the_as_of_date(csv_path, out_dir):
+    transactions = read_transactions_csv(csv_path)
+    as_of = dt.date(2023, 3, 1)
+    ml_data = load_ml_data(as_of, csv_path, out_dir)
+
+    earlier = transactions_as_of(transactions, as_of)
+    rfm = compute_rfm(earlier, as_of)[['CustomerID', 'Recency', 'Frequency', 'Monetary']]
+    assert_same_frame(ml_data, rfm.merge(customer_features(earlier), on='CustomerID'))
+
+
+def test_streamed_tables_match_the_loaded_ones(csv_path, out_dir):
+    build_snapshot(csv_path, out_dir, streaming=True)
+    streamed = load_tables(csv_path, out_dir)
+    expected = build_tables(read_transactions_csv(csv_path))
+    for name in expected:
+        assert_same_frame(streamed[name], expected[name])
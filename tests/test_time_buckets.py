@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from time_buckets import GRANULARITIES, aggregate_by_period, bucket_keys, bucket_labels, bucket_starts, period_ends
+
+DATES = pd.Series(pd.date_range('2022-12-25', '2024-01-07', freq='13h'))
+PANDAS_FREQ = {'D': 'D', 'W': 'W-SUN', 'M': 'M', 'Q': 'Q'}
+
+
+@pytest.mark.parametrize('granularity', list(GRANULARITIES))
+def test_buckets_start_where_pandas_periods_start(granularity):
+    starts = bucket_starts(bucket_keys(DATES, granularity), granularity)
+    expected = DATES.dt.to_period(PANDAS_FREQ[granularity]).dt.start_time.to_numpy(dtype='datetime64[D]')
+    np.testing.assert_array_equal(starts, expected)
+
+
+def test_labels():
+    dates = np.array(['2023-04-11', '2023-04-16'], dtype='datetime64[ns]')
+    assert list(bucket_labels(bucket_keys(dates, 'D'), 'D')) == ['2023-04-11', '2023-04-16']
+    assert list(bucket_labels(bucket_keys(dates, 'W'), 'W')) == ['2023-04-10', '2023-04-10']
+    assert list(bucket_labels(bucket_keys(dates, 'M'), 'M')) == ['2023-04', '2023-04']
+    assert list(bucket_labels(bucket_keys(dates, 'Q'), 'Q')) == ['2023-Q2', '2023-Q2']
+
+
+def test_unknown_granularity():
+    with pytest.raises(ValueError):
+        bucket_keys(DATES, 'Y')
+
+
+def test_period_ends_stop_at_the_end_date():
+    ends = period_ends(np.datetime64('2023-01-15'), np.datetime64('2023-03-10'), 'M')
+    assert list(ends.astype(str)) == ['2023-01-31', '2023-02-28', '2023-03-10']
+
+
+def test_aggregate_by_period_matches_string_grouping(transactions):
+    result = aggregate_by_period(transactions, 'PurchaseDate', 'M', label='Month',
+                                 Revenue=('TransactionAmount', 'sum'), Orders=('OrderID', 'count'))
+    expected = transactions.groupby(transactions['PurchaseDate'].dt.strftime('%Y-%m')).agg(
+        Revenue=('TransactionAmount', 'sum'), Orders=('OrderID', 'count'))
+    assert list(result['Month']) == list(expected.index)
+    np.testing.assert_allclose(result['Revenue'], expected['Revenue'])
+    np.testing.assert_array_equal(result['Orders'], expected['Orders'])
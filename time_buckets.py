@@ -0,0 +1,74 @@
+import numpy as np
+
+# Supported bucket sizes and their display names
+GRANULARITIES = {
+    'D': 'Daily',
+    'W': 'Weekly',
+    'M': 'Monthly',
+    'Q': 'Quarterly',
+}
+
+# 1970-01-01, day 0, was a Thursday; shifting by 3 days starts weeks on Monday
+WEEK_OFFSET_DAYS = 3
+
+
+def bucket_keys(dates, granularity='M'):
+    """Integer bucket key per date, counted from the 1970 epoch.
+
+    Days and months come straight from datetime64 unit casts, so no
+    per-row strings or Python date objects are created.
+    """
+    dates = np.asarray(dates, dtype='datetime64[ns]')
+    if granularity in ('D', 'W'):
+        days = dates.astype('datetime64[D]').astype(np.int64)
+        return days if granularity == 'D' else (days + WEEK_OFFSET_DAYS) // 7
+    months = dates.astype('datetime64[M]').astype(np.int64)
+    if granularity == 'M':
+        return months
+    if granularity == 'Q':
+        return months // 3
+    raise ValueError(f"Unknown granularity {granularity!r}; expected one of {list(GRANULARITIES)}")
+
+
+def bucket_starts(keys, granularity='M'):
+    """First day of each bucket as datetime64[D]."""
+    keys = np.asarray(keys, dtype=np.int64)
+    if granularity == 'D':
+        return keys.astype('datetime64[D]')
+    if granularity == 'W':
+        return (keys * 7 - WEEK_OFFSET_DAYS).astype('datetime64[D]')
+    if granularity == 'M':
+        return keys.astype('datetime64[M]').astype('datetime64[D]')
+    if granularity == 'Q':
+        return (keys * 3).astype('datetime64[M]').astype('datetime64[D]')
+    raise ValueError(f"Unknown granularity {granularity!r}; expected one of {list(GRANULARITIES)}")
+
+
+def period_ends(start, end, granularity='M'):
+    """Last day of every bucket from start to end, with the final one cut off at end."""
+    first, last = bucket_keys([start, end], granularity)
+    ends = bucket_starts(np.arange(first + 1, last + 2), granularity) - np.timedelta64(1, 'D')
+    ends[-1] = np.datetime64(end, 'D')
+    return ends
+
+
+def bucket_labels(keys, granularity='M'):
+    """Display labels for bucket keys: 2023-04-11, 2023-04-10 (week start), 2023-04 or 2023-Q2."""
+    keys = np.asarray(keys, dtype=np.int64)
+    if granularity == 'M':
+        return np.datetime_as_string(keys.astype('datetime64[M]'), unit='M')
+    if granularity == 'Q':
+        return np.array([f'{1970 + key // 4}-Q{key % 4 + 1}' for key in keys.tolist()], dtype=object)
+    return np.datetime_as_string(bucket_starts(keys, granularity), unit='D')
+
+
+def aggregate_by_period(frame, date_column, granularity='M', label='Period', **aggregations):
+    """Group frame by time bucket and aggregate with named aggregations.
+
+    The result has one row per non-empty bucket in time order, with the
+    bucket label in column label followed by the aggregations.
+    """
+    keys = bucket_keys(frame[date_column], granularity)
+    result = frame.groupby(keys).agg(**aggregations)
+    result.insert(0, label, bucket_labels(result.index.to_numpy(), granularity))
+    return result.reset_index(drop=True)